@@ -0,0 +1,3 @@
+"""
+Бенчмарки. Запуск из корня репозитория: python -m benchmarks.<имя>
+"""
@@ -0,0 +1,106 @@
+"""
+Проверка capi.ConversionsSink на локальной заглушке Conversions API.
+
+Заглушка (aiohttp-сервер на 127.0.0.1) отвечает 503 на первые запросы,
+затем принимает пачки. Сценарий:
+
+1. API недоступен: события уходят в spill-файл, sink останавливается.
+2. Новый sink (как после перезапуска) с тем же spill-файлом отправляет
+   и сохранённые, и новые события, пережив серию 503.
+
+Печатает стоимость track() и число запросов; код возврата 1, если
+какое-то событие потерялось.
+
+    python -m benchmarks.capi_standin --events 5000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+
+from capi import ConversionsSink
+
+
+class StandIn:
+    """Заглушка /{pixel_id}/events: первые fail_first запросов получают 503."""
+
+    def __init__(self, fail_first: int):
+        self.fail_first = fail_first
+        self.requests = 0
+        self.event_ids: set[str] = set()
+        self.max_batch = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self.requests <= self.fail_first:
+            return web.json_response({"error": "unavailable"}, status=503)
+        body = await request.json()
+        assert body["access_token"] == "token"
+        self.max_batch = max(self.max_batch, len(body["data"]))
+        self.event_ids.update(event["event_id"] for event in body["data"])
+        return web.json_response({"events_received": len(body["data"])})
+
+
+async def run(events: int, batch_size: int, fail_first: int) -> bool:
+    stand_in = StandIn(fail_first)
+    app = web.Application()
+    app.router.add_post("/{pixel_id}/events", stand_in.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        spill_path = os.path.join(tmp, "spill.jsonl")
+        half = events // 2
+
+        # 1. Неверный порт — API недоступен, всё уходит в spill-файл
+        sink = ConversionsSink("pixel", "token", "http://127.0.0.1:9", spill_path,
+                               batch_size=batch_size, flush_interval=0.05, timeout=1.0)
+        await sink.start()
+        started = time.perf_counter()
+        for i in range(half):
+            sink.track("Lead", i, event_id=f"e{i}")
+        track_us = (time.perf_counter() - started) / half * 1e6
+        await asyncio.sleep(0.2)
+        await sink.stop()
+        spilled = os.path.getsize(sink.spill_path) if os.path.exists(sink.spill_path) else 0
+
+        # 2. Перезапуск: заглушка доступна, но сначала отвечает 503
+        sink = ConversionsSink("pixel", "token", f"http://127.0.0.1:{port}", spill_path,
+                               batch_size=batch_size, flush_interval=0.05, timeout=1.0)
+        await sink.start()
+        for i in range(half, events):
+            sink.track("Purchase", i, {"currency": "USD", "value": 200}, event_id=f"e{i}")
+        deadline = time.monotonic() + 30
+        while len(stand_in.event_ids) < events and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        await sink.stop()
+
+    await runner.cleanup()
+    print(f"track(): {track_us:.2f} us/event")
+    print(f"spill file after outage: {spilled} bytes")
+    print(f"requests: {stand_in.requests} ({fail_first} rejected with 503), max batch {stand_in.max_batch}")
+    print(f"delivered: {len(stand_in.event_ids)}/{events}")
+    return len(stand_in.event_ids) == events and stand_in.max_batch <= batch_size
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--fail-first", type=int, default=3)
+    args = parser.parse_args()
+    if not await run(args.events, args.batch_size, args.fail_first):
+        print("FAILED: events were lost")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
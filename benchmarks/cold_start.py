@@ -0,0 +1,209 @@
+"""
+Холодный старт процесса вебхука (см. webapp.py).
+
+1. Профиль импорта: python -X importtime -c "import webapp" и то же для
+   bot — самые дорогие модули по суммарному времени (с вложенными).
+2. Старт: uvicorn с webapp:app запускается отдельным процессом во
+   временном каталоге, Bot API заменён заглушкой (TELEGRAM_API_SERVER).
+   Сразу после открытия порта отправляется /start, как Telegram
+   доставляет накопившиеся апдейты. Замеряется от запуска процесса: порт
+   открыт (/ отвечает), /ready отвечает 200, ответ на первый апдейт
+   пришёл в Bot API; затем задержка второго апдейта. Старт повторяется
+   на той же БД: схема уже актуальна, DDL пропускается.
+
+    python -m benchmarks.cold_start --runs 2 --pdf-mb 50
+
+Без /ready (старая версия) готовностью считается первый ответ /.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "123456:COLDSTART"
+USER_ID = 30_000_000
+IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def env(api_port: int) -> dict:
+    return {
+        **os.environ,
+        "PYTHONPATH": ROOT,
+        "TELEGRAM_BOT_TOKEN": TOKEN,
+        "ADMIN_IDS": "1",
+        "USDT_TRC20_WALLET": "test-trc20", "USDT_ERC20_WALLET": "test-erc20",
+        "BTC_WALLET": "test-btc", "ETH_WALLET": "test-eth",
+        "TELEGRAM_API_SERVER": f"http://127.0.0.1:{api_port}",
+        "TELEGRAM_API_LOCAL": "0",
+    }
+
+
+def import_profile(module: str, top: int):
+    """Самые дорогие модули при import module по данным -X importtime."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env(1), capture_output=True, text=True
+    )
+    rows = [
+        (int(self_us), int(total_us), len(indent) // 2, name)
+        for self_us, total_us, indent, name in IMPORTTIME.findall(result.stderr)
+    ]
+    total = next(total_us for _, total_us, _, name in reversed(rows) if name == module)
+    print(f"\nimport {module}: {total / 1000:.0f} ms")
+    print(f"  {'cumulative':>10} {'self':>8}  module")
+    for self_us, total_us, depth, name in sorted(rows, key=lambda row: -row[1])[1:top + 1]:
+        print(f"  {total_us / 1000:>8.0f}ms {self_us / 1000:>6.0f}ms  {'  ' * (depth - 1)}{name}")
+
+
+class BotApiStub:
+    """Bot API, который отвечает на всё и запоминает время первого sendMessage."""
+
+    def __init__(self):
+        self.sent: list[float] = []
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": {
+                "id": 123456, "is_bot": True, "first_name": "stub", "username": "stub_bot",
+            }})
+        if method == "sendMessage":
+            self.sent.append(time.perf_counter())
+        return web.json_response({"ok": True, "result": {
+            "message_id": len(self.sent), "date": int(time.time()), "chat": {"id": USER_ID, "type": "private"},
+        }})
+
+
+def start_update(n: int) -> dict:
+    user = {"id": USER_ID, "is_bot": False, "first_name": "cold"}
+    return {"update_id": n, "message": {
+        "message_id": n, "date": int(time.time()), "chat": {"id": USER_ID, "type": "private"},
+        "from": user, "text": "/start",
+    }}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for(predicate, timeout: float = 60):
+    """Ждать, пока predicate() (обычная функция или корутина) не вернёт истину."""
+    deadline = time.monotonic() + timeout
+    while True:
+        result = predicate()
+        if asyncio.iscoroutine(result):
+            result = await result
+        if result:
+            return
+        if time.monotonic() > deadline:
+            raise TimeoutError("process did not start")
+        await asyncio.sleep(0.005)
+
+
+async def one_start(workdir: str, stub: BotApiStub, api_port: int, web_port: int, update_id: int) -> dict:
+    base = f"http://127.0.0.1:{web_port}"
+    stub.sent.clear()
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-c", f"import uvicorn; uvicorn.run('webapp:app', port={web_port}, log_level='warning')"],
+        cwd=workdir, env=env(api_port), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    report = {}
+    try:
+        async with aiohttp.ClientSession() as session:
+            async def status(path: str) -> int | None:
+                try:
+                    async with session.get(base + path) as response:
+                        return response.status
+                except aiohttp.ClientError:
+                    return None
+
+            async def port_open() -> bool:
+                return await status("/") == 200
+
+            await wait_for(port_open)
+            report["port"] = time.perf_counter() - started
+
+            async def first_update():
+                async with session.post(base + "/telegram/webhook", json=start_update(update_id)) as response:
+                    return response.status
+
+            posted = asyncio.create_task(first_update())
+
+            async def is_ready() -> bool:
+                return await status("/ready") in (200, 404)
+
+            await wait_for(is_ready)
+            report["ready"] = time.perf_counter() - started
+            assert await posted == 200
+            await wait_for(lambda: stub.sent)
+            report["first_update"] = stub.sent[0] - started
+
+            async with session.get(base + "/ready") as response:
+                if response.status == 200:
+                    report["timings"] = (await response.json())["timings"]
+
+            sent = len(stub.sent)
+            posted_at = time.perf_counter()
+            async with session.post(base + "/telegram/webhook", json=start_update(update_id + 1)) as response:
+                assert response.status == 200
+            await wait_for(lambda: len(stub.sent) > sent)
+            report["warm_update"] = stub.sent[sent] - posted_at
+    finally:
+        proc.terminate()
+        proc.wait()
+    return report
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=2, help="стартов на одной БД")
+    parser.add_argument("--pdf-mb", type=int, default=50, help="размер каждого тестового PDF")
+    parser.add_argument("--top", type=int, default=12)
+    args = parser.parse_args()
+
+    import_profile("webapp", args.top)
+    import_profile("bot", args.top)
+
+    stub = BotApiStub()
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", stub.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    api_port = site._server.sockets[0].getsockname()[1]
+
+    print(f"\n{'run':<10} {'port open':>10} {'ready':>8} {'1st update':>11} {'warm update':>12}  warm-up stages")
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            os.makedirs(os.path.join(workdir, "data"))
+            for name in ("course1.pdf", "course2.pdf"):
+                with open(os.path.join(workdir, "data", name), "wb") as f:
+                    f.write(b"%PDF-1.4\n")
+                    f.write(os.urandom(args.pdf_mb * 1024 * 1024))
+            for run in range(args.runs):
+                report = await one_start(workdir, stub, api_port, free_port(), 1000 * (run + 1))
+                label = "fresh db" if run == 0 else f"restart {run}"
+                print(f"{label:<10} {report['port'] * 1000:>8.0f}ms {report['ready'] * 1000:>6.0f}ms"
+                      f" {report['first_update'] * 1000:>9.0f}ms {report['warm_update'] * 1000:>10.1f}ms  "
+                      + json.dumps(report.get("timings", {})))
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
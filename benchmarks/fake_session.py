@@ -0,0 +1,72 @@
+"""
+Фейковая сессия aiogram: вместо запросов к Telegram записывает вызовы API.
+"""
+
+import asyncio
+import itertools
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import Chat, Document, Message, PhotoSize, User
+
+
+class FakeSession(BaseSession):
+    """Отвечает правдоподобными объектами и считает вызовы по методам.
+
+    latency — искусственная задержка ответа в секундах (имитация сети).
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.uploads = 0
+        self._ids = itertools.count(1)
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[Any], timeout: int | None = None) -> Any:
+        name = method.__api_method__
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method.__returning__ is bool:
+            return True
+        if name == "getMe":
+            return User(id=bot.id, is_bot=True, first_name="bot", username="fake_bot")
+
+        n = next(self._ids)
+        chat_id = getattr(method, "chat_id", None) or 1
+        fields: dict[str, Any] = {}
+        if name == "sendDocument":
+            document = method.document
+            if not isinstance(document, str):
+                # Новая загрузка файла, а не повторная отправка по file_id
+                self.uploads += 1
+                document = f"file-{n}"
+            fields["document"] = Document(file_id=document, file_unique_id=document)
+        elif name == "sendPhoto":
+            fields["photo"] = [PhotoSize(file_id=str(method.photo), file_unique_id=str(n), width=1, height=1)]
+        else:
+            fields["text"] = getattr(method, "text", None)
+        message = Message(
+            message_id=n,
+            date=datetime.fromtimestamp(int(time.time())),
+            chat=Chat(id=chat_id, type="private"),
+            **fields,
+        )
+        return message.as_(bot)
+
+    async def stream_content(self, url: str, headers: dict | None = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True):
+        yield b""
+
+    async def close(self) -> None:
+        pass
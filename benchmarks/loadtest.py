@@ -0,0 +1,286 @@
+"""
+Нагрузочный прогон воронки покупки через настоящий диспетчер бота.
+
+Тысячи синтетических пользователей проходят шаги
+/start → buy_course → choose_currency → i_paid → receive_proof →
+cmd_confirm (от админа) → download_volume. Telegram заменён фейковой
+сессией (benchmarks/fake_session.py), БД — временный SQLite файл.
+Каждый шаг выполняется для всех пользователей параллельно, поэтому
+запросы к БД и вызовы API можно отнести к конкретному хендлеру.
+
+    python -m benchmarks.loadtest --users 2000
+    python -m benchmarks.loadtest --users 2000 --save-baseline baseline.json
+    python -m benchmarks.loadtest --users 2000 --baseline baseline.json
+
+С --baseline код возврата 1, если p95 хендлера, число запросов к БД
+или вызовов API на апдейт выросли сильнее допусков.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Значения по умолчанию для окружения без .env
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:LOADTEST")
+os.environ.setdefault("ADMIN_IDS", "1")
+for _wallet in ("USDT_TRC20_WALLET", "USDT_ERC20_WALLET", "BTC_WALLET", "ETH_WALLET"):
+    os.environ.setdefault(_wallet, f"test-{_wallet.lower()}")
+
+from aiogram.types import Update  # noqa: E402
+
+import catalog  # noqa: E402
+import config  # noqa: E402
+import storage  # noqa: E402
+from benchmarks.fake_session import FakeSession  # noqa: E402
+from middlewares import TelegramMetricsMiddleware  # noqa: E402
+from models import OrderStatus  # noqa: E402
+from ratelimit import TokenBucket, KeyedRateLimiter  # noqa: E402
+
+FIRST_USER_ID = 10_000_000
+ADMIN_ID = config.ADMIN_IDS[0]
+
+_update_ids = itertools.count(1)
+
+
+class QueryCounter:
+    """sqlite trace callback: считает выполненные выражения."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, statement: str):
+        self.count += 1
+
+
+def _user(tg_id: int) -> dict:
+    return {"id": tg_id, "is_bot": False, "first_name": f"user{tg_id}", "username": f"user{tg_id}"}
+
+
+def message_update(bot, tg_id: int, text: str) -> Update:
+    n = next(_update_ids)
+    return Update.model_validate({
+        "update_id": n,
+        "message": {
+            "message_id": n,
+            "date": int(time.time()),
+            "chat": {"id": tg_id, "type": "private"},
+            "from": _user(tg_id),
+            "text": text,
+        },
+    }, context={"bot": bot})
+
+
+def callback_update(bot, tg_id: int, data: str) -> Update:
+    n = next(_update_ids)
+    return Update.model_validate({
+        "update_id": n,
+        "callback_query": {
+            "id": str(n),
+            "chat_instance": str(tg_id),
+            "from": _user(tg_id),
+            "data": data,
+            "message": {
+                "message_id": n,
+                "date": int(time.time()),
+                "chat": {"id": tg_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "bot"},
+                "text": "menu",
+            },
+        },
+    }, context={"bot": bot})
+
+
+async def pending_order_ids(tg_ids: list[int]) -> dict[int, int]:
+    async with storage.get_pool().read() as db:
+        async with db.execute(
+            """SELECT u.tg_id, MAX(o.id) FROM orders o JOIN users u ON u.id = o.user_id
+               WHERE o.status = ? GROUP BY u.tg_id""",
+            (OrderStatus.WAITING_REVIEW,)
+        ) as cursor:
+            return {tg_id: order_id for tg_id, order_id in await cursor.fetchall()}
+
+
+async def outbox_backlog() -> int:
+    async with storage.get_pool().read() as db:
+        async with db.execute("SELECT COUNT(*) FROM outbox WHERE status IN ('pending', 'sending')") as cursor:
+            return (await cursor.fetchone())[0]
+
+
+async def run_phase(name: str, updates: list[Update], dp, bot, session: FakeSession,
+                    counter: QueryCounter, concurrency: int, drain_outbox: bool = False) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+
+    async def feed(update: Update):
+        async with semaphore:
+            started = time.perf_counter()
+            await dp.feed_update(bot, update)
+            latencies.append(time.perf_counter() - started)
+
+    queries_before = counter.count
+    calls_before = session.total_calls
+    uploads_before = session.uploads
+    started = time.perf_counter()
+    await asyncio.gather(*(feed(update) for update in updates))
+    elapsed = time.perf_counter() - started
+    # Отложенные записи (last_seen, FSM) сбрасываются здесь, чтобы попасть в счётчик своего шага
+    await storage.flush_last_seen()
+    await dp.storage.flush()
+    drain = 0.0
+    if drain_outbox:
+        # Доставка идёт воркерами outbox в фоне — её стоимость тоже относится к подтверждению
+        drain_started = time.perf_counter()
+        while await outbox_backlog():
+            await asyncio.sleep(0.05)
+        drain = time.perf_counter() - drain_started
+
+    q = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [latencies[0] * 1000] * 99
+    return {
+        "handler": name,
+        "updates": len(updates),
+        "seconds": elapsed,
+        "drain_seconds": drain,
+        "p50_ms": q[49] * 1000,
+        "p95_ms": q[94] * 1000,
+        "p99_ms": q[98] * 1000,
+        "queries_per_update": (counter.count - queries_before) / len(updates),
+        "api_calls_per_update": (session.total_calls - calls_before) / len(updates),
+        "uploads": session.uploads - uploads_before,
+    }
+
+
+async def run(users: int, concurrency: int) -> dict:
+    import bot as botmod
+
+    # Лог на каждый апдейт заметно искажает задержки
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+    session = FakeSession()
+    bot, dp = botmod.bot, botmod.dp
+    bot.session = session
+    # Как в продакшене: метрики Bot API включены
+    session.middleware(TelegramMetricsMiddleware())
+    # Harness меряет наш код, а не лимиты Telegram
+    botmod.outbox.global_limit = TokenBucket(1e9, 1e9)
+    botmod.outbox.chat_limit = KeyedRateLimiter(1e9, 1e9)
+
+    await storage.init_db()
+    # Outbox и остальные фоновые задачи — как в одиночном процессе
+    botmod.start_background_jobs(dp)
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    counter = QueryCounter()
+    await storage.get_pool().set_trace_callback(counter)
+
+    tg_ids = list(range(FIRST_USER_ID, FIRST_USER_ID + users))
+    phases = []
+    started = time.perf_counter()
+    try:
+        steps = [
+            ("cmd_start", lambda u: message_update(bot, u, "/start")),
+            ("buy_course", lambda u: callback_update(bot, u, "buy_course:1")),
+            ("choose_currency", lambda u: callback_update(bot, u, "cur_USDT_TRC20")),
+            ("i_paid", lambda u: callback_update(bot, u, "i_paid")),
+            ("receive_proof", lambda u: message_update(bot, u, f"tx{u:064d}")),
+        ]
+        for name, make in steps:
+            phases.append(await run_phase(name, [make(u) for u in tg_ids], dp, bot, session, counter, concurrency))
+
+        await storage.get_pool().set_trace_callback(None)
+        orders = await pending_order_ids(tg_ids)
+        await storage.get_pool().set_trace_callback(counter)
+        confirms = [message_update(bot, ADMIN_ID, f"/confirm {orders[u]} {u}") for u in tg_ids if u in orders]
+        phases.append(await run_phase("cmd_confirm", confirms, dp, bot, session, counter, concurrency, drain_outbox=True))
+
+        downloads = [callback_update(bot, u, "download_volume:1:1") for u in tg_ids]
+        phases.append(await run_phase("download_volume", downloads, dp, bot, session, counter, concurrency))
+    finally:
+        elapsed = time.perf_counter() - started
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await storage.close_db()
+
+    total_updates = sum(p["updates"] for p in phases)
+    return {
+        "users": users,
+        "updates": total_updates,
+        "seconds": elapsed,
+        "throughput": total_updates / elapsed,
+        "api_calls": dict(session.calls),
+        "handlers": {p["handler"]: p for p in phases},
+    }
+
+
+def print_report(report: dict):
+    print(f"{report['users']} users, {report['updates']} updates in {report['seconds']:.2f}s "
+          f"({report['throughput']:.0f} updates/s)")
+    header = f"{'handler':<18}{'updates':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'db/upd':>8}{'api/upd':>8}{'uploads':>8}"
+    print(header)
+    print("-" * len(header))
+    for p in report["handlers"].values():
+        print(f"{p['handler']:<18}{p['updates']:>8}{p['p50_ms']:>9.2f}{p['p95_ms']:>9.2f}{p['p99_ms']:>9.2f}"
+              f"{p['queries_per_update']:>8.2f}{p['api_calls_per_update']:>8.2f}{p['uploads']:>8}")
+    print("api calls:", ", ".join(f"{k}={v}" for k, v in sorted(report["api_calls"].items())))
+
+
+def compare(report: dict, baseline: dict, latency_tolerance: float, count_tolerance: float) -> list[str]:
+    """Сравнить с базовым отчётом; вернуть список регрессий."""
+    regressions = []
+    for name, base in baseline["handlers"].items():
+        current = report["handlers"].get(name)
+        if current is None:
+            regressions.append(f"{name}: missing from run")
+            continue
+        # Абсолютный запас 1 мс, чтобы не ловить шум на субмиллисекундных хендлерах
+        if current["p95_ms"] > base["p95_ms"] * (1 + latency_tolerance) + 1.0:
+            regressions.append(f"{name}: p95 {base['p95_ms']:.2f} -> {current['p95_ms']:.2f} ms")
+        for key in ("queries_per_update", "api_calls_per_update"):
+            if current[key] > base[key] * (1 + count_tolerance) + 0.01:
+                regressions.append(f"{name}: {key} {base[key]:.2f} -> {current[key]:.2f}")
+    if report["throughput"] < baseline["throughput"] * (1 - latency_tolerance):
+        regressions.append(f"throughput {baseline['throughput']:.0f} -> {report['throughput']:.0f} updates/s")
+    return regressions
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200, help="одновременно обрабатываемых апдейтов")
+    parser.add_argument("--baseline", help="JSON отчёт, с которым сравнивать")
+    parser.add_argument("--save-baseline", help="сохранить отчёт как базовый")
+    parser.add_argument("--latency-tolerance", type=float, default=0.5)
+    parser.add_argument("--count-tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.DB_PATH = os.path.join(tmp, "loadtest.db")
+        for course in config.COURSES.values():
+            for idx, volume in enumerate(course["volumes"]):
+                path = os.path.join(tmp, f"volume{idx}.pdf")
+                with open(path, "wb") as f:
+                    f.write(b"%PDF-1.4\n" + os.urandom(256 * 1024))
+                volume["pdf_path"] = path
+        catalog.reload_catalog()
+        report = await run(args.users, args.concurrency)
+
+    print_report(report)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.latency_tolerance, args.count_tolerance)
+        if regressions:
+            print("Regressions:")
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
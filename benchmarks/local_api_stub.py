@@ -0,0 +1,187 @@
+"""
+Проверка отправки томов через локальный Bot API сервер на заглушке.
+
+Заглушка (aiohttp-сервер на 127.0.0.1) отвечает на sendDocument как
+telegram-bot-api: multipart-загрузку больше 50 МБ отклоняет (лимит
+облачного API), а ссылку file:// принимает только в режиме --local и
+читает файл с диска сама. delivery.send_volume прогоняется дважды:
+
+1. облачный режим: том загружается multipart, большой том не проходит;
+2. локальный режим (TelegramAPIServer is_local=True): оба тома уходят
+   ссылкой на файл, тело запроса — сотни байт вместо мегабайт.
+
+Повторная отправка в обоих режимах идёт по сохранённому file_id.
+
+    python -m benchmarks.local_api_stub --small-mb 20 --large-mb 60
+
+Код возврата 1, если какой-то сценарий дал неверный результат.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from urllib.parse import unquote, urlparse
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramAPIError
+
+import delivery
+import storage
+from catalog import Volume
+
+TOKEN = "123456:STUB"
+UPLOAD_LIMIT = 50 * 1024 * 1024
+
+
+class StubServer:
+    """Минимальный telegram-bot-api: getMe и sendDocument."""
+
+    def __init__(self, local: bool):
+        self.local = local
+        self.bytes_received = 0
+        self.uploads = 0
+        self.by_path = 0
+        self.by_file_id = 0
+        self._ids = 0
+
+    def _ok(self, result: dict) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    def _error(self, code: int, description: str) -> web.Response:
+        return web.json_response({"ok": False, "error_code": code, "description": description}, status=code)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if method == "getMe":
+            return self._ok({"id": 123456, "is_bot": True, "first_name": "stub", "username": "stub_bot"})
+        if method != "sendDocument":
+            return self._error(404, "Not Found: method not found")
+
+        form = await request.post()
+        # aiogram шлёт multipart без Content-Length: считаем размер полей
+        sizes = {
+            name: len(value.file.read()) if isinstance(value, web.FileField) else len(value)
+            for name, value in form.items()
+        }
+        self.bytes_received += sum(sizes.values())
+        document = form["document"]
+        if document.startswith("attach://"):
+            size = sizes[document.removeprefix("attach://")]
+            if size > UPLOAD_LIMIT:
+                return self._error(413, "Request Entity Too Large")
+            self.uploads += 1
+            file_id = f"uploaded-{size}"
+        elif document.startswith("file://"):
+            if not self.local:
+                return self._error(400, "Bad Request: wrong remote file identifier specified: Wrong character in the string")
+            path = unquote(urlparse(document).path)
+            if not os.path.exists(path):
+                return self._error(400, "Bad Request: file not found")
+            self.by_path += 1
+            file_id = f"local-{os.path.getsize(path)}"
+        else:
+            self.by_file_id += 1
+            file_id = document
+
+        self._ids += 1
+        return self._ok({
+            "message_id": self._ids,
+            "date": int(time.time()),
+            "chat": {"id": int(form["chat_id"]), "type": "private"},
+            "document": {"file_id": file_id, "file_unique_id": file_id},
+            "caption": form.get("caption"),
+        })
+
+
+async def run_mode(local: bool, volumes: list[Volume]) -> tuple[StubServer, list[str]]:
+    stub = StubServer(local)
+    app = web.Application(client_max_size=2 * UPLOAD_LIMIT)
+    app.router.add_post("/bot{token}/{method}", stub.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    mode = "local" if local else "cloud"
+    api = TelegramAPIServer.from_base(f"http://127.0.0.1:{port}", is_local=local)
+    bot = Bot(TOKEN, session=AiohttpSession(api=api, timeout=120))
+    results = []
+    try:
+        for volume in volumes:
+            for attempt in ("first", "repeat"):
+                before = stub.bytes_received
+                started = time.perf_counter()
+                try:
+                    message = await delivery.send_volume(bot, 1, volume)
+                    outcome = message.document.file_id
+                except TelegramAPIError as e:
+                    outcome = f"error: {e.message}"
+                elapsed = (time.perf_counter() - started) * 1000
+                sent_kb = (stub.bytes_received - before) / 1024
+                print(f"{mode:<6} {volume.title:<10} {attempt:<7} {elapsed:>9.1f} ms {sent_kb:>12.1f} KB  {outcome}")
+                results.append(outcome)
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+    return stub, results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--small-mb", type=int, default=20)
+    parser.add_argument("--large-mb", type=int, default=60)
+    args = parser.parse_args()
+
+    errors = []
+
+    def expect(name: str, condition: bool):
+        if not condition:
+            errors.append(name)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.DB_PATH = os.path.join(tmp, "stub.db")
+        await storage.init_db()
+        volumes = []
+        for title, size_mb in (("small", args.small_mb), ("large", args.large_mb)):
+            path = os.path.join(tmp, f"{title}.pdf")
+            with open(path, "wb") as f:
+                f.write(b"%PDF-1.4\n")
+                f.truncate(size_mb * 1024 * 1024)
+            volumes.append(Volume(len(volumes) + 1, title, "", path, title))
+
+        print(f"{'mode':<6} {'volume':<10} {'send':<7} {'time':>12} {'request body':>15}  result")
+        try:
+            cloud, results = await run_mode(False, volumes)
+            expect("cloud: small volume uploaded once", cloud.uploads == 1 and not results[0].startswith("error"))
+            expect("cloud: repeat goes by file_id", results[1] == results[0])
+            expect("cloud: volume over 50 MB rejected", results[2].startswith("error"))
+
+            # Сбросить file_id облачного прогона, чтобы локальный тоже начал с первой отправки
+            delivery._file_ids.clear()
+            async with storage.get_pool().write() as db:
+                await db.execute("DELETE FROM file_ids")
+
+            local, results = await run_mode(True, volumes)
+            expect("local: no multipart uploads", local.uploads == 0)
+            expect("local: both volumes sent by path", local.by_path == 2)
+            expect("local: repeats go by file_id", local.by_file_id == 2 and results[1] == results[0])
+            expect("local: request bodies stay small", local.bytes_received < 64 * 1024)
+        finally:
+            await storage.close_db()
+
+    for name in errors:
+        print(f"FAIL {name}")
+    if errors:
+        sys.exit(1)
+    print("ok")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
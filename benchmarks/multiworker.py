@@ -0,0 +1,230 @@
+"""
+Масштабирование вебхука на несколько процессов (см. cluster.py).
+
+Для каждого числа процессов из --workers поднимаются N процессов с
+webapp.app на одном слушающем сокете (как uvicorn --workers N) и общей
+временной БД, Telegram заменён фейковой сессией. Клиент шлёт вебхуки от
+--users пользователей: /start → «Мои томы» → «О курсе» → «Назад»
+(апдейты одного чата — друг за другом), и ждёт, пока все апдейты будут
+обработаны.
+
+При нескольких процессах затем проверяется согласованность кэшей: доступ
+выдаётся напрямую в БД (как будто другим процессом), и повторное «Мои
+томы» должно сразу показать купленный курс, хотя отказ уже лежит в кэше.
+
+    python -m benchmarks.multiworker --workers 1,2,4 --users 500
+
+Код возврата 1, если обработаны не все апдейты или кэш остался устаревшим.
+"""
+
+import argparse
+import asyncio
+import itertools
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+ADMIN_ID = 1
+FIRST_USER_ID = 20_000_000
+OWNED_SCREEN = "У тебя есть доступ"
+STEPS = ("/start", "my_courses_list", "course_info:1", "back_to_menu")
+
+
+def serve(workers: int, sock: socket.socket, db_path: str, latency: float, processed, owned_shown):
+    """Процесс вебхука: настоящий webapp.app с фейковой сессией Telegram."""
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:MULTIWORKER")
+    os.environ.setdefault("ADMIN_IDS", str(ADMIN_ID))
+    for wallet in ("USDT_TRC20_WALLET", "USDT_ERC20_WALLET", "BTC_WALLET", "ETH_WALLET"):
+        os.environ.setdefault(wallet, f"test-{wallet.lower()}")
+    os.environ["CLUSTER_LEASE_TTL"] = "3"
+
+    import logging
+
+    import uvicorn
+
+    import storage
+    storage.DB_PATH = db_path
+
+    import bot as botmod
+    from benchmarks.fake_session import FakeSession
+    from ratelimit import TokenBucket, KeyedRateLimiter
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+    class CountingSession(FakeSession):
+        async def make_request(self, bot, method, timeout=None):
+            if OWNED_SCREEN in (getattr(method, "text", None) or ""):
+                with owned_shown.get_lock():
+                    owned_shown.value += 1
+            return await super().make_request(bot, method, timeout)
+
+    botmod.bot.session = CountingSession(latency)
+    botmod.outbox.global_limit = TokenBucket(1e9, 1e9)
+    botmod.outbox.chat_limit = KeyedRateLimiter(1e9, 1e9)
+
+    async def count_processed(handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            with processed.get_lock():
+                processed.value += 1
+
+    botmod.dp.update.outer_middleware(count_processed)
+
+    import webapp
+    logging.getLogger().setLevel(logging.WARNING)
+    server = uvicorn.Server(uvicorn.Config(webapp.app, log_level="warning", lifespan="on"))
+    asyncio.run(server.serve(sockets=[sock]))
+
+
+_update_ids = itertools.count(1)
+
+
+def _user(tg_id: int) -> dict:
+    return {"id": tg_id, "is_bot": False, "first_name": f"user{tg_id}", "username": f"user{tg_id}"}
+
+
+def make_update(tg_id: int, step: str) -> dict:
+    n = next(_update_ids)
+    chat = {"id": tg_id, "type": "private"}
+    if step.startswith("/"):
+        return {"update_id": n, "message": {
+            "message_id": n, "date": int(time.time()), "chat": chat, "from": _user(tg_id), "text": step,
+        }}
+    return {"update_id": n, "callback_query": {
+        "id": str(n), "chat_instance": str(tg_id), "from": _user(tg_id), "data": step,
+        "message": {
+            "message_id": n, "date": int(time.time()), "chat": chat,
+            "from": {"id": 1, "is_bot": True, "first_name": "bot"}, "text": "menu",
+        },
+    }}
+
+
+async def wait_for(predicate, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.02)
+    return True
+
+
+async def drive(url: str, tg_ids: list[int], steps: tuple[str, ...], concurrency: int, processed, expected: int) -> float:
+    """Отправить шаги для каждого пользователя и дождаться обработки. Возвращает секунды."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession() as session:
+        async def user_flow(tg_id: int):
+            async with semaphore:
+                for step in steps:
+                    async with session.post(url, json=make_update(tg_id, step)) as response:
+                        assert response.status == 200, await response.text()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user_flow(tg_id) for tg_id in tg_ids))
+        await wait_for(lambda: processed.value >= expected, 60)
+        return time.perf_counter() - started
+
+
+def grant_access_directly(db_path: str, tg_ids: list[int]):
+    """Выдать доступ мимо процессов вебхука (как сделал бы другой процесс)."""
+    db = sqlite3.connect(db_path, timeout=30)
+    with db:
+        db.executemany(
+            "INSERT OR IGNORE INTO access (user_id, course_id, volumes_count) SELECT id, 1, 2 FROM users WHERE tg_id = ?",
+            [(tg_id,) for tg_id in tg_ids]
+        )
+    db.close()
+
+
+async def run(workers: int, users: int, concurrency: int, latency: float) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    processed = ctx.Value("q", 0)
+    owned_shown = ctx.Value("q", 0)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "multiworker.db")
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("127.0.0.1", 0))
+        sock.listen(1024)
+        port = sock.getsockname()[1]
+        url = f"http://127.0.0.1:{port}/telegram/webhook"
+        procs = [ctx.Process(target=serve, args=(workers, sock, db_path, latency, processed, owned_shown))
+                 for _ in range(workers)]
+        for proc in procs:
+            proc.start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async def ready() -> bool:
+                    try:
+                        async with session.get(f"http://127.0.0.1:{port}/") as response:
+                            return response.status == 200
+                    except aiohttp.ClientError:
+                        return False
+                while not await ready():
+                    await asyncio.sleep(0.1)
+            # Дать всем процессам занять слоты
+            await asyncio.sleep(1.0)
+
+            tg_ids = list(range(FIRST_USER_ID, FIRST_USER_ID + users))
+            total = users * len(STEPS)
+            elapsed = await drive(url, tg_ids, STEPS, concurrency, processed, total)
+            done = processed.value
+
+            # Отказ в доступе уже в кэше — выдаём доступ в обход и спрашиваем снова.
+            # Один процесс — единственный писатель, там такой сценарий невозможен.
+            checked = tg_ids[:min(100, users)] if workers > 1 else []
+            fresh = 0
+            if checked:
+                grant_access_directly(db_path, checked)
+                await asyncio.sleep(0.5)
+                before = owned_shown.value
+                await drive(url, checked, ("my_courses_list",), concurrency, processed, done + len(checked))
+                fresh = owned_shown.value - before
+        finally:
+            for proc in procs:
+                proc.terminate()
+            for proc in procs:
+                proc.join()
+            sock.close()
+    return {
+        "workers": workers, "updates": total, "processed": done, "seconds": elapsed,
+        "throughput": done / elapsed, "coherent": fresh, "checked": len(checked),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="числа процессов через запятую")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100, help="одновременно активных пользователей")
+    parser.add_argument("--latency", type=float, default=0.005, help="задержка фейкового Telegram API, с")
+    args = parser.parse_args()
+
+    print(f"cpu cores: {os.cpu_count()}")
+    print("workers  updates  seconds  updates/s  speedup  coherent")
+    base = None
+    failed = False
+    for workers in [int(n) for n in args.workers.split(",")]:
+        report = await run(workers, args.users, args.concurrency, args.latency)
+        base = base or report["throughput"]
+        print(f"{workers:>7}  {report['processed']:>7}  {report['seconds']:>7.2f}  {report['throughput']:>9.0f}"
+              f"  {report['throughput'] / base:>6.2f}x  "
+              + (f"{report['coherent']}/{report['checked']}" if report["checked"] else "-"))
+        if report["processed"] < report["updates"] or report["coherent"] < report["checked"]:
+            failed = True
+    if failed:
+        print("FAILED: lost updates or stale cache")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,142 @@
+"""
+Проверка PaymentWatcher на FakeIndexer и временной БД.
+
+Сценарии: совпадение по tx hash, по сумме в окне времени, неоднозначная
+сумма (два одинаковых заказа), повторное использование перевода, перевод
+раньше заказа, кошелёк без открытых заказов (индексатор не вызывается),
+старый перевод с присланным хэшем, хэш заказа, подтверждённого вручную,
+и перевод, который мог оплатить заказ, подтверждённый вручную по чеку.
+В конце — сверка пачки из --orders заказов за один проход.
+
+    python -m benchmarks.payment_matching --orders 2000
+
+Код возврата 1, если какой-то сценарий дал неверный результат.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import storage
+from models import Order, OrderStatus
+from payments import FakeIndexer, PaymentWatcher, Transfer
+
+WALLETS = {"USDT_TRC20": "trc20-wallet", "USDT_ERC20": "erc20-wallet", "BTC": "btc-wallet", "ETH": "eth-wallet"}
+
+
+async def new_order(tg_id: int, currency: str, tx_hash: str | None = None, wallet: str | None = None,
+                    proof: str | None = None) -> int:
+    user = await storage.get_or_create_user(tg_id, None)
+    order = await storage.create_order(user["id"], 1, 200, currency, wallet or WALLETS[currency])
+    if tx_hash or proof:
+        await storage.update_order_status(order.id, OrderStatus.WAITING_REVIEW, tx_hash, proof)
+    return order.id
+
+
+async def run(orders_count: int) -> list[str]:
+    errors = []
+    indexer = FakeIndexer()
+    paid: list[tuple[int, int]] = []
+
+    async def on_paid(order: Order, tg_id: int):
+        paid.append((order.id, tg_id))
+
+    def fulfillment():
+        return {1: [{"kind": "message", "text": "paid"}]}, {1: 2}
+
+    watcher = PaymentWatcher(indexer, WALLETS, on_paid, fulfillment, tolerance=0.5, window_hours=24)
+    now = time.time()
+
+    def expect(name: str, condition: bool):
+        print(f"{'ok  ' if condition else 'FAIL'} {name}")
+        if not condition:
+            errors.append(name)
+
+    by_hash = await new_order(1, "USDT_TRC20", "0xABC123")
+    by_amount = await new_order(2, "USDT_ERC20")
+    ambiguous = [await new_order(3, "BTC"), await new_order(4, "BTC")]
+    indexer.add(Transfer("abc123", "USDT_TRC20", WALLETS["USDT_TRC20"], 200.0, now))
+    indexer.add(Transfer("erc-1", "USDT_ERC20", WALLETS["USDT_ERC20"], 199.8, now + 60))
+    indexer.add(Transfer("btc-1", "BTC", WALLETS["BTC"], 200.0, now + 60))
+    # Перевод за сутки до заказа не засчитывается по сумме
+    early = await new_order(5, "ETH")
+    indexer.add(Transfer("eth-old", "ETH", WALLETS["ETH"], 200.0, now - 86400))
+
+    await watcher.check()
+    expect("tx hash match", (by_hash, 1) in paid)
+    # Доступ и доставка записаны вместе со статусом, до on_paid
+    user = await storage.get_or_create_user(1, None)
+    expect("access granted with the payment", await storage.user_has_access(user["id"], 1))
+    async with storage.get_pool().read() as db:
+        async with db.execute("SELECT COUNT(*) FROM outbox WHERE chat_id = 1") as cursor:
+            expect("delivery queued with the payment", (await cursor.fetchone())[0] == 1)
+    expect("amount match in window", (by_amount, 2) in paid)
+    expect("ambiguous amount is left for review", not any(order_id in ambiguous for order_id, _ in paid))
+    expect("transfer before order is ignored", not any(order_id == early for order_id, _ in paid))
+
+    # Тот же перевод не засчитывается новому заказу с тем же tx hash
+    reused = await new_order(6, "USDT_TRC20", "abc123")
+    await watcher.check()
+    expect("transfer is used once", not any(order_id == reused for order_id, _ in paid))
+
+    calls = indexer.calls
+    await watcher.check()
+    expect("only wallets with open orders hit the indexer", indexer.calls - calls == 3)
+
+    # Хэш старого перевода (за сутки до заказа) не засчитывается
+    old_hash = await new_order(7, "ETH", "eth-old")
+    # Хэш из заказа, подтверждённого вручную, не оплачивает другой заказ
+    manual = await new_order(8, "USDT_ERC20", "0xMANUAL")
+    await storage.approve_orders([manual], {}, {})
+    copycat = await new_order(9, "USDT_ERC20", "manual")
+    indexer.add(Transfer("0xmanual", "USDT_ERC20", WALLETS["USDT_ERC20"], 200.0, now + 120))
+    await watcher.check()
+    expect("old transfer hash is not accepted", not any(order_id == old_hash for order_id, _ in paid))
+    expect("hash of a manually approved order is not reused", not any(order_id == copycat for order_id, _ in paid))
+
+    # Заказ подтверждён вручную по чеку, перевод за него приходит позже:
+    # по сумме он не должен оплатить другой открытый заказ той же цены
+    wallet = "trc20-manual"
+    by_receipt = await new_order(10, "USDT_TRC20", wallet=wallet, proof="photo")
+    await storage.approve_orders([by_receipt], {}, {})
+    other = await new_order(11, "USDT_TRC20", wallet=wallet)
+    indexer.add(Transfer("receipt-1", "USDT_TRC20", wallet, 200.0, now + 180))
+    manual_watcher = PaymentWatcher(indexer, {"USDT_TRC20": wallet}, on_paid, fulfillment, tolerance=0.5, window_hours=24)
+    await manual_watcher.check()
+    expect("amount match competes with manually paid orders", not any(order_id == other for order_id, _ in paid))
+
+    # Пачка: заказы с tx hash на одном кошельке, один запрос к индексатору
+    indexer.transfers.clear()
+    paid.clear()
+    for i in range(orders_count):
+        await new_order(1000 + i, "USDT_TRC20", f"batch-{i}")
+        indexer.add(Transfer(f"batch-{i}", "USDT_TRC20", WALLETS["USDT_TRC20"], 200.0, now + i))
+    calls = indexer.calls
+    started = time.perf_counter()
+    await watcher.check()
+    elapsed = time.perf_counter() - started
+    expect(f"batch of {orders_count} orders paid", len(paid) == orders_count)
+    print(f"batch: {orders_count} orders in {elapsed:.2f}s, {indexer.calls - calls} indexer calls")
+    return errors
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=2000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.DB_PATH = os.path.join(tmp, "payments.db")
+        await storage.init_db()
+        try:
+            errors = await run(args.orders)
+        finally:
+            await storage.close_db()
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
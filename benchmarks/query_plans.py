@@ -0,0 +1,85 @@
+"""
+Проверка планов запросов горячего пути (storage.HOT_QUERIES).
+
+Создаёт БД через init_db (все миграции), заполняет orders большим числом
+строк и для каждого запроса проверяет EXPLAIN QUERY PLAN: таблица не
+сканируется целиком, нет сортировки во временном B-дереве и используется
+ожидаемый индекс. Код возврата 1, если хотя бы один план деградировал.
+
+    python -m benchmarks.query_plans --orders 2000000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import storage
+from models import OrderStatus
+
+STATUSES = (OrderStatus.PAID, OrderStatus.CANCELED, OrderStatus.PENDING, OrderStatus.WAITING_REVIEW)
+# Незавершённых заказов мало: sweeper отменяет их по TTL
+STATUS_WEIGHTS = (60, 39.8, 0.1, 0.1)
+
+
+def fill_orders(path: str, orders: int, users: int):
+    conn = sqlite3.connect(path)
+    rnd = random.Random(1)
+    # Пользователи нужны запросам с JOIN users, иначе LIMIT никогда не набирается
+    conn.executemany("INSERT INTO users (id, tg_id) VALUES (?, ?)", [(i, i) for i in range(1, users + 1)])
+    batch = 100_000
+    for start in range(0, orders, batch):
+        conn.executemany(
+            "INSERT INTO orders (user_id, course_id, amount_usdt, currency, status, wallet_address) VALUES (?, 1, 200, 'USDT_TRC20', ?, 'w')",
+            [(rnd.randint(1, users), rnd.choices(STATUSES, STATUS_WEIGHTS)[0]) for _ in range(min(batch, orders - start))]
+        )
+    conn.commit()
+    conn.close()
+
+
+def check_plans(path: str) -> list[str]:
+    conn = sqlite3.connect(path)
+    failures = []
+    for name, (sql, params, index) in storage.HOT_QUERIES.items():
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        started = time.perf_counter()
+        for _ in range(100):
+            conn.execute(sql, params).fetchall()
+        per_query_us = (time.perf_counter() - started) / 100 * 1e6
+        # Перебор CONSTANT ROW и json_each (списка id из параметра) — не скан таблицы
+        scans = [step for step in plan if step.startswith("SCAN ")
+                 and "CONSTANT ROW" not in step and "json_each VIRTUAL TABLE" not in step]
+        sorts = [step for step in plan if "TEMP B-TREE" in step]
+        ok = not scans and not sorts and any(index in step for step in plan)
+        print(f"{'ok  ' if ok else 'FAIL'} {name:<22}{per_query_us:>9.1f} us  " + " | ".join(plan))
+        if not ok:
+            failures.append(name)
+    conn.close()
+    return failures
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.DB_PATH = os.path.join(tmp, "plans.db")
+        await storage.init_db()
+        await storage.close_db()
+        fill_orders(storage.DB_PATH, args.orders, args.users)
+        print(f"orders: {args.orders} rows")
+        failures = check_plans(storage.DB_PATH)
+
+    if failures:
+        print(f"Query plan regression: {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
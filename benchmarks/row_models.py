@@ -0,0 +1,145 @@
+"""
+Стоимость строки заказа: модели models.py против словарей.
+
+1. Построение записи из строки sqlite (кортежа): прежний словарь,
+   собранный вручную, dict(zip(...)), старый класс Order с
+   datetime.utcnow() в конструкторе и Order._make(row). Печатает время
+   на строку (timeit) и память на строку в списке из --rows записей
+   (tracemalloc).
+2. Выборка доступов для --users пользователей из временной БД: по
+   запросу на пользователя против одного get_access_for_users.
+
+    python -m benchmarks.row_models --rows 100000 --users 1000
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import timeit
+import tracemalloc
+from datetime import datetime
+
+import storage
+from models import Access, Order, OrderStatus
+
+ROW = (1, 42, 1, 200.0, "USDT_TRC20", "pending", "wallet", None, None, "2024-05-01 12:00:00", None)
+
+
+def legacy_dict(row: tuple) -> dict:
+    # Как get_last_pending_order до моделей
+    return {
+        "id": row[0],
+        "user_id": row[1],
+        "course_id": row[2],
+        "amount_usdt": row[3],
+        "currency": row[4],
+        "status": row[5],
+        "wallet_address": row[6],
+        "tx_hash": row[7],
+        "proof_file_id": row[8],
+        "created_at": row[9],
+        "paid_at": row[10],
+    }
+
+
+def zip_dict(row: tuple) -> dict:
+    return dict(zip(Order._fields, row))
+
+
+class LegacyOrder:
+    """Прежний models.Order: __dict__ и datetime.utcnow() в конструкторе."""
+
+    def __init__(self, id, user_id, course_id, amount_usdt, currency, wallet_address, status=OrderStatus.PENDING):
+        self.id = id
+        self.user_id = user_id
+        self.course_id = course_id
+        self.amount_usdt = amount_usdt
+        self.currency = currency
+        self.status = status
+        self.wallet_address = wallet_address
+        self.tx_hash = None
+        self.proof_file_id = None
+        self.created_at = datetime.utcnow()
+        self.paid_at = None
+
+
+def legacy_object(row: tuple) -> LegacyOrder:
+    return LegacyOrder(row[0], row[1], row[2], row[3], row[4], row[6], row[5])
+
+
+BUILDERS = {
+    "dict literal": legacy_dict,
+    "dict(zip)": zip_dict,
+    "class + utcnow": legacy_object,
+    "Order._make": Order._make,
+}
+
+
+def bytes_per_row(build, rows: list[tuple]) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    records = [build(row) for row in rows]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del records
+    return (after - before) / len(rows)
+
+
+async def batch_fetch(users: int, courses_per_user: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.DB_PATH = os.path.join(tmp, "rows.db")
+        await storage.init_db()
+        try:
+            async with storage.get_pool().write() as db:
+                await db.executemany("INSERT INTO users (tg_id) VALUES (?)", [(i,) for i in range(users)])
+                await db.executemany(
+                    "INSERT INTO access (user_id, course_id) VALUES (?, ?)",
+                    [(user_id, course_id) for user_id in range(1, users + 1) for course_id in range(1, courses_per_user + 1)]
+                )
+            user_ids = list(range(1, users + 1))
+
+            started = time.perf_counter()
+            one_by_one = 0
+            for user_id in user_ids:
+                async with storage.get_pool().read() as db:
+                    async with db.execute(
+                        f"SELECT {storage.ACCESS_COLUMNS} FROM access WHERE user_id = ?", (user_id,)
+                    ) as cursor:
+                        rows = await cursor.fetchall()
+                        one_by_one += len([dict(zip(Access._fields, row)) for row in rows])
+            per_user = time.perf_counter() - started
+
+            started = time.perf_counter()
+            batched = len(await storage.get_access_for_users(user_ids))
+            batch = time.perf_counter() - started
+        finally:
+            await storage.close_db()
+    print(f"\n{users} users x {courses_per_user} courses")
+    print(f"  query per user + dicts   {per_user * 1000:8.1f} ms  ({one_by_one} rows)")
+    print(f"  get_access_for_users     {batch * 1000:8.1f} ms  ({batched} rows)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--courses-per-user", type=int, default=2)
+    args = parser.parse_args()
+
+    rows = [(i, *ROW[1:]) for i in range(args.rows)]
+    print(f"{'builder':<16} {'ns/row':>8} {'bytes/row':>10}")
+    for name, build in BUILDERS.items():
+        seconds = min(timeit.repeat(lambda: build(ROW), number=100_000, repeat=5)) / 100_000
+        print(f"{name:<16} {seconds * 1e9:>8.0f} {bytes_per_row(build, rows):>10.0f}")
+
+    order = Order._make(ROW)
+    seconds = min(timeit.repeat(lambda: order.created, number=100_000, repeat=5)) / 100_000
+    print(f"\nOrder.created (lazy parse on access): {seconds * 1e9:.0f} ns")
+
+    asyncio.run(batch_fetch(args.users, args.courses_per_user))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Задержка БД на одно обновление: соединение на каждый вызов против пула.
+
+Каждый симулированный пользователь обрабатывает несколько «обновлений»,
+как это делают хендлеры бота: get_or_create_user + user_has_access,
+а часть обновлений ещё создаёт заказ и ищет последний незавершённый.
+
+    python -m benchmarks.storage_latency --users 300 --updates 5
+"""
+
+import argparse
+import asyncio
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+import aiosqlite
+
+import storage
+from models import OrderStatus
+
+
+# Прежняя реализация: новое соединение (и фоновый поток) на каждый вызов
+
+async def legacy_get_or_create_user(tg_id: int, username: str | None) -> dict:
+    async with aiosqlite.connect(storage.DB_PATH) as db:
+        cursor = await db.execute("SELECT id FROM users WHERE tg_id = ?", (tg_id,))
+        row = await cursor.fetchone()
+        if row:
+            await db.execute(
+                "UPDATE users SET last_seen = ? WHERE tg_id = ?",
+                (datetime.utcnow().isoformat(), tg_id)
+            )
+            await db.commit()
+            return {"id": row[0], "tg_id": tg_id, "username": username}
+        cursor = await db.execute(
+            "INSERT INTO users (tg_id, username) VALUES (?, ?)",
+            (tg_id, username)
+        )
+        await db.commit()
+        return {"id": cursor.lastrowid, "tg_id": tg_id, "username": username}
+
+
+async def legacy_user_has_access(user_id: int, course_id: int) -> bool:
+    async with aiosqlite.connect(storage.DB_PATH) as db:
+        cursor = await db.execute(
+            "SELECT id FROM access WHERE user_id = ? AND course_id = ?",
+            (user_id, course_id)
+        )
+        return await cursor.fetchone() is not None
+
+
+async def legacy_create_order(user_id: int, course_id: int, amount_usdt: float, currency: str, wallet_address: str) -> dict:
+    async with aiosqlite.connect(storage.DB_PATH) as db:
+        cursor = await db.execute(
+            """INSERT INTO orders (user_id, course_id, amount_usdt, currency, wallet_address, status)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (user_id, course_id, amount_usdt, currency, wallet_address, OrderStatus.PENDING)
+        )
+        await db.commit()
+        return {"id": cursor.lastrowid}
+
+
+async def legacy_get_last_pending_order(user_id: int):
+    async with aiosqlite.connect(storage.DB_PATH) as db:
+        cursor = await db.execute(
+            """SELECT id FROM orders WHERE user_id = ? AND status IN (?, ?, ?)
+               ORDER BY id DESC LIMIT 1""",
+            (user_id, OrderStatus.PENDING, OrderStatus.WAITING_PROOF, OrderStatus.WAITING_REVIEW)
+        )
+        return await cursor.fetchone()
+
+
+LEGACY = (legacy_get_or_create_user, legacy_user_has_access, legacy_create_order, legacy_get_last_pending_order)
+
+
+def pooled():
+    return (storage.get_or_create_user, storage.user_has_access, storage.create_order, storage.get_last_pending_order)
+
+
+async def simulate_user(tg_id: int, updates: int, api, latencies: list, errors: list):
+    get_user, has_access, new_order, last_order = api
+    for n in range(updates):
+        started = time.perf_counter()
+        try:
+            user = await get_user(tg_id, f"user{tg_id}")
+            await has_access(user["id"], 1)
+            if n % 3 == 2:
+                await new_order(user["id"], 1, 200, "USDT_TRC20", "wallet")
+                await last_order(user["id"])
+        except sqlite3.OperationalError:
+            # "database is locked": конкурирующие писатели не дождались блокировки
+            errors.append(tg_id)
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+async def run(label: str, api, users: int, updates: int) -> dict:
+    latencies: list[float] = []
+    errors: list[int] = []
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate_user(tg_id, updates, api, latencies, errors) for tg_id in range(1, users + 1)))
+    elapsed = time.perf_counter() - started
+    q = statistics.quantiles(latencies, n=100)
+    return {
+        "label": label,
+        "updates/s": len(latencies) / elapsed,
+        "p50 ms": q[49] * 1000,
+        "p95 ms": q[94] * 1000,
+        "p99 ms": q[98] * 1000,
+        "errors": len(errors),
+    }
+
+
+def print_report(results: list[dict]):
+    header = f"{'mode':<10}{'updates/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['label']:<10}{r['updates/s']:>12.0f}{r['p50 ms']:>10.2f}"
+            f"{r['p95 ms']:>10.2f}{r['p99 ms']:>10.2f}{r['errors']:>8}"
+        )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--updates", type=int, default=5)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        # Схема создаётся один раз, обе реализации работают с одинаковыми данными
+        storage.DB_PATH = os.path.join(tmp, "legacy.db")
+        await storage.init_db()
+        await storage.close_db()
+        results.append(await run("legacy", LEGACY, args.users, args.updates))
+
+        storage.DB_PATH = os.path.join(tmp, "pooled.db")
+        await storage.init_db()
+        try:
+            results.append(await run("pooled", pooled(), args.users, args.updates))
+        finally:
+            await storage.close_db()
+
+    print(f"{args.users} concurrent users x {args.updates} updates")
+    print_report(results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
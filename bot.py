@@ -7,32 +7,68 @@ import logging
 from datetime import datetime
 
 from aiogram import Bot, Dispatcher, F
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup
 from aiogram.filters import CommandStart, Command
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 
 from config import (
-    TELEGRAM_BOT_TOKEN, ADMIN_IDS, COURSES, 
-    USDT_TRC20_WALLET, USDT_ERC20_WALLET, BTC_WALLET, ETH_WALLET
+    TELEGRAM_BOT_TOKEN, TELEGRAM_API_SERVER, TELEGRAM_API_LOCAL, ADMIN_IDS,
+    USDT_TRC20_WALLET, USDT_ERC20_WALLET, BTC_WALLET, ETH_WALLET,
+    PAYMENT_INDEXER, PAYMENT_POLL_INTERVAL, PAYMENT_AMOUNT_TOLERANCE, PAYMENT_MATCH_WINDOW_HOURS,
+    OUTBOX_WORKERS, TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE,
+    ORDER_TTL_HOURS, ORDER_ARCHIVE_AFTER_DAYS, ORDER_SWEEP_INTERVAL,
+    THROTTLE_RATE, THROTTLE_BURST,
+    META_PIXEL_ID, META_ACCESS_TOKEN, META_CAPI_URL, META_CAPI_BATCH_SIZE, META_CAPI_FLUSH_INTERVAL, META_CAPI_SPILL_PATH
 )
 from storage import (
     init_db, 
+    close_db,
     get_or_create_user, 
     create_order, 
     get_last_pending_order, 
-    grant_access, 
     user_has_access,
+    get_access_for_users,
     update_order_status,
-    confirm_payment
+    cancel_pending_order,
+    get_funnel_stats,
+    get_review_page,
+    get_review_order,
+    approve_orders,
+    reject_order,
+    publish_change
 )
-from models import OrderStatus
+from models import OrderStatus, Order, ReviewOrder
+from delivery import send_volume
+from fsm_storage import SQLiteStorage
+from outbox import Outbox, course_delivery_payloads
+from sweeper import OrderSweeper
+from broadcast import Broadcaster
+from capi import ConversionsSink
+from catalog import Catalog, get_catalog, reload_catalog
+from payments import PaymentWatcher, load_indexer
+from review import (
+    REVIEW_PAGE_SIZE, FROM_NOTIFICATION,
+    render_review_page, tx_hash_html, order_actions_kb, parse_review_data, toggle_selection, selected_order_ids
+)
+from middlewares import ThrottlingMiddleware, HandlerMetricsMiddleware, TelegramMetricsMiddleware
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Сколько уведомлений админам отправляется одновременно
+ADMIN_NOTIFY_CONCURRENCY = 10
+# Покупателю, чей чек отклонён в /review
+REJECTED_NOTICE = "❌ Оплата не подтверждена. Если это ошибка — напиши в поддержку и приложи чек."
+# Сколько последних дней /stats показывает по дням (не больше)
+STATS_MAX_DAYS = 90
+# /confirm подтверждает любой неоплаченный заказ, в том числе отменённый по TTL (оплата пришла поздно)
+CONFIRMABLE_STATUSES = (OrderStatus.PENDING, OrderStatus.WAITING_PROOF, OrderStatus.WAITING_REVIEW, OrderStatus.CANCELED)
+
 
 class BuyStates(StatesGroup):
     CHOOSING_CURRENCY = State()
@@ -40,146 +76,158 @@ class BuyStates(StatesGroup):
     WAITING_PROOF = State()
 
 
-def get_main_menu_kb() -> InlineKeyboardMarkup:
-    kb = [
-        [InlineKeyboardButton(text="🛍️ Купить Эскортопедию", callback_data="buy_course")],
-        [InlineKeyboardButton(text="📚 Мои томы", callback_data="my_courses_list")],
-        [InlineKeyboardButton(text="📖 О курсе", callback_data="courses_info")],
-        [InlineKeyboardButton(text="💬 Поддержка", url="https://t.me/your_support")],
-    ]
-    return InlineKeyboardMarkup(inline_keyboard=kb)
-
-
-def get_currency_kb() -> InlineKeyboardMarkup:
-    kb = [
-        [InlineKeyboardButton(text="USDT TRC20", callback_data="cur_USDT_TRC20"), InlineKeyboardButton(text="USDT ERC20", callback_data="cur_USDT_ERC20")],
-        [InlineKeyboardButton(text="BTC", callback_data="cur_BTC"), InlineKeyboardButton(text="ETH", callback_data="cur_ETH")],
-        [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_order")],
-    ]
-    return InlineKeyboardMarkup(inline_keyboard=kb)
-
-
-def get_payment_actions_kb() -> InlineKeyboardMarkup:
-    kb = [
-        [InlineKeyboardButton(text="💡 Как купить крипту?", callback_data="how_to_buy_crypto")],
-        [InlineKeyboardButton(text="✅ Я оплатил(а)", callback_data="i_paid")],
-        [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_order")],
-    ]
-    return InlineKeyboardMarkup(inline_keyboard=kb)
-
-
 # Handlers (без декораторов!)
 
 async def cmd_start(message: Message, state: FSMContext):
     await get_or_create_user(message.from_user.id, message.from_user.username)
-    text = (
-        "Привет! 👋\n\n"
-        "Добро пожаловать в <b>Эскортопедию</b> — твой полный гайд по сфере!\n\n"
-        "Здесь ты найдёшь:\n"
-        "• 💡 Гайды и фишки для новичков (Том 1)\n"
-        "• 📈 Продвинутые стратегии заработка (Том 2)\n"
-        "• 🛡️ Советы по безопасности и маркетингу\n\n"
-        "<b>Стоимость: 200 USDT за оба тома</b> 💰"
-    )
+    conversions.track("Lead", message.from_user.id)
     await state.clear()
-    await message.answer(text, reply_markup=get_main_menu_kb())
+    screen = get_catalog().main_menu
+    await message.answer(screen.text, reply_markup=screen.reply_markup)
 
 
 async def courses_info(callback: CallbackQuery):
-    course_info = COURSES[1]
-    text = f"<b>📖 {course_info['name']}</b>\n\n💵 <b>Цена: {course_info['price']} USDT</b>\n\n<b>Содержание:</b>\n\n"
-    for idx, volume in enumerate(course_info["volumes"], 1):
-        text += f"<b>📕 {volume['title']}</b>\n{volume['description']}\n\n"
-    text += "Нажми «Купить Эскортопедию» чтобы начать."
-    await callback.message.edit_text(text, reply_markup=get_main_menu_kb())
+    catalog = get_catalog()
+    if len(catalog.courses) == 1:
+        screen = catalog.course_info[catalog.default_course_id]
+    else:
+        screen = catalog.catalog_list
+    await callback.message.edit_text(screen.text, reply_markup=screen.reply_markup)
+    await callback.answer()
+
+
+async def course_info(callback: CallbackQuery):
+    catalog = get_catalog()
+    course_id = catalog.course_id_from(callback.data)
+    if course_id is None:
+        await callback.answer("Курс не найден.", show_alert=True)
+        return
+    screen = catalog.course_info[course_id]
+    await callback.message.edit_text(screen.text, reply_markup=screen.reply_markup)
     await callback.answer()
 
 
+async def _owned_course_ids(user_id: int, catalog: Catalog) -> tuple[int, ...]:
+    # Один запрос на все курсы вместо user_has_access на каждый курс каталога
+    owned = {access.course_id for access in await get_access_for_users([user_id])}
+    return tuple([course_id for course_id in catalog.courses if course_id in owned])
+
+
 async def my_courses_list(callback: CallbackQuery):
+    catalog = get_catalog()
     user = await get_or_create_user(callback.from_user.id, callback.from_user.username)
-    has_access = await user_has_access(user["id"], 1)  # ← ПРАВИЛЬНО (user["id"])
+    owned = await _owned_course_ids(user["id"], catalog)
+    if not owned:
+        screen = catalog.no_access
+    elif len(owned) == 1:
+        screen = catalog.owned[owned[0]]
+    else:
+        screen = catalog.owned_list(owned)
+    await callback.message.edit_text(screen.text, reply_markup=screen.reply_markup)
+    await callback.answer()
 
-    if not has_access:
-        text = "У тебя ещё нет доступа. Нажми «Купить Эскортопедию»!"
-        await callback.message.edit_text(text, reply_markup=get_main_menu_kb())
-        await callback.answer()
-        return
 
-    course_info = COURSES[1]
-    text = f"<b>✅ У тебя есть доступ!</b>\n\n<b>{course_info['name']}</b>\n\n"
-    kb = []
-    for idx, volume in enumerate(course_info["volumes"], 1):
-        text += f"✅ {volume['title']}\n"
-        kb.append([InlineKeyboardButton(text=f"📥 {volume['title']}", callback_data=f"download_volume_{idx}")])
-    kb.append([InlineKeyboardButton(text="📚 Оба тома", callback_data="download_all_volumes")])
-    kb.append([InlineKeyboardButton(text="← Назад", callback_data="back_to_menu")])
-    reply_kb = InlineKeyboardMarkup(inline_keyboard=kb)
-    await callback.message.edit_text(text, reply_markup=reply_kb)
+async def my_course(callback: CallbackQuery):
+    catalog = get_catalog()
+    course_id = catalog.course_id_from(callback.data)
+    if await _accessible_course_id(callback, course_id) is None:
+        await callback.answer("Нет доступа.", show_alert=True)
+        return
+    screen = catalog.owned[course_id]
+    await callback.message.edit_text(screen.text, reply_markup=screen.reply_markup)
     await callback.answer()
 
 
+async def _accessible_course_id(callback: CallbackQuery, course_id: int | None) -> int | None:
+    """course_id, если покупатель владеет курсом; иначе None."""
+    if course_id is None:
+        return None
+    user = await get_or_create_user(callback.from_user.id, callback.from_user.username)
+    return course_id if await user_has_access(user["id"], course_id) else None
+
+
 async def download_volume(callback: CallbackQuery):
-    volume_idx = int(callback.data.split("_")[-1]) - 1
-    course_info = COURSES[1]
-    if volume_idx >= len(course_info["volumes"]):
-        await callback.answer("Том не найден.", show_alert=True)
+    catalog = get_catalog()
+    # download_volume:<course_id>:<n> или старое download_volume_<n>
+    if ":" in callback.data:
+        course_id = catalog.course_id_from(callback.data)
+        volume_no = callback.data.rsplit(":", 1)[-1]
+    else:
+        course_id = catalog.default_course_id
+        volume_no = callback.data.rsplit("_", 1)[-1]
+    course_id = await _accessible_course_id(callback, course_id)
+    volumes = catalog.courses[course_id].volumes if course_id is not None else ()
+    volume_idx = int(volume_no) - 1 if volume_no.isdigit() else -1
+    if not 0 <= volume_idx < len(volumes):
+        await callback.answer("Нет доступа.", show_alert=True)
         return
-    volume = course_info["volumes"][volume_idx]
     try:
-        pdf = FSInputFile(volume["pdf_path"])
-        await callback.message.answer_document(pdf, caption=f"📕 <b>{volume['title']}</b>")
+        await send_volume(callback.bot, callback.message.chat.id, volumes[volume_idx])
         await callback.answer("✅ Том отправлен!")
     except Exception as e:
         await callback.answer(f"❌ Ошибка: {e}", show_alert=True)
 
 
 async def download_all_volumes(callback: CallbackQuery):
-    course_info = COURSES[1]
-    for volume in course_info["volumes"]:
+    catalog = get_catalog()
+    course_id = await _accessible_course_id(callback, catalog.course_id_from(callback.data))
+    if course_id is None:
+        await callback.answer("Нет доступа.", show_alert=True)
+        return
+    for volume in catalog.courses[course_id].volumes:
         try:
-            pdf = FSInputFile(volume["pdf_path"])
-            await callback.message.answer_document(pdf, caption=f"📕 <b>{volume['title']}</b>")
+            await send_volume(callback.bot, callback.message.chat.id, volume)
         except Exception as e:
             await callback.answer(f"❌ Ошибка: {e}", show_alert=True)
             return
-    await callback.answer("✅ Оба тома отправлены!")
+    await callback.answer("✅ Все тома отправлены!")
 
 
 async def back_to_menu(callback: CallbackQuery, state: FSMContext):
     await state.clear()
-    text = "Привет! 👋\n\nДобро пожаловать в <b>Эскортопедию</b>"
-    await callback.message.edit_text(text, reply_markup=get_main_menu_kb())
+    screen = get_catalog().main_menu
+    await callback.message.edit_text(screen.text, reply_markup=screen.reply_markup)
     await callback.answer()
 
 
 async def buy_course(callback: CallbackQuery, state: FSMContext):
+    catalog = get_catalog()
+    course_id = catalog.course_id_from(callback.data)
+    if course_id is None:
+        await callback.answer("Курс не найден.", show_alert=True)
+        return
     user = await get_or_create_user(callback.from_user.id, callback.from_user.username)
-    has_access = await user_has_access(user["id"], 1)  # ← ПРАВИЛЬНО
+    has_access = await user_has_access(user["id"], course_id)
     if has_access:
         await callback.answer("У тебя уже есть доступ ✅", show_alert=True)
         return
-    course_info = COURSES[1]
-    text = f"<b>🎓 {course_info['name']}</b>\n\n💵 <b>{course_info['price']} USDT</b>\n\nВыбери валюту:"
-    await state.update_data(course_id=1)
+    screen = catalog.choose_currency[course_id]
+    await state.update_data(course_id=course_id)
     await state.set_state(BuyStates.CHOOSING_CURRENCY)
-    await callback.message.edit_text(text, reply_markup=get_currency_kb())
+    await callback.message.edit_text(screen.text, reply_markup=screen.reply_markup)
     await callback.answer()
 
 
 async def choose_currency(callback: CallbackQuery, state: FSMContext):
+    catalog = get_catalog()
     currency_code = callback.data.split("_", 1)[1]
-    wallet_map = {"USDT_TRC20": USDT_TRC20_WALLET, "USDT_ERC20": USDT_ERC20_WALLET, "BTC": BTC_WALLET, "ETH": ETH_WALLET}
-    wallet_address = wallet_map.get(currency_code)
-    if not wallet_address:
+    state_data = await state.get_data()
+    course_id = state_data.get("course_id", catalog.default_course_id)
+    screen = catalog.payment.get((course_id, currency_code))
+    if screen is None:
         await callback.answer("Недоступно", show_alert=True)
         return
-    course_info = COURSES[1]
+    course = catalog.courses[course_id]
     user = await get_or_create_user(callback.from_user.id, callback.from_user.username)
-    order = await create_order(user["id"], 1, course_info["price"], currency_code, wallet_address)
-    await state.update_data(order_id=order["id"])
-    text = f"<b>💳 Оплата</b>\n\n📊 {course_info['price']} USDT\n\n📍 Адрес:\n<code>{wallet_address}</code>\n\n⚠️ Проверь адрес и сеть!"
+    order = await create_order(user["id"], course_id, course.price, currency_code, catalog.wallets[currency_code])
+    await state.update_data(order_id=order.id)
+    conversions.track(
+        "InitiateCheckout", callback.from_user.id,
+        {"currency": "USD", "value": course.price, "content_ids": [str(course_id)], "order_id": str(order.id)},
+        event_id=f"checkout:{order.id}"
+    )
     await state.set_state(BuyStates.WAITING_PAYMENT)
-    await callback.message.edit_text(text, reply_markup=get_payment_actions_kb())
+    await callback.message.edit_text(screen.text, reply_markup=screen.reply_markup)
     await callback.answer()
 
 
@@ -196,8 +244,27 @@ async def i_paid(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-async def receive_proof(message: Message, state: FSMContext):
-    state_data = await state.get_data()
+async def notify_admins(bot: Bot, text: str, photo: str | None = None, document: str | None = None,
+                        reply_markup: InlineKeyboardMarkup | None = None):
+    """Разослать уведомление всем админам параллельно (одно сообщение на админа)."""
+    semaphore = asyncio.Semaphore(ADMIN_NOTIFY_CONCURRENCY)
+
+    async def send(admin_id: int):
+        async with semaphore:
+            if photo:
+                await bot.send_photo(admin_id, photo, caption=text, reply_markup=reply_markup)
+            elif document:
+                await bot.send_document(admin_id, document, caption=text, reply_markup=reply_markup)
+            else:
+                await bot.send_message(admin_id, text, reply_markup=reply_markup)
+
+    results = await asyncio.gather(*(send(admin_id) for admin_id in ADMIN_IDS), return_exceptions=True)
+    for admin_id, result in zip(ADMIN_IDS, results):
+        if isinstance(result, Exception):
+            logger.warning("Failed to notify admin %s: %s", admin_id, result)
+
+
+async def receive_proof(message: Message, state: FSMContext, bot: Bot):
     user = await get_or_create_user(message.from_user.id, message.from_user.username)
     order = await get_last_pending_order(user["id"])
     if not order:
@@ -205,33 +272,34 @@ async def receive_proof(message: Message, state: FSMContext):
         await state.clear()
         return
     
-    proof_file_id = None
+    photo_id = None
+    document_id = None
     tx_hash = None
     if message.photo:
-        proof_file_id = message.photo[-1].file_id
+        photo_id = message.photo[-1].file_id
     elif message.document:
-        proof_file_id = message.document.file_id
+        document_id = message.document.file_id
     elif message.text:
         tx_hash = message.text.strip()
     
-    await update_order_status(order["id"], OrderStatus.WAITING_REVIEW, tx_hash, proof_file_id)
+    await update_order_status(order.id, OrderStatus.WAITING_REVIEW, tx_hash, photo_id or document_id)
     
-    course_info = COURSES[1]
-    bot = Bot(token=TELEGRAM_BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-    for admin_id in ADMIN_IDS:
-        text = f"🔔 <b>НОВАЯ ОПЛАТА</b>\n\n📚 {course_info['name']}\n👤 @{message.from_user.username or message.from_user.id}\n💵 {course_info['price']} USDT\n"
-        if tx_hash:
-            text += f"\n🔗 TXID: <code>{tx_hash}</code>\n"
-        text += f"\n✅ /confirm {order['id']} {message.from_user.id}"
-        await bot.send_message(admin_id, text)
-        if proof_file_id:
-            await bot.send_photo(admin_id, proof_file_id)
+    course = get_catalog().courses.get(order.course_id)
+    course_name = course.name if course else f"Курс #{order.course_id}"
+    text = f"🔔 <b>НОВАЯ ОПЛАТА</b>\n\n📚 {course_name}\n👤 @{message.from_user.username or message.from_user.id}\n💵 {order.amount_usdt} USDT\n"
+    if tx_hash:
+        text += f"\n🔗 TXID: {tx_hash_html(tx_hash)}\n"
+    text += f"\n✅ /confirm {order.id} {message.from_user.id}\n🧾 Очередь: /review"
+    await notify_admins(bot, text, photo=photo_id, document=document_id, reply_markup=order_actions_kb(order.id))
     
     await state.clear()
     await message.answer("✅ Чек получен!")
 
 
 async def cancel_order(callback: CallbackQuery, state: FSMContext):
+    state_data = await state.get_data()
+    if state_data.get("order_id"):
+        await cancel_pending_order(state_data["order_id"])
     await state.clear()
     await callback.message.edit_text("❌ Отменено.")
     await callback.answer()
@@ -251,64 +319,294 @@ async def cmd_confirm(message: Message):
         await message.answer("Числа!")
         return
     
-    await confirm_payment(order_id)
-    user = await get_or_create_user(user_tg_id, None)
-    await grant_access(user["id"], 1, volumes_count=2)
-    
-    course_info = COURSES[1]
-    bot = Bot(token=TELEGRAM_BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
+    # Статус, доступ и доставка — одной транзакцией; покупатель — владелец заказа
+    orders = await approve_reviewed_orders([order_id], CONFIRMABLE_STATUSES)
+    if not orders:
+        await message.answer(f"ℹ️ Заказ #{order_id} не найден или уже подтверждён.")
+        return
+    text = f"✅ Заказ #{order_id} готов! Тома отправляются."
+    if orders[0].tg_id != user_tg_id:
+        text += f"\n⚠️ Заказ оформлен пользователем {orders[0].tg_id}, а не {user_tg_id} — тома ушли ему."
+    await message.answer(text)
+
+
+def track_purchase(order: Order | ReviewOrder, user_tg_id: int):
+    conversions.track(
+        "Purchase", user_tg_id,
+        {"currency": "USD", "value": order.amount_usdt, "content_ids": [str(order.course_id)],
+         "order_id": str(order.id)},
+        event_id=f"purchase:{order.id}"
+    )
+
+
+async def on_chain_payment(order: Order, user_tg_id: int):
+    """Заказ оплачен переводом, найденным PaymentWatcher (доступ и доставка уже записаны)."""
+    outbox.notify()
+    track_purchase(order, user_tg_id)
+    await notify_admins(
+        bot,
+        f"🤖 Заказ #{order.id} оплачен автоматически\n"
+        f"💵 {order.amount_usdt} USDT ({order.currency})\n🔗 {tx_hash_html(order.tx_hash)}"
+    )
+
+
+def course_fulfillment() -> tuple[dict[int, list[dict]], dict[int, int]]:
+    """Задания доставки и число томов по course_id для подтверждения оплаты одной транзакцией."""
+    catalog = get_catalog()
+    return (
+        {course_id: course_delivery_payloads(course_id) for course_id in catalog.courses},
+        {course_id: len(course.volumes) for course_id, course in catalog.courses.items()},
+    )
+
+
+async def approve_reviewed_orders(order_ids: list[int],
+                                  statuses: tuple[str, ...] = (OrderStatus.WAITING_REVIEW,)) -> list[ReviewOrder]:
+    """Подтвердить заказы одной транзакцией (статус, доступы, задания доставки); доставку ведёт outbox."""
+    orders = await approve_orders(order_ids, *course_fulfillment(), statuses)
+    if orders:
+        outbox.notify()
+    for order in orders:
+        track_purchase(order, order.tg_id)
+    return orders
+
+
+async def _review_page(after_id: int) -> tuple[str, InlineKeyboardMarkup]:
+    orders, total = await get_review_page(after_id, REVIEW_PAGE_SIZE + 1)
+    return render_review_page(orders[:REVIEW_PAGE_SIZE], total, after_id, len(orders) > REVIEW_PAGE_SIZE, get_catalog())
+
+
+async def cmd_review(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    text, reply_markup = await _review_page(0)
+    await message.answer(text, reply_markup=reply_markup)
+
+
+async def review_callback(callback: CallbackQuery, bot: Bot):
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer()
+        return
+    action, order_id, after_id = parse_review_data(callback.data)
+    message = callback.message
+
+    if action == "sel":
+        await message.edit_reply_markup(reply_markup=toggle_selection(message.reply_markup, order_id))
+        await callback.answer()
+        return
+    if action == "proof":
+        order = await get_review_order(order_id)
+        if order is None or not order.proof_file_id:
+            await callback.answer("Заказ уже обработан.", show_alert=True)
+            return
+        caption = f"🧾 Заказ #{order_id}"
+        try:
+            await bot.send_photo(callback.from_user.id, order.proof_file_id, caption=caption)
+        except TelegramBadRequest:
+            # Чек мог прийти документом
+            await bot.send_document(callback.from_user.id, order.proof_file_id, caption=caption)
+        await callback.answer()
+        return
+
+    if action == "ok":
+        approved = await approve_reviewed_orders([order_id])
+        notice = f"✅ Заказ #{order_id} подтверждён" if approved else "ℹ️ Заказ уже обработан"
+    elif action == "no":
+        rejected = await reject_order(order_id, REJECTED_NOTICE)
+        if rejected:
+            outbox.notify()
+        notice = f"❌ Заказ #{order_id} отклонён" if rejected else "ℹ️ Заказ уже обработан"
+    elif action == "bulk":
+        selected = selected_order_ids(message.reply_markup)
+        if not selected:
+            await callback.answer("Ничего не выбрано.", show_alert=True)
+            return
+        approved = await approve_reviewed_orders(selected)
+        notice = f"✅ Подтверждено: {len(approved)} из {len(selected)}"
+    else:
+        notice = None
+
     try:
-        for volume in course_info["volumes"]:
-            pdf = FSInputFile(volume["pdf_path"])
-            await bot.send_document(chat_id=user_tg_id, document=pdf, caption=f"📕 <b>{volume['title']}</b>")
-        await bot.send_message(chat_id=user_tg_id, text="🎉 <b>Оплата подтверждена!</b>\n\n✅ Том 1\n✅ Том 2")
-    except Exception as e:
-        await message.answer(f"❌ {e}")
+        if after_id == FROM_NOTIFICATION:
+            # Уведомление о новой оплате: просто убрать кнопки
+            await message.edit_reply_markup(reply_markup=None)
+        else:
+            text, reply_markup = await _review_page(after_id)
+            await message.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        # "message is not modified" — страница уже актуальна; остальное — ошибка отрисовки
+        if "message is not modified" in e.message:
+            logger.debug("Review page not updated: %s", e)
+        else:
+            logger.warning("Failed to render review page: %s", e)
+    await callback.answer(notice)
+
+
+def _percent(part: int, whole: int) -> str:
+    return f"{part / whole * 100:.1f}%" if whole else "—"
+
+
+def format_funnel_stats(stats: dict) -> str:
+    """Текст ответа /stats."""
+    totals = stats["totals"]
+    lines = [
+        "📊 <b>Воронка (всё время)</b>",
+        f"Старт: {totals['started']}",
+        f"Выбрали валюту: {totals['chose_currency']} ({_percent(totals['chose_currency'], totals['started'])})",
+        f"Отправили чек: {totals['sent_proof']} ({_percent(totals['sent_proof'], totals['chose_currency'])})",
+        f"Оплатили: {totals['paid']} ({_percent(totals['paid'], totals['sent_proof'])})",
+        f"Конверсия старт → оплата: {_percent(totals['paid'], totals['started'])}",
+        "",
+        "💰 <b>Выручка</b>",
+    ]
+    lines += [f"{currency}: {amount:g} USDT" for currency, amount in sorted(stats["revenue"].items())] or ["—"]
+    lines += ["", "📅 <b>По дням</b> (старт / валюта / чек / оплата)"]
+    lines += [
+        f"{row['day']}: {row['started']} / {row['chose_currency']} / {row['sent_proof']} / {row['paid']}"
+        for row in stats["daily"]
+    ] or ["—"]
+    return "\n".join(lines)
+
+
+async def cmd_stats(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    parts = message.text.strip().split()
+    days = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 7
+    stats = await get_funnel_stats(min(max(days, 1), STATS_MAX_DAYS))
+    await message.answer(format_funnel_stats(stats))
+
+
+async def cmd_broadcast(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    # html_text сохраняет форматирование админа
+    parts = message.html_text.split(maxsplit=1)
+    if len(parts) != 2:
+        await message.answer("Формат: /broadcast <текст>")
+        return
+    broadcast_id = await broadcaster.create(parts[1], message.from_user.id)
+    await message.answer(f"📣 Рассылка #{broadcast_id} запущена. Остановить: /broadcast_stop {broadcast_id}")
+
+
+async def cmd_broadcast_stop(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    parts = message.text.strip().split()
+    if len(parts) != 2 or not parts[1].isdigit():
+        await message.answer("Формат: /broadcast_stop <id>")
         return
-    await message.answer(f"✅ Заказ #{order_id} готов!")
+    if await broadcaster.cancel(int(parts[1])):
+        await message.answer(f"⏹ Рассылка #{parts[1]} остановлена.")
+    else:
+        await message.answer(f"ℹ️ Рассылка #{parts[1]} не найдена или уже завершена.")
 
 
 async def my_books_cmd(message: Message):
+    catalog = get_catalog()
     user = await get_or_create_user(message.from_user.id, message.from_user.username)
-    has_access = await user_has_access(user["id"], 1)
-    if not has_access:
+    owned = await _owned_course_ids(user["id"], catalog)
+    if not owned:
         await message.answer("❌ Нет доступа.")
         return
-    course_info = COURSES[1]
-    kb = []
-    for idx, volume in enumerate(course_info["volumes"], 1):
-        kb.append([InlineKeyboardButton(text=f"📥 {volume['title']}", callback_data=f"download_volume_{idx}")])
-    kb.append([InlineKeyboardButton(text="📚 Оба", callback_data="download_all_volumes")])
-    reply_kb = InlineKeyboardMarkup(inline_keyboard=kb)
-    await message.answer("📚 Твои томы:", reply_markup=reply_kb)
+    for course_id in owned:
+        screen = catalog.books[course_id]
+        await message.answer(screen.text, reply_markup=screen.reply_markup)
 
 
-async def main():
-    await init_db()
-    
-    bot = Bot(
-        token=TELEGRAM_BOT_TOKEN,
-        default=DefaultBotProperties(parse_mode="HTML")
-    )
-    dp = Dispatcher(storage=MemoryStorage())
-    
-    # Регистрируем handlers
+async def cmd_reload_catalog(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    try:
+        catalog = await asyncio.to_thread(reload_catalog)
+    except Exception as e:
+        logger.exception("Catalog reload failed")
+        await message.answer(f"❌ Каталог не перезагружен, работает прежний: {e}")
+        return
+    # Остальные процессы вебхука перечитают каталог по журналу изменений
+    await publish_change("catalog")
+    await message.answer(f"✅ Каталог перезагружен: {len(catalog.courses)} курс(ов).")
+
+
+def register_handlers(dp: Dispatcher):
+    """Регистрация хендлеров (без декораторов, общая для polling и вебхука)."""
+    dp.callback_query.outer_middleware(ThrottlingMiddleware(rate=THROTTLE_RATE, burst=THROTTLE_BURST, exempt_ids=ADMIN_IDS))
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+
     dp.message.register(cmd_start, CommandStart())
     dp.callback_query.register(courses_info, F.data == "courses_info")
+    dp.callback_query.register(course_info, F.data.startswith("course_info:"))
     dp.callback_query.register(my_courses_list, F.data == "my_courses_list")
-    dp.callback_query.register(download_volume, F.data.startswith("download_volume_"))
-    dp.callback_query.register(download_all_volumes, F.data == "download_all_volumes")
+    dp.callback_query.register(my_course, F.data.startswith("my_course:"))
+    # Префиксы без ":" ловят и кнопки старого формата (download_volume_1, buy_course)
+    dp.callback_query.register(download_volume, F.data.startswith("download_volume"))
+    dp.callback_query.register(download_all_volumes, F.data.startswith("download_all"))
     dp.callback_query.register(back_to_menu, F.data == "back_to_menu")
-    dp.callback_query.register(buy_course, F.data == "buy_course")
+    dp.callback_query.register(buy_course, F.data.startswith("buy_course"))
     dp.callback_query.register(choose_currency, BuyStates.CHOOSING_CURRENCY, F.data.startswith("cur_"))
     dp.callback_query.register(how_to_buy_crypto, BuyStates.WAITING_PAYMENT, F.data == "how_to_buy_crypto")
     dp.callback_query.register(i_paid, BuyStates.WAITING_PAYMENT, F.data == "i_paid")
     dp.message.register(receive_proof, BuyStates.WAITING_PROOF)
     dp.callback_query.register(cancel_order, F.data == "cancel_order")
     dp.message.register(cmd_confirm, Command("confirm"))
+    dp.message.register(cmd_review, Command("review"))
+    dp.callback_query.register(review_callback, F.data.startswith("rv:"))
+    dp.message.register(cmd_stats, Command("stats"))
+    dp.message.register(cmd_broadcast, Command("broadcast"))
+    dp.message.register(cmd_broadcast_stop, Command("broadcast_stop"))
     dp.message.register(my_books_cmd, Command("my_books"))
-    
-    await dp.start_polling(bot)
+    dp.message.register(cmd_reload_catalog, Command("reload_catalog"))
+
+
+bot = Bot(
+    token=TELEGRAM_BOT_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_SERVER, is_local=TELEGRAM_API_LOCAL))
+    if TELEGRAM_API_SERVER else None,
+    default=DefaultBotProperties(parse_mode="HTML")
+)
+bot.session.middleware(TelegramMetricsMiddleware())
+dp = Dispatcher(storage=SQLiteStorage())
+register_handlers(dp)
+outbox = Outbox(bot, workers=OUTBOX_WORKERS, global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE)
+sweeper = OrderSweeper(ORDER_TTL_HOURS, ORDER_ARCHIVE_AFTER_DAYS, interval=ORDER_SWEEP_INTERVAL)
+broadcaster = Broadcaster(bot, outbox.global_limit)
+# Фоновые задачи. В одном процессе (polling или вебхук) запускаются вместе с диспетчером
+# (start_background_jobs), при нескольких процессах вебхука — только в процессе-лидере (см. cluster.py)
+background_jobs = [outbox, sweeper, broadcaster]
+# Без META_PIXEL_ID/META_ACCESS_TOKEN track() ничего не делает
+conversions = ConversionsSink(
+    META_PIXEL_ID, META_ACCESS_TOKEN, META_CAPI_URL, META_CAPI_SPILL_PATH,
+    batch_size=META_CAPI_BATCH_SIZE, flush_interval=META_CAPI_FLUSH_INTERVAL
+)
+dp.startup.register(conversions.start)
+dp.shutdown.register(conversions.stop)
+# Без PAYMENT_INDEXER оплаты подтверждаются только вручную (/confirm)
+if PAYMENT_INDEXER:
+    payment_watcher = PaymentWatcher(
+        load_indexer(PAYMENT_INDEXER),
+        {"USDT_TRC20": USDT_TRC20_WALLET, "USDT_ERC20": USDT_ERC20_WALLET, "BTC": BTC_WALLET, "ETH": ETH_WALLET},
+        on_chain_payment,
+        course_fulfillment,
+        interval=PAYMENT_POLL_INTERVAL, tolerance=PAYMENT_AMOUNT_TOLERANCE, window_hours=PAYMENT_MATCH_WINDOW_HOURS
+    )
+    background_jobs.append(payment_watcher)
+
+
+def start_background_jobs(dispatcher: Dispatcher):
+    """Запускать фоновые задачи вместе с диспетчером этого процесса."""
+    for job in background_jobs:
+        dispatcher.startup.register(job.start)
+        dispatcher.shutdown.register(job.stop)
+
+
+async def main():
+    await init_db()
+    # Polling — всегда один процесс (WEB_CONCURRENCY относится только к вебхуку)
+    start_background_jobs(dp)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await close_db()
 
 
 if __name__ == "__main__":
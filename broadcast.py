@@ -0,0 +1,154 @@
+"""
+Рассылка сообщения всем пользователям.
+
+Получатели читаются страницами по users.id (keyset pagination), страница
+отправляется параллельно в пределах общего лимита Telegram, после неё
+прогресс записывается в таблицу broadcasts. После перезапуска рассылка
+продолжается с последней записанной страницы: повторно могут уйти только
+сообщения одной недописанной страницы.
+"""
+
+import asyncio
+import logging
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramNetworkError, TelegramServerError, TelegramAPIError
+
+from ratelimit import TokenBucket
+from storage import (
+    create_broadcast,
+    get_running_broadcasts,
+    get_broadcast_recipients,
+    save_broadcast_progress,
+    finish_broadcast,
+)
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 200
+# Сколько сообщений одной страницы отправляется одновременно (темп задаёт лимитер)
+SEND_CONCURRENCY = 20
+MAX_ATTEMPTS = 3
+
+
+class Broadcaster:
+    """Фоновые рассылки с контрольными точками в БД."""
+
+    def __init__(self, bot: Bot, limiter: TokenBucket, page_size: int = PAGE_SIZE):
+        self.bot = bot
+        # Общий с outbox лимитер: Telegram ограничивает бота целиком
+        self.limiter = limiter
+        self.page_size = page_size
+        self._tasks: dict[int, asyncio.Task] = {}
+        # Отправляет только запущенный экземпляр: при нескольких процессах — процесс-лидер
+        self._active = False
+
+    async def start(self):
+        """Продолжить рассылки, прерванные перезапуском."""
+        self._active = True
+        await self.resume()
+
+    async def resume(self):
+        """Начать отправку рассылок со статусом running, которые ещё не идут в этом процессе."""
+        if not self._active:
+            return
+        for broadcast in await get_running_broadcasts():
+            if broadcast["id"] in self._tasks:
+                continue
+            logger.info("Resuming broadcast %d after user %d", broadcast["id"], broadcast["last_user_id"])
+            self._spawn(broadcast)
+
+    async def stop(self):
+        """Остановить отправку. Статус в БД остаётся running — продолжим при запуске."""
+        self._active = False
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def create(self, text: str, created_by: int) -> int:
+        """Создать рассылку и начать отправку. Возвращает её id.
+
+        В неактивном процессе только создаёт запись: отправку начнёт лидер по журналу изменений.
+        """
+        broadcast = await create_broadcast(text, created_by)
+        if self._active:
+            self._spawn(broadcast)
+        return broadcast["id"]
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        """Остановить рассылку насовсем."""
+        result = await finish_broadcast(broadcast_id, "canceled")
+        task = self._tasks.pop(broadcast_id, None)
+        if task is not None:
+            task.cancel()
+        return result is not None
+
+    def _spawn(self, broadcast: dict):
+        if broadcast["id"] not in self._tasks:
+            self._tasks[broadcast["id"]] = asyncio.create_task(self._run(broadcast))
+
+    async def _run(self, broadcast: dict):
+        broadcast_id = broadcast["id"]
+        last_user_id = broadcast["last_user_id"]
+        try:
+            while recipients := await get_broadcast_recipients(last_user_id, self.page_size):
+                sent, failed, blocked = await self._send_page(broadcast["text"], recipients)
+                last_user_id = recipients[-1][0]
+                if not await save_broadcast_progress(broadcast_id, last_user_id, sent, failed, blocked):
+                    logger.info("Broadcast %d was canceled", broadcast_id)
+                    return
+            result = await finish_broadcast(broadcast_id)
+        except Exception:
+            logger.exception("Broadcast %d crashed, will resume on restart", broadcast_id)
+            return
+        finally:
+            if self._tasks.get(broadcast_id) is asyncio.current_task():
+                del self._tasks[broadcast_id]
+        if result is not None:
+            logger.info("Broadcast %d done: %s", broadcast_id, result)
+            try:
+                await self.bot.send_message(
+                    result["created_by"],
+                    f"📣 Рассылка #{broadcast_id} завершена.\n"
+                    f"Доставлено: {result['sent']}, заблокировали бота: {result['blocked']}, ошибок: {result['failed']}"
+                )
+            except TelegramAPIError as e:
+                logger.warning("Failed to report broadcast %d: %s", broadcast_id, e)
+
+    async def _send_page(self, text: str, recipients: list[tuple[int, int]]) -> tuple[int, int, list[int]]:
+        """Отправить страницу. Возвращает (доставлено, ошибок, id заблокировавших)."""
+        semaphore = asyncio.Semaphore(SEND_CONCURRENCY)
+        blocked: list[int] = []
+        failed = 0
+
+        async def send(user_id: int, tg_id: int):
+            nonlocal failed
+            async with semaphore:
+                attempts = 0
+                while True:
+                    await self.limiter.acquire()
+                    try:
+                        await self.bot.send_message(tg_id, text)
+                        return
+                    except TelegramRetryAfter as e:
+                        # Flood wait распространяется на весь бот, попыткой не считается
+                        self.limiter.pause(e.retry_after)
+                    except TelegramForbiddenError:
+                        blocked.append(user_id)
+                        return
+                    except (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError, OSError) as e:
+                        attempts += 1
+                        if attempts >= MAX_ATTEMPTS:
+                            logger.warning("Broadcast to %s failed: %s", tg_id, e)
+                            break
+                        await asyncio.sleep(2.0 ** attempts)
+                    except TelegramAPIError as e:
+                        # Чат удалён, неверный id — повтор не поможет
+                        logger.warning("Broadcast to %s failed: %s", tg_id, e)
+                        break
+                failed += 1
+
+        await asyncio.gather(*(send(user_id, tg_id) for user_id, tg_id in recipients))
+        return len(recipients) - failed - len(blocked), failed, blocked
@@ -0,0 +1,87 @@
+"""
+Простые in-process кэши для горячих путей хендлеров.
+"""
+
+import time
+from collections import OrderedDict, deque
+
+
+class LRUCache:
+    """Ограниченный по размеру кэш с вытеснением давно не использованных ключей.
+
+    Записи хранятся бессрочно, если в set() не передан ttl (в секундах).
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        # key -> (value, expires_at | None)
+        self._data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        try:
+            value, expires_at = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float | None = None):
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class RecentIds:
+    """Окно последних N идентификаторов: кольцевой буфер + множество для O(1) проверки."""
+
+    def __init__(self, size: int):
+        self._order: deque = deque(maxlen=size)
+        self._seen: set = set()
+
+    def add(self, item) -> bool:
+        """Запомнить идентификатор. False, если он уже есть в окне."""
+        if item in self._seen:
+            return False
+        if len(self._order) == self._order.maxlen:
+            self._seen.discard(self._order[0])
+        self._order.append(item)
+        self._seen.add(item)
+        return True
+
+    def discard(self, item):
+        """Забыть идентификатор (O(N), для редких случаев)."""
+        if item in self._seen:
+            self._seen.discard(item)
+            self._order.remove(item)
+
+    def __contains__(self, item):
+        return item in self._seen
+
+    def __len__(self):
+        return len(self._order)
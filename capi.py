@@ -0,0 +1,268 @@
+"""
+Отправка событий воронки в Meta Conversions API.
+
+Хендлеры только кладут событие в буфер в памяти (track не ждёт сети).
+Фоновая задача отправляет события пачками — по размеру пачки или раз в
+flush_interval секунд. Пока API недоступен, события ждут в буфере, где
+при переполнении вытесняются самые старые. При остановке неотправленное
+сохраняется в spill-файл (JSON lines, не больше max_buffer событий) и
+повторяется после перезапуска.
+
+При WEB_CONCURRENCY > 1 у каждого процесса свой spill-файл
+(<имя>.<pid>.jsonl). На старте sink забирает файлы завершившихся
+процессов переименованием, поэтому один файл не повторяют двое.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import deque
+
+import aiohttp
+
+from metrics import counter
+
+logger = logging.getLogger(__name__)
+
+# Лимит Conversions API — 1000 событий в запросе
+MAX_BATCH_SIZE = 1000
+MAX_BACKOFF = 300.0
+
+CAPI_EVENTS = counter("bot_capi_events_total", "Meta Conversions API events", ("result",))
+
+
+def hash_user_id(tg_id: int) -> str:
+    """external_id для Meta: sha256 от Telegram id."""
+    return hashlib.sha256(str(tg_id).encode()).hexdigest()
+
+
+def _process_spill_path(base: str, pid: int) -> str:
+    root, ext = os.path.splitext(base)
+    return f"{root}.{pid}{ext}"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ConversionsSink:
+    """Буфер событий Conversions API с пакетной отправкой и spill-файлом."""
+
+    def __init__(self, pixel_id: str, access_token: str, api_url: str, spill_path: str,
+                 batch_size: int = 100, flush_interval: float = 5.0, max_buffer: int = 10_000,
+                 timeout: float = 10.0):
+        self.pixel_id = pixel_id
+        self.access_token = access_token
+        self.endpoint = f"{api_url.rstrip('/')}/{pixel_id}/events"
+        self.spill_base = spill_path
+        # Уточняется в start(): pid рабочего процесса, а не того, что импортировал модуль
+        self.spill_path = _process_spill_path(spill_path, os.getpid())
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        # При долгом простое API старые события вытесняются, память не растёт
+        self._buffer: deque[dict] = deque(maxlen=max_buffer)
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._session: aiohttp.ClientSession | None = None
+        self._retry_at = 0.0
+        self._failures = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.pixel_id and self.access_token)
+
+    def track(self, event_name: str, tg_id: int, custom_data: dict | None = None, event_id: str | None = None):
+        """Добавить событие в буфер. Не обращается к сети и не ждёт."""
+        if not self.enabled:
+            return
+        event = {
+            "event_name": event_name,
+            "event_time": int(time.time()),
+            "action_source": "chat",
+            "user_data": {"external_id": [hash_user_id(tg_id)]},
+        }
+        if custom_data:
+            event["custom_data"] = custom_data
+        if event_id:
+            # Meta отбрасывает повторы с тем же event_id (например, после повтора из spill)
+            event["event_id"] = event_id
+        if len(self._buffer) == self._buffer.maxlen:
+            CAPI_EVENTS.inc(("dropped",))
+        self._buffer.append(event)
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def start(self):
+        if self.enabled and self._task is None:
+            self.spill_path = _process_spill_path(self.spill_base, os.getpid())
+            try:
+                adopted = await asyncio.to_thread(self._adopt_orphaned_spills)
+            except OSError:
+                logger.exception("Failed to adopt spilled Conversions API events")
+            else:
+                if adopted:
+                    logger.info("Adopted %d spilled Conversions API events of stopped processes", adopted)
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Отправить остаток буфера; что не ушло — останется в spill-файле."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await self.flush(spill=True)
+        except Exception:
+            logger.exception("Final Conversions API flush failed")
+        await self._session.close()
+        self._session = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Conversions API flush failed")
+
+    async def flush(self, spill: bool = False):
+        """Отправить буфер пачками и, если API доступен, повторить spill-файл.
+
+        Во время паузы после ошибки события остаются в буфере; spill=True
+        (при остановке) переносит то, что не ушло, в spill-файл.
+        """
+        while self._buffer and time.monotonic() >= self._retry_at:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            if not await self._send(batch):
+                self._requeue(batch)
+        if spill and self._buffer:
+            events = list(self._buffer)
+            self._buffer.clear()
+            CAPI_EVENTS.inc(("spilled",), len(events))
+            await asyncio.to_thread(self._spill_events, events)
+        elif time.monotonic() >= self._retry_at and os.path.exists(self.spill_path):
+            await self._retry_spilled()
+
+    def _requeue(self, batch: list[dict]):
+        """Вернуть неотправленную пачку в начало буфера; лишние старые события отбрасываются."""
+        total = len(batch) + len(self._buffer)
+        if total > self._buffer.maxlen:
+            CAPI_EVENTS.inc(("dropped",), total - self._buffer.maxlen)
+        self._buffer = deque([*batch, *self._buffer], maxlen=self._buffer.maxlen)
+
+    async def _send(self, batch: list[dict]) -> bool:
+        """True, если пачку больше не нужно повторять."""
+        try:
+            async with self._session.post(
+                self.endpoint,
+                json={"data": batch, "access_token": self.access_token}
+            ) as response:
+                if response.status < 300:
+                    self._failures = 0
+                    CAPI_EVENTS.inc(("sent",), len(batch))
+                    return True
+                body = await response.text()
+                if response.status != 429 and response.status < 500:
+                    # Ошибка в самих событиях или токене — повтор не поможет
+                    logger.error("Conversions API rejected %d events: %s %s", len(batch), response.status, body[:500])
+                    CAPI_EVENTS.inc(("rejected",), len(batch))
+                    return True
+                logger.warning("Conversions API returned %s, will retry", response.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("Conversions API request failed: %s", e)
+        self._failures += 1
+        self._retry_at = time.monotonic() + min(MAX_BACKOFF, self.flush_interval * 2 ** self._failures)
+        return False
+
+    def _spill(self, batches: list[list[dict]], mode: str = "a"):
+        with open(self.spill_path, mode, encoding="utf-8") as f:
+            for batch in batches:
+                f.write(json.dumps(batch, ensure_ascii=False) + "\n")
+
+    def _spill_events(self, events: list[dict]):
+        """Дописать события к spill-файлу, оставив в нём не больше max_buffer самых новых."""
+        if os.path.exists(self.spill_path):
+            events = [event for batch in self._load_spilled() for event in batch] + events
+        limit = self._buffer.maxlen
+        if len(events) > limit:
+            logger.warning("Conversions API spill file is full, dropping %d oldest events", len(events) - limit)
+            CAPI_EVENTS.inc(("dropped",), len(events) - limit)
+            events = events[-limit:]
+        batches = [events[i:i + self.batch_size] for i in range(0, len(events), self.batch_size)]
+        self._spill(batches, "w")
+
+    def _load_spilled(self, path: str | None = None) -> list[list[dict]]:
+        path = path or self.spill_path
+        batches = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    batches.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Строка, недописанная при аварийной остановке
+                    logger.warning("Skipping corrupted line in %s", path)
+        return batches
+
+    def _orphaned_spills(self) -> list[str]:
+        """Spill-файлы завершившихся процессов и общий файл версии без разделения по pid."""
+        directory, name = os.path.split(self.spill_base)
+        directory = directory or "."
+        if not os.path.isdir(directory):
+            return []
+        root, ext = os.path.splitext(name)
+        pattern = re.compile(rf"{re.escape(root)}\.(\d+){re.escape(ext)}")
+        paths = [self.spill_base] if os.path.exists(self.spill_base) else []
+        for entry in os.listdir(directory):
+            match = pattern.fullmatch(entry)
+            if match and int(match[1]) != os.getpid() and not _pid_alive(int(match[1])):
+                paths.append(os.path.join(directory, entry))
+        return paths
+
+    def _adopt_orphaned_spills(self) -> int:
+        """Перенести события из чужих spill-файлов в свой. Возвращает число событий."""
+        adopted = 0
+        claimed = f"{self.spill_path}.adopting"
+        for path in self._orphaned_spills():
+            try:
+                # rename атомарен: если файл уже забрал другой процесс, пропускаем
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            events = [event for batch in self._load_spilled(claimed) for event in batch]
+            self._spill_events(events)
+            os.remove(claimed)
+            adopted += len(events)
+        return adopted
+
+    async def _retry_spilled(self):
+        batches = await asyncio.to_thread(self._load_spilled)
+        remaining = []
+        for i, batch in enumerate(batches):
+            if not await self._send(batch):
+                remaining = batches[i:]
+                break
+        if remaining:
+            await asyncio.to_thread(self._spill, remaining, "w")
+        else:
+            await asyncio.to_thread(os.remove, self.spill_path)
+        logger.info("Retried spilled Conversions API batches, %d left", len(remaining))
@@ -0,0 +1,239 @@
+"""
+Каталог курсов с заранее отрисованными экранами.
+
+Курсы загружаются один раз (из COURSES_FILE или config.COURSES) в
+неизменяемые структуры, а все тексты и клавиатуры строятся при загрузке,
+поэтому хендлер получает экран поиском в словаре. Перезагрузка строит
+новый каталог целиком и подменяет ссылку на него — хендлеры видят либо
+старый, либо новый каталог, но не смесь.
+"""
+
+import json
+import logging
+import os
+from types import MappingProxyType
+from typing import NamedTuple
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from config import COURSES, COURSES_FILE, USDT_TRC20_WALLET, USDT_ERC20_WALLET, BTC_WALLET, ETH_WALLET
+
+logger = logging.getLogger(__name__)
+
+SUPPORT_URL = "https://t.me/your_support"
+# Порядок кнопок выбора валюты, по две в ряд
+CURRENCIES = (("USDT_TRC20", "USDT TRC20"), ("USDT_ERC20", "USDT ERC20"), ("BTC", "BTC"), ("ETH", "ETH"))
+
+
+class Volume(NamedTuple):
+    index: int  # с 1, как в callback_data
+    title: str
+    description: str
+    pdf_path: str
+    caption: str
+
+
+class Course(NamedTuple):
+    id: int
+    name: str
+    short_name: str
+    price: float
+    description: str
+    volumes: tuple[Volume, ...]
+
+
+class Screen(NamedTuple):
+    text: str
+    reply_markup: InlineKeyboardMarkup
+
+
+def _kb(*rows: list[InlineKeyboardButton]) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=list(rows))
+
+
+def _button(text: str, callback_data: str) -> InlineKeyboardButton:
+    return InlineKeyboardButton(text=text, callback_data=callback_data)
+
+
+def _all_volumes_label(course: Course) -> str:
+    return "📚 Оба тома" if len(course.volumes) == 2 else "📚 Все тома"
+
+
+class Catalog:
+    """Неизменяемый снимок курсов и всех экранов, которые из них строятся."""
+
+    def __init__(self, courses: dict, wallets: dict[str, str | None]):
+        self.courses: MappingProxyType[int, Course] = MappingProxyType({
+            int(course_id): self._parse_course(int(course_id), info) for course_id, info in courses.items()
+        })
+        if not self.courses:
+            raise ValueError("Catalog has no courses")
+        self.default_course_id = next(iter(self.courses))
+        self.wallets = MappingProxyType({code: wallet for code, wallet in wallets.items() if wallet})
+
+        self.currency_kb = _kb(
+            *[[_button(label, f"cur_{code}") for code, label in CURRENCIES[i:i + 2]] for i in range(0, len(CURRENCIES), 2)],
+            [_button("❌ Отмена", "cancel_order")],
+        )
+        self.payment_kb = _kb(
+            [_button("💡 Как купить крипту?", "how_to_buy_crypto")],
+            [_button("✅ Я оплатил(а)", "i_paid")],
+            [_button("❌ Отмена", "cancel_order")],
+        )
+        self.main_menu_kb = self._main_menu_kb()
+        self.main_menu = Screen(self._main_menu_text(), self.main_menu_kb)
+        self.catalog_list = self._catalog_list()
+        self.no_access = Screen(
+            "У тебя ещё нет доступа. Нажми «Купить "
+            + (self.courses[self.default_course_id].short_name if len(self.courses) == 1 else "в каталоге")
+            + "»!",
+            self.main_menu_kb,
+        )
+
+        self.course_info: dict[int, Screen] = {}
+        self.choose_currency: dict[int, Screen] = {}
+        self.payment: dict[tuple[int, str], Screen] = {}
+        self.owned: dict[int, Screen] = {}
+        self.books: dict[int, Screen] = {}
+        self.delivered_text: dict[int, str] = {}
+        for course in self.courses.values():
+            self._render_course(course)
+        # Набор купленных курсов -> экран «Мои курсы»; строится при первом запросе
+        self._owned_lists: dict[tuple[int, ...], Screen] = {}
+
+    @staticmethod
+    def _parse_course(course_id: int, info: dict) -> Course:
+        volumes = tuple(
+            Volume(idx, volume["title"], volume.get("description", ""), volume["pdf_path"], f"📕 <b>{volume['title']}</b>")
+            for idx, volume in enumerate(info["volumes"], 1)
+        )
+        if not volumes:
+            raise ValueError(f"Course {course_id} has no volumes")
+        for volume in volumes:
+            if not os.path.exists(volume.pdf_path):
+                logger.warning("Course %s: file %s not found", course_id, volume.pdf_path)
+        return Course(
+            course_id, info["name"], info.get("short_name", info["name"]),
+            info["price"], info.get("description", ""), volumes,
+        )
+
+    def _main_menu_kb(self) -> InlineKeyboardMarkup:
+        if len(self.courses) == 1:
+            course = self.courses[self.default_course_id]
+            buy = _button(f"🛍️ Купить {course.short_name}", f"buy_course:{course.id}")
+            about = _button("📖 О курсе", f"course_info:{course.id}")
+        else:
+            buy = _button("🛍️ Каталог курсов", "courses_info")
+            about = None
+        rows = [[buy], [_button("📚 Мои томы", "my_courses_list")]]
+        if about:
+            rows.append([about])
+        rows.append([InlineKeyboardButton(text="💬 Поддержка", url=SUPPORT_URL)])
+        return _kb(*rows)
+
+    def _main_menu_text(self) -> str:
+        if len(self.courses) > 1:
+            return "Привет! 👋\n\nДобро пожаловать! Наши курсы:\n\n" + "".join(
+                f"• <b>{course.name}</b> — {course.price} USDT\n" for course in self.courses.values()
+            ) + "\nВыбирай в «Каталоге курсов» 👇"
+        course = self.courses[self.default_course_id]
+        text = f"Привет! 👋\n\nДобро пожаловать в <b>{course.short_name}</b>!\n"
+        if course.description:
+            text += course.description.rstrip(".") + ".\n"
+        text += "\nЗдесь ты найдёшь:\n" + "".join(f"• 📕 {volume.title}\n" for volume in course.volumes)
+        count = len(course.volumes)
+        volumes = "том" if count == 1 else "оба тома" if count == 2 else "все тома"
+        return text + f"\n<b>Стоимость: {course.price} USDT за {volumes}</b> 💰"
+
+    def _catalog_list(self) -> Screen:
+        text = "<b>📖 Курсы</b>\n\n" + "\n".join(
+            f"• <b>{course.name}</b> — {course.price} USDT" for course in self.courses.values()
+        )
+        rows = [[_button(f"📖 {course.name}", f"course_info:{course.id}")] for course in self.courses.values()]
+        rows.append([_button("← Назад", "back_to_menu")])
+        return Screen(text, _kb(*rows))
+
+    def _render_course(self, course: Course):
+        text = f"<b>📖 {course.name}</b>\n\n💵 <b>Цена: {course.price} USDT</b>\n\n<b>Содержание:</b>\n\n"
+        for volume in course.volumes:
+            text += f"<b>📕 {volume.title}</b>\n{volume.description}\n\n"
+        text += f"Нажми «Купить {course.short_name}» чтобы начать."
+        self.course_info[course.id] = Screen(text, _kb(
+            [_button(f"🛍️ Купить {course.short_name}", f"buy_course:{course.id}")],
+            [_button("← Назад", "back_to_menu")],
+        ))
+
+        self.choose_currency[course.id] = Screen(
+            f"<b>🎓 {course.name}</b>\n\n💵 <b>{course.price} USDT</b>\n\nВыбери валюту:",
+            self.currency_kb,
+        )
+        for code, wallet in self.wallets.items():
+            self.payment[(course.id, code)] = Screen(
+                f"<b>💳 Оплата</b>\n\n📊 {course.price} USDT\n\n📍 Адрес:\n<code>{wallet}</code>\n\n⚠️ Проверь адрес и сеть!",
+                self.payment_kb,
+            )
+
+        downloads = [[_button(f"📥 {volume.title}", f"download_volume:{course.id}:{volume.index}")] for volume in course.volumes]
+        download_all = [_button(_all_volumes_label(course), f"download_all:{course.id}")]
+        checks = "".join(f"✅ {volume.title}\n" for volume in course.volumes)
+        self.owned[course.id] = Screen(
+            f"<b>✅ У тебя есть доступ!</b>\n\n<b>{course.name}</b>\n\n{checks}",
+            _kb(*downloads, download_all, [_button("← Назад", "back_to_menu")]),
+        )
+        self.books[course.id] = Screen(f"📚 Твои томы — <b>{course.name}</b>:", _kb(*downloads, download_all))
+        self.delivered_text[course.id] = "🎉 <b>Оплата подтверждена!</b>\n\n" + checks.rstrip("\n")
+
+    def owned_list(self, course_ids: tuple[int, ...]) -> Screen:
+        """Экран «Мои курсы» для нескольких купленных курсов."""
+        screen = self._owned_lists.get(course_ids)
+        if screen is None:
+            courses = [self.courses[course_id] for course_id in course_ids]
+            text = "<b>✅ Твои курсы</b>\n\n" + "\n".join(f"• {course.name}" for course in courses)
+            rows = [[_button(f"📚 {course.name}", f"my_course:{course.id}")] for course in courses]
+            rows.append([_button("← Назад", "back_to_menu")])
+            screen = self._owned_lists[course_ids] = Screen(text, _kb(*rows))
+        return screen
+
+    def course_id_from(self, callback_data: str) -> int | None:
+        """Курс из callback_data вида "action:course_id[:...]"; старые кнопки без id — курс по умолчанию."""
+        parts = callback_data.split(":")
+        if len(parts) < 2:
+            return self.default_course_id
+        try:
+            course_id = int(parts[1])
+        except ValueError:
+            return None
+        return course_id if course_id in self.courses else None
+
+
+def _read_courses() -> dict:
+    if not COURSES_FILE:
+        return COURSES
+    with open(COURSES_FILE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_catalog() -> Catalog:
+    """Прочитать курсы и построить новый каталог (текущий не меняется)."""
+    wallets = {"USDT_TRC20": USDT_TRC20_WALLET, "USDT_ERC20": USDT_ERC20_WALLET, "BTC": BTC_WALLET, "ETH": ETH_WALLET}
+    return Catalog(_read_courses(), wallets)
+
+
+_catalog: Catalog | None = None
+
+
+def get_catalog() -> Catalog:
+    """Текущий каталог. Хендлер берёт его один раз и работает с этим снимком."""
+    global _catalog
+    if _catalog is None:
+        _catalog = load_catalog()
+    return _catalog
+
+
+def reload_catalog() -> Catalog:
+    """Перечитать курсы. При ошибке исключение, а текущий каталог остаётся прежним."""
+    global _catalog
+    catalog = load_catalog()
+    _catalog = catalog
+    logger.info("Catalog loaded: %d courses", len(catalog.courses))
+    return catalog
@@ -0,0 +1,210 @@
+"""
+Несколько процессов вебхука (uvicorn --workers N) над одной bot.db.
+
+Журнал изменений. Таблица changes пополняется триггерами (выдача
+доступа, новая рассылка) и publish_change() (перезагрузка каталога).
+Процесс раз в poll_interval читает PRAGMA data_version — счётчик без
+обращения к таблицам, который меняется, только если БД кто-то изменил, —
+и лишь тогда дочитывает журнал и сбрасывает свои кэши.
+
+Слоты чатов. Апдейт относится к слоту chat_key % slots, каждый слот
+арендует один процесс (таблица worker_slots, аренда продлевается раз в
+lease_ttl / 3). Апдейты чужих слотов вебхук кладёт в таблицу inbox,
+владелец забирает их при следующей проверке. Так апдейты одного чата
+обрабатывает один процесс, и состояния FSM и лимиты нажатий в его памяти
+остаются верными. Строка inbox удаляется только после того, как апдейт
+принят в очередь процесса; перед своим прямым апдейтом владелец сначала
+разбирает inbox, а пока в слоте остался хвост (очередь была полна),
+прямые апдейты слота тоже идут в inbox — порядок внутри чата сохраняется.
+
+Лидер. Фоновые задачи (outbox, очистка заказов, рассылки, сверка
+оплат) работают только в процессе, владеющем слотом 0: общий лимит
+Telegram соблюдается, а рассылка не уходит дважды. Если лидер упал,
+слот 0 и задачи через 2 * lease_ttl подхватит другой процесс.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+from typing import Callable
+
+from aiogram import Bot
+from aiogram.types import Update
+
+from storage import (
+    get_pool,
+    last_change_id,
+    get_changes,
+    push_inbox,
+    read_inbox,
+    delete_inbox,
+    init_worker_slots,
+    renew_worker_slots,
+    release_worker_slots,
+)
+from update_queue import UpdateQueue, chat_key
+
+logger = logging.getLogger(__name__)
+
+
+class Cluster:
+    """Согласование процессов вебхука через SQLite."""
+
+    def __init__(self, bot: Bot, update_queue: UpdateQueue, slots: int,
+                 poll_interval: float = 0.05, lease_ttl: float = 10.0):
+        self.bot = bot
+        self.update_queue = update_queue
+        self.slots = slots
+        self.poll_interval = poll_interval
+        self.lease_ttl = lease_ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.owned: set[int] = set()
+        self.is_leader = False
+        self._handlers: dict[str, list[Callable]] = {}
+        self._on_commit: list[Callable[[], None]] = []
+        self._leader_jobs: list = []
+        self._data_version: int | None = None
+        self._change_id = 0
+        self._tasks: list[asyncio.Task] = []
+        # Проверки из поллера и из вебхука не должны разбирать inbox одновременно
+        self._check_lock = asyncio.Lock()
+        # Слоты, в inbox которых остались апдейты после последней проверки
+        self._backlog: set[int] = set()
+        self.forwarded = 0
+        self.received = 0
+
+    def on_change(self, topic: str, callback: Callable):
+        """callback(key) (или корутина) на каждую запись журнала с этим topic."""
+        self._handlers.setdefault(topic, []).append(callback)
+
+    def on_commit(self, callback: Callable[[], None]):
+        """callback() после любого изменения БД (например, разбудить outbox)."""
+        self._on_commit.append(callback)
+
+    def leader_job(self, job):
+        """Задача с async start()/stop(), которая работает только в процессе-лидере."""
+        self._leader_jobs.append(job)
+
+    async def start(self):
+        if self._tasks:
+            return
+        # Кэши процесса пусты — журнал до запуска не нужен
+        self._change_id = await last_change_id()
+        self._data_version = await get_pool().data_version()
+        await init_worker_slots(self.slots)
+        await self._renew()
+        self._tasks = [asyncio.create_task(self._poller()), asyncio.create_task(self._renewer())]
+        logger.info("Worker %s started with slots %s", self.owner, sorted(self.owned))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._set_leader(False)
+        await release_worker_slots(self.owner)
+        self.owned = set()
+
+    async def route(self, update: Update, body: str) -> bool:
+        """Обработать апдейт здесь или передать владельцу слота. False — локальная очередь переполнена."""
+        slot = chat_key(update) % self.slots
+        if slot in self.owned:
+            # Сначала апдейты этого чата, пересланные другими процессами
+            await self.check()
+            if slot not in self._backlog:
+                return await self.update_queue.submit(update)
+        else:
+            self.forwarded += 1
+        await push_inbox(slot, body)
+        return True
+
+    async def check(self):
+        """Применить изменения БД, сделанные с прошлой проверки."""
+        async with self._check_lock:
+            version = await get_pool().data_version()
+            if version == self._data_version:
+                return
+            self._data_version = version
+            for change_id, topic, key in await get_changes(self._change_id):
+                self._change_id = change_id
+                for callback in self._handlers.get(topic, ()):
+                    try:
+                        result = callback(key)
+                        if asyncio.iscoroutine(result):
+                            await result
+                    except Exception:
+                        logger.exception("Change handler for %s:%s failed", topic, key)
+            for callback in self._on_commit:
+                callback()
+            if self.owned:
+                await self._drain_inbox()
+
+    async def _drain_inbox(self, limit: int = 500):
+        """Передать апдейты своих слотов в очередь; из inbox удаляются только принятые."""
+        accepted = []
+        backlog = set()
+        try:
+            for slot, rows in (await read_inbox(sorted(self.owned), limit)).items():
+                if len(rows) == limit:
+                    backlog.add(slot)
+                for row_id, body in rows:
+                    update = Update.model_validate_json(body, context={"bot": self.bot})
+                    # Не ждём места: поллер не должен застревать, остаток заберёт следующая проверка
+                    if not await self.update_queue.submit(update, wait=False):
+                        backlog.add(slot)
+                        break
+                    accepted.append(row_id)
+                    self.received += 1
+        finally:
+            self._backlog = backlog
+            if backlog:
+                # Следующая проверка дочитает inbox, даже если БД никто не менял
+                self._data_version = None
+            if accepted:
+                await delete_inbox(accepted)
+
+    async def _poller(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.check()
+            except Exception:
+                logger.exception("Cluster check failed")
+
+    async def _renew(self):
+        owned = set(await renew_worker_slots(self.owner, self.lease_ttl))
+        if owned != self.owned:
+            logger.info("Worker %s now owns slots %s", self.owner, sorted(owned))
+            self.owned = owned
+            # Апдейты, накопившиеся для новых слотов, заберёт ближайшая проверка
+            self._data_version = None
+        await self._set_leader(0 in owned)
+
+    async def _set_leader(self, leader: bool):
+        if leader == self.is_leader:
+            return
+        self.is_leader = leader
+        logger.info("Worker %s %s background jobs", self.owner, "starts" if leader else "stops")
+        for job in self._leader_jobs if leader else reversed(self._leader_jobs):
+            try:
+                await (job.start() if leader else job.stop())
+            except Exception:
+                logger.exception("Failed to %s %s", "start" if leader else "stop", type(job).__name__)
+
+    async def _renewer(self):
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                await self._renew()
+            except Exception:
+                logger.exception("Worker slot renewal failed")
+
+    def stats(self) -> dict:
+        return {
+            "owner": self.owner,
+            "slots": sorted(self.owned),
+            "leader": self.is_leader,
+            "forwarded": self.forwarded,
+            "received": self.received,
+        }
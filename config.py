@@ -4,6 +4,11 @@ from dotenv import load_dotenv
 load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# Свой Bot API сервер (telegram-bot-api), например http://localhost:8081; пусто — api.telegram.org.
+# Перед переключением бот должен выйти из облачного API (метод logOut).
+TELEGRAM_API_SERVER = os.getenv("TELEGRAM_API_SERVER", "")
+# Сервер запущен с --local: тома отправляются путём к файлу (сервер читает их с того же диска)
+TELEGRAM_API_LOCAL = os.getenv("TELEGRAM_API_LOCAL", "1") == "1"
 ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x]
 
 USDT_TRC20_WALLET = os.getenv("USDT_TRC20_WALLET")
@@ -14,6 +19,8 @@ ETH_WALLET = os.getenv("ETH_WALLET")
 COURSES = {
     1: {
         "name": "Эскортопедия. Полное издание",
+        # Для кнопки «Купить …»
+        "short_name": "Эскортопедию",
         "price": 200,
         "description": "Полный гайд по сфере в двух томах",
         "volumes": [
@@ -31,7 +38,54 @@ COURSES = {
     }
 }
 
+# JSON с курсами в формате COURSES ({"1": {...}}); пусто — COURSES выше.
+# Перечитывается командой /reload_catalog без перезапуска.
+COURSES_FILE = os.getenv("COURSES_FILE", "")
+
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./bot.db")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+# Вебхук отвечает сразу, апдейты обрабатывает пул воркеров
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_ENQUEUE_TIMEOUT = float(os.getenv("WEBHOOK_ENQUEUE_TIMEOUT", "5"))
+# Сколько апдейт, пришедший во время прогрева процесса, ждёт готовности (потом 503 и повтор от Telegram)
+WEBHOOK_READY_TIMEOUT = float(os.getenv("WEBHOOK_READY_TIMEOUT", "20"))
+# Процессов вебхука (uvicorn --workers читает ту же переменную). Больше 1 — апдейты чата
+# направляются одному процессу, кэши сбрасываются по журналу изменений в БД (см. cluster.py)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Как часто процесс проверяет, менял ли БД кто-то ещё, и на сколько секунд арендует слоты чатов
+CLUSTER_POLL_INTERVAL = float(os.getenv("CLUSTER_POLL_INTERVAL", "0.05"))
+CLUSTER_LEASE_TTL = float(os.getenv("CLUSTER_LEASE_TTL", "10"))
+# Отправка из outbox: число воркеров и лимиты Telegram (сообщений в секунду)
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+# Через сколько часов брошенный заказ отменяется (0 — никогда)
+ORDER_TTL_HOURS = {
+    "pending": float(os.getenv("ORDER_TTL_PENDING_HOURS", "24")),
+    "waiting_proof": float(os.getenv("ORDER_TTL_WAITING_PROOF_HOURS", "72")),
+    "waiting_review": float(os.getenv("ORDER_TTL_WAITING_REVIEW_HOURS", "0")),
+}
+# Оплаченные и отменённые заказы старше N дней переносятся в orders_archive
+ORDER_ARCHIVE_AFTER_DAYS = float(os.getenv("ORDER_ARCHIVE_AFTER_DAYS", "30"))
+ORDER_SWEEP_INTERVAL = float(os.getenv("ORDER_SWEEP_INTERVAL", "600"))
+# Нажатия кнопок на пользователя: пополнение в секунду и максимальный запас
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "1"))
+THROTTLE_BURST = float(os.getenv("THROTTLE_BURST", "5"))
+# Токен для /admin/stats вебхук-сервера (заголовок X-Admin-Token); пусто — эндпоинт выключен
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
+# Автоподтверждение оплат: индексатор блокчейна "модуль:Класс" (см. payments.py); пусто — выключено
+PAYMENT_INDEXER = os.getenv("PAYMENT_INDEXER", "")
+PAYMENT_POLL_INTERVAL = float(os.getenv("PAYMENT_POLL_INTERVAL", "30"))
+# Допустимое расхождение суммы перевода с ценой заказа, USDT
+PAYMENT_AMOUNT_TOLERANCE = float(os.getenv("PAYMENT_AMOUNT_TOLERANCE", "0.5"))
+# Перевод без tx hash засчитывается, если пришёл не позже N часов после заказа
+PAYMENT_MATCH_WINDOW_HOURS = float(os.getenv("PAYMENT_MATCH_WINDOW_HOURS", "24"))
 META_PIXEL_ID = os.getenv("META_PIXEL_ID", "")
 META_ACCESS_TOKEN = os.getenv("META_ACCESS_TOKEN", "")
+# События воронки копятся в памяти и уходят пачками; неотправленные — в spill-файл
+META_CAPI_URL = os.getenv("META_CAPI_URL", "https://graph.facebook.com/v19.0")
+META_CAPI_BATCH_SIZE = int(os.getenv("META_CAPI_BATCH_SIZE", "100"))
+META_CAPI_FLUSH_INTERVAL = float(os.getenv("META_CAPI_FLUSH_INTERVAL", "5"))
+# Каждый процесс пишет в свой файл: capi_spill.<pid>.jsonl
+META_CAPI_SPILL_PATH = os.getenv("META_CAPI_SPILL_PATH", "capi_spill.jsonl")
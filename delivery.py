@@ -0,0 +1,133 @@
+"""
+Отправка PDF томов с переиспользованием file_id Telegram.
+
+Первый раз файл загружается с диска, а file_id из ответа Telegram
+сохраняется (ключ: путь + хэш содержимого + id бота). Дальше том
+отправляется по file_id без повторной загрузки.
+
+С собственным Bot API сервером в режиме --local (TELEGRAM_API_SERVER)
+первая отправка идёт не multipart-загрузкой, а ссылкой file:// на PDF:
+сервер читает файл с диска сам, и лимит 50 МБ на загрузку не действует.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from collections import defaultdict
+from pathlib import Path
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, InputFile, Message
+
+from catalog import Volume
+from storage import get_file_id, get_file_ids, save_file_id, delete_file_id
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# Фрагменты описаний Bad Request, когда Telegram не принимает сохранённый file_id
+STALE_FILE_ID_ERRORS = ("file identifier", "file reference", "file_reference")
+
+# path -> (mtime_ns, size, sha256): файл перехэшируется только после изменения
+_hashes: dict[str, tuple[int, int, str]] = {}
+# (path, content_hash, bot_id) -> file_id
+_file_ids: dict[tuple[str, str, int], str] = {}
+# Параллельные первые скачивания одного тома загружают файл один раз
+_upload_locks: defaultdict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def file_hash(path: str) -> str:
+    """Хэш содержимого файла (кэшируется по mtime и размеру)."""
+    st = os.stat(path)
+    cached = _hashes.get(path)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    content_hash = await asyncio.to_thread(_sha256, path)
+    _hashes[path] = (st.st_mtime_ns, st.st_size, content_hash)
+    return content_hash
+
+
+async def _lookup(path: str, content_hash: str, bot_id: int) -> str | None:
+    key = (path, content_hash, bot_id)
+    file_id = _file_ids.get(key)
+    if file_id is None:
+        file_id = await get_file_id(path, content_hash, bot_id)
+        if file_id is not None:
+            _file_ids[key] = file_id
+    return file_id
+
+
+async def warm_up(bot: Bot, volumes: list[Volume]) -> int:
+    """Загрузить сохранённые file_id в память и посчитать хэши PDF заранее.
+
+    Возвращает, сколько томов уйдёт по file_id без загрузки.
+    """
+    for path, content_hash, file_id in await get_file_ids(bot.id):
+        _file_ids[(path, content_hash, bot.id)] = file_id
+    cached = 0
+    for path in dict.fromkeys(volume.pdf_path for volume in volumes):
+        try:
+            content_hash = await file_hash(path)
+        except OSError as e:
+            logger.warning("Volume file %s is unavailable: %s", path, e)
+            continue
+        cached += (path, content_hash, bot.id) in _file_ids
+    return cached
+
+
+async def _forget(path: str, content_hash: str, bot_id: int):
+    _file_ids.pop((path, content_hash, bot_id), None)
+    await delete_file_id(path, bot_id)
+
+
+def _is_stale_file_id(error: TelegramBadRequest) -> bool:
+    message = error.message.lower()
+    return any(marker in message for marker in STALE_FILE_ID_ERRORS)
+
+
+def upload_source(bot: Bot, path: str) -> InputFile | str:
+    """Чем загрузить файл: путём для локального Bot API сервера, иначе содержимым."""
+    if bot.session.api.is_local:
+        # Сервер должен видеть файл по тому же абсолютному пути
+        return Path(path).resolve().as_uri()
+    return FSInputFile(path)
+
+
+async def send_volume(bot: Bot, chat_id: int, volume: Volume) -> Message:
+    """Отправить том: по сохранённому file_id, иначе загрузить PDF и запомнить file_id."""
+    path = volume.pdf_path
+    caption = volume.caption
+    content_hash = await file_hash(path)
+
+    file_id = await _lookup(path, content_hash, bot.id)
+    if file_id:
+        try:
+            return await bot.send_document(chat_id=chat_id, document=file_id, caption=caption)
+        except TelegramBadRequest as e:
+            # Чат не найден, неверная подпись и т. п. — повторная загрузка PDF не поможет
+            if not _is_stale_file_id(e):
+                raise
+            logger.warning("Cached file_id for %s rejected, re-uploading: %s", path, e)
+            await _forget(path, content_hash, bot.id)
+
+    async with _upload_locks[path]:
+        # Пока ждали блокировку, файл мог загрузить параллельный запрос
+        file_id = _file_ids.get((path, content_hash, bot.id))
+        if file_id:
+            return await bot.send_document(chat_id=chat_id, document=file_id, caption=caption)
+
+        message = await bot.send_document(chat_id=chat_id, document=upload_source(bot, path), caption=caption)
+        file_id = message.document.file_id
+        _file_ids[(path, content_hash, bot.id)] = file_id
+        await save_file_id(path, content_hash, bot.id, file_id)
+        return message
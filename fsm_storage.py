@@ -0,0 +1,145 @@
+"""
+FSM-хранилище aiogram поверх SQLite бота.
+
+Чтения идут из памяти, изменения копятся и периодически записываются
+в таблицу fsm_states одной транзакцией. Заброшенные состояния удаляются
+по TTL, поэтому покупатель посреди оплаты переживает перезапуск бота.
+"""
+
+import asyncio
+import copy
+import json
+import logging
+import time
+from typing import Any
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+from storage import load_fsm_record, save_fsm_records, delete_expired_fsm_records
+
+logger = logging.getLogger(__name__)
+
+
+class _Record:
+    __slots__ = ("state", "data", "updated_at")
+
+    def __init__(self, state: str | None, data: dict, updated_at: float):
+        self.state = state
+        self.data = data
+        self.updated_at = updated_at
+
+    def is_empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(BaseStorage):
+    """Write-behind хранилище состояний FSM в SQLite."""
+
+    def __init__(
+        self,
+        flush_interval: float = 1.0,
+        state_ttl: float = 7 * 24 * 3600,
+        cleanup_interval: float = 3600,
+        memory_idle_ttl: float = 900,
+    ):
+        self.flush_interval = flush_interval
+        # Сколько живёт брошенное состояние (в БД и в памяти)
+        self.state_ttl = state_ttl
+        self.cleanup_interval = cleanup_interval
+        # Через сколько неизменённая запись выгружается из памяти (в БД она остаётся)
+        self.memory_idle_ttl = memory_idle_ttl
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+        self._records: dict[str, _Record] = {}
+        self._dirty: set[str] = set()
+        self._task: asyncio.Task | None = None
+        self._last_cleanup = time.time()
+
+    async def _get(self, key: StorageKey) -> tuple[str, _Record]:
+        k = self.key_builder.build(key)
+        record = self._records.get(k)
+        if record is not None:
+            return k, record
+
+        row = await load_fsm_record(k)
+        if row and row[2] >= time.time() - self.state_ttl:
+            loaded = _Record(row[0], json.loads(row[1]), row[2])
+        else:
+            loaded = _Record(None, {}, time.time())
+        # Пока шёл запрос, запись мог создать параллельный апдейт
+        return k, self._records.setdefault(k, loaded)
+
+    def _touch(self, k: str, record: _Record):
+        record.updated_at = time.time()
+        self._dirty.add(k)
+        if self._task is None:
+            self._task = asyncio.create_task(self._flusher())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k, record = await self._get(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._touch(k, record)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        _, record = await self._get(key)
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        k, record = await self._get(key)
+        record.data = copy.deepcopy(data)
+        self._touch(k, record)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, record = await self._get(key)
+        return copy.deepcopy(record.data)
+
+    async def flush(self):
+        """Записать изменённые состояния в БД."""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        rows = []
+        deleted = []
+        for k in dirty:
+            record = self._records.get(k)
+            if record is None or record.is_empty():
+                deleted.append(k)
+            else:
+                rows.append((k, record.state, json.dumps(record.data), record.updated_at))
+        try:
+            await save_fsm_records(rows, deleted)
+        except Exception:
+            self._dirty |= dirty
+            raise
+
+    async def cleanup(self):
+        """Удалить просроченные состояния из БД и выгрузить простаивающие из памяти."""
+        now = time.time()
+        expired = now - self.state_ttl
+        idle = now - self.memory_idle_ttl
+        for k in [k for k, r in self._records.items() if r.updated_at < idle and k not in self._dirty]:
+            del self._records[k]
+        removed = await delete_expired_fsm_records(expired)
+        if removed:
+            logger.info("Removed %d abandoned FSM states", removed)
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.time() - self._last_cleanup >= self.cleanup_interval:
+                    self._last_cleanup = time.time()
+                    await self.cleanup()
+            except Exception:
+                logger.exception("Failed to flush FSM states")
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -0,0 +1,97 @@
+"""
+Middleware диспетчера.
+"""
+
+import logging
+import time
+from typing import Any, Awaitable, Callable, Iterable
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.types import CallbackQuery, TelegramObject
+
+from metrics import HANDLER_SECONDS, HANDLER_ERRORS, TELEGRAM_SECONDS, TELEGRAM_ERRORS
+from ratelimit import KeyedRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Стоимость нажатия по префиксу callback_data: отправка PDF дороже перерисовки меню
+DEFAULT_CALLBACK_COSTS = {
+    "download_all": 4.0,
+    "download_volume": 2.0,
+}
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Ограничивает частоту нажатий кнопок для каждого пользователя.
+
+    Регистрируется как outer middleware на callback_query, поэтому
+    отсеянные нажатия не доходят ни до БД, ни до отправки файлов.
+    exempt_ids (админы) не ограничиваются: массовый разбор /review
+    требует многих нажатий подряд.
+    """
+
+    def __init__(self, rate: float = 1.0, burst: float = 5.0, costs: dict[str, float] | None = None,
+                 default_cost: float = 1.0, exempt_ids: Iterable[int] = ()):
+        self.limiter = KeyedRateLimiter(rate, burst)
+        self.costs = DEFAULT_CALLBACK_COSTS if costs is None else costs
+        self.default_cost = default_cost
+        self.exempt_ids = frozenset(exempt_ids)
+        self.throttled = 0
+
+    def cost(self, data: str | None) -> float:
+        if data:
+            for prefix, cost in self.costs.items():
+                if data.startswith(prefix):
+                    return cost
+        return self.default_cost
+
+    async def __call__(
+        self,
+        handler: Callable[[CallbackQuery, dict[str, Any]], Awaitable[Any]],
+        event: CallbackQuery,
+        data: dict[str, Any],
+    ) -> Any:
+        user_id = event.from_user.id
+        if user_id not in self.exempt_ids and self.limiter.try_acquire(user_id, self.cost(event.data)) > 0:
+            self.throttled += 1
+            await event.answer("⏳ Слишком часто, подожди пару секунд")
+            return None
+        return await handler(event, data)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время работы и ошибки каждого хендлера (inner middleware: хендлер уже выбран)."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        labels = (handler_object.callback.__name__ if handler_object else "unknown",)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(labels)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(labels, time.perf_counter() - started)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Время и ошибки вызовов Bot API по методам (middleware сессии бота)."""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        labels = (method.__api_method__,)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            TELEGRAM_ERRORS.inc((method.__api_method__, type(e).__name__))
+            raise
+        finally:
+            TELEGRAM_SECONDS.observe(labels, time.perf_counter() - started)
@@ -0,0 +1,347 @@
+"""
+Версионированные миграции схемы БД.
+
+Каждая миграция применяется один раз в своей транзакции, номер
+последней применённой хранится в таблице schema_version. Новые
+изменения схемы добавляются только в конец списка MIGRATIONS.
+
+Тот же номер дублируется в PRAGMA user_version (заголовок файла БД):
+если он уже равен SCHEMA_VERSION, старт обходится без DDL и без
+транзакции записи.
+"""
+
+import logging
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+# Все заказы, включая перенесённые в orders_archive
+_ORDER_HISTORY = """(
+    SELECT currency, status, amount_usdt, tx_hash, proof_file_id, created_at, paid_at FROM orders
+    UNION ALL
+    SELECT currency, status, amount_usdt, tx_hash, proof_file_id, created_at, paid_at FROM orders_archive
+)"""
+
+MIGRATIONS: list[tuple[int, str, tuple[str, ...]]] = [
+    (1, "base tables", (
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tg_id INTEGER UNIQUE NOT NULL,
+            username TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            last_seen TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            course_id INTEGER NOT NULL,
+            amount_usdt FLOAT NOT NULL,
+            currency TEXT NOT NULL,
+            status TEXT DEFAULT 'pending',
+            wallet_address TEXT NOT NULL,
+            tx_hash TEXT,
+            proof_file_id TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            paid_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS access (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            course_id INTEGER NOT NULL,
+            volumes_count INTEGER DEFAULT 2,
+            granted_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            UNIQUE(user_id, course_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS file_ids (
+            path TEXT NOT NULL,
+            bot_id INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (path, bot_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states(updated_at)",
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at)",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_chat ON outbox(chat_id, status, id)",
+    )),
+    (2, "hot path indexes for orders", (
+        # get_last_pending_order: поиск по (user_id, status) без обхода всей истории пользователя
+        "CREATE INDEX IF NOT EXISTS idx_orders_user_status ON orders(user_id, status, id)",
+    )),
+    (3, "order expiry and archive", (
+        # Поиск устаревших заказов по статусу для sweeper.py
+        "CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders(status, created_at)",
+        """
+        CREATE TABLE IF NOT EXISTS orders_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            course_id INTEGER NOT NULL,
+            amount_usdt FLOAT NOT NULL,
+            currency TEXT NOT NULL,
+            status TEXT,
+            wallet_address TEXT NOT NULL,
+            tx_hash TEXT,
+            proof_file_id TEXT,
+            created_at TEXT,
+            paid_at TEXT,
+            archived_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_orders_archive_user ON orders_archive(user_id)",
+    )),
+    (4, "sales funnel counters", (
+        # Счётчики воронки по дням; day = '' — итог за всё время.
+        # Ведутся триггерами, поэтому /stats не сканирует orders и users.
+        """
+        CREATE TABLE IF NOT EXISTS funnel_counters (
+            day TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            currency TEXT NOT NULL DEFAULT '',
+            count INTEGER NOT NULL DEFAULT 0,
+            amount REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, stage, currency)
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_funnel_started AFTER INSERT ON users
+        BEGIN
+            INSERT INTO funnel_counters (day, stage, currency, count) VALUES
+                (date('now'), 'started', '', 1), ('', 'started', '', 1)
+            ON CONFLICT (day, stage, currency) DO UPDATE SET count = count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_funnel_chose_currency AFTER INSERT ON orders
+        BEGIN
+            INSERT INTO funnel_counters (day, stage, currency, count) VALUES
+                (date('now'), 'chose_currency', NEW.currency, 1), ('', 'chose_currency', NEW.currency, 1)
+            ON CONFLICT (day, stage, currency) DO UPDATE SET count = count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_funnel_sent_proof AFTER UPDATE OF status ON orders
+        WHEN NEW.status = 'waiting_review' AND OLD.status != 'waiting_review'
+        BEGIN
+            INSERT INTO funnel_counters (day, stage, currency, count) VALUES
+                (date('now'), 'sent_proof', NEW.currency, 1), ('', 'sent_proof', NEW.currency, 1)
+            ON CONFLICT (day, stage, currency) DO UPDATE SET count = count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_funnel_paid AFTER UPDATE OF status ON orders
+        WHEN NEW.status = 'paid' AND OLD.status != 'paid'
+        BEGIN
+            INSERT INTO funnel_counters (day, stage, currency, count, amount) VALUES
+                (date('now'), 'paid', NEW.currency, 1, NEW.amount_usdt),
+                ('', 'paid', NEW.currency, 1, NEW.amount_usdt)
+            ON CONFLICT (day, stage, currency) DO UPDATE
+                SET count = count + 1, amount = amount + excluded.amount;
+        END
+        """,
+        # Заполнение по существующей истории (включая архив)
+        """
+        INSERT INTO funnel_counters (day, stage, currency, count)
+        SELECT date(created_at), 'started', '', COUNT(*) FROM users GROUP BY 1
+        """,
+        f"""
+        INSERT INTO funnel_counters (day, stage, currency, count)
+        SELECT date(created_at), 'chose_currency', currency, COUNT(*) FROM {_ORDER_HISTORY} GROUP BY 1, 3
+        """,
+        # Время отправки чека не хранится: чек относится ко дню создания заказа
+        f"""
+        INSERT INTO funnel_counters (day, stage, currency, count)
+        SELECT date(created_at), 'sent_proof', currency, COUNT(*) FROM {_ORDER_HISTORY}
+        WHERE tx_hash IS NOT NULL OR proof_file_id IS NOT NULL
+        GROUP BY 1, 3
+        """,
+        f"""
+        INSERT INTO funnel_counters (day, stage, currency, count, amount)
+        SELECT date(COALESCE(paid_at, created_at)), 'paid', currency, COUNT(*), SUM(amount_usdt) FROM {_ORDER_HISTORY}
+        WHERE status = 'paid'
+        GROUP BY 1, 3
+        """,
+        """
+        INSERT INTO funnel_counters (day, stage, currency, count, amount)
+        SELECT '', stage, currency, SUM(count), SUM(amount) FROM funnel_counters GROUP BY stage, currency
+        """,
+    )),
+    (5, "broadcasts", (
+        # Пользователи, заблокировавшие бота, пропускаются рассылками
+        "ALTER TABLE users ADD COLUMN blocked_at TEXT",
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            created_by INTEGER NOT NULL,
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            finished_at TEXT
+        )
+        """,
+    )),
+    (6, "on-chain payment matching", (
+        # Каждый перевод засчитывается только одному заказу
+        """
+        CREATE TABLE IF NOT EXISTS payment_transfers (
+            tx_hash TEXT PRIMARY KEY,
+            order_id INTEGER NOT NULL,
+            currency TEXT NOT NULL,
+            amount REAL NOT NULL,
+            rule TEXT NOT NULL,
+            matched_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Неоплаченные заказы одной валюты (кошелька) для сверки с переводами
+        "CREATE INDEX IF NOT EXISTS idx_orders_currency_status ON orders(currency, status)",
+    )),
+    (7, "admin review queue", (
+        # Очередь проверки: keyset-пагинация по id внутри статуса
+        "CREATE INDEX IF NOT EXISTS idx_orders_status_id ON orders(status, id)",
+    )),
+    (8, "multi-worker coordination", (
+        # Журнал изменений, по которому процессы сбрасывают свои кэши
+        """
+        CREATE TABLE IF NOT EXISTS changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic TEXT NOT NULL,
+            key TEXT NOT NULL DEFAULT '',
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_changes_access_insert AFTER INSERT ON access
+        BEGIN
+            INSERT INTO changes (topic, key) VALUES ('access', NEW.user_id || ':' || NEW.course_id);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_changes_access_delete AFTER DELETE ON access
+        BEGIN
+            INSERT INTO changes (topic, key) VALUES ('access', OLD.user_id || ':' || OLD.course_id);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_changes_broadcast AFTER INSERT ON broadcasts
+        BEGIN
+            INSERT INTO changes (topic, key) VALUES ('broadcast', NEW.id);
+        END
+        """,
+        # Слот чатов -> процесс, который сейчас обрабатывает его апдейты
+        """
+        CREATE TABLE IF NOT EXISTS worker_slots (
+            slot INTEGER PRIMARY KEY,
+            owner TEXT,
+            expires_at REAL NOT NULL DEFAULT 0
+        )
+        """,
+        # Апдейты, принятые не тем процессом, ждут владельца слота
+        """
+        CREATE TABLE IF NOT EXISTS inbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            slot INTEGER NOT NULL,
+            body TEXT NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_inbox_slot ON inbox(slot, id)",
+    )),
+    (9, "tx hashes of manually paid orders", (
+        # Перевод, которым оплачен заказ, больше не засчитывается другим заказам
+        "CREATE INDEX IF NOT EXISTS idx_payment_transfers_order ON payment_transfers(order_id)",
+        # Хэши, присланные покупателями заказов, подтверждённых вручную (как normalize_tx_hash)
+        """
+        INSERT OR IGNORE INTO payment_transfers (tx_hash, order_id, currency, amount, rule)
+        SELECT CASE WHEN lower(trim(tx_hash)) LIKE '0x%' THEN substr(lower(trim(tx_hash)), 3)
+                    ELSE lower(trim(tx_hash)) END,
+               id, currency, amount_usdt, 'manual'
+        FROM orders WHERE status = 'paid' AND tx_hash IS NOT NULL AND trim(tx_hash) != ''
+        """,
+    )),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_schema_version(db: aiosqlite.Connection) -> int:
+    """Номер последней применённой миграции (0 для пустой БД)."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    async with db.execute("SELECT MAX(version) FROM schema_version") as cursor:
+        row = await cursor.fetchone()
+    return row[0] or 0
+
+
+async def apply_migrations(db: aiosqlite.Connection) -> int:
+    """Применить недостающие миграции на соединении-писателе. Возвращает итоговую версию."""
+    async with db.execute("PRAGMA user_version") as cursor:
+        if (await cursor.fetchone())[0] == SCHEMA_VERSION:
+            return SCHEMA_VERSION
+    current = await get_schema_version(db)
+    await db.commit()
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        # IMMEDIATE: параллельно стартующий процесс дождётся нас и увидит новую версию
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            current = await get_schema_version(db)
+            if version <= current:
+                await db.commit()
+                continue
+            for sql in statements:
+                await db.execute(sql)
+            await db.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+            await db.execute(f"PRAGMA user_version = {version}")
+        except BaseException:
+            await db.rollback()
+            raise
+        await db.commit()
+        logger.info("Applied migration %d: %s", version, description)
+        current = version
+    # БД, мигрированная до появления user_version
+    await db.execute(f"PRAGMA user_version = {current}")
+    await db.commit()
+    return current
@@ -1,8 +1,14 @@
 """
 Модели данных (простые классы, без SQLAlchemy).
+
+Строки таблиц — NamedTuple в порядке колонок SELECT, поэтому запись
+строится из строки sqlite одним вызовом Model._make(row) и не хранит
+__dict__. Время хранится как пришло из SQLite (строкой) и разбирается в
+datetime только при обращении к свойству.
 """
 
 from datetime import datetime
+from typing import NamedTuple
 
 
 class OrderStatus:
@@ -14,38 +20,84 @@ class OrderStatus:
     CANCELED = "canceled"
 
 
-class User:
-    """Модель пользователя."""
-    def __init__(self, id: int, tg_id: int, username: str | None = None):
-        self.id = id
-        self.tg_id = tg_id
-        self.username = username
-        self.created_at = datetime.utcnow()
-        self.last_seen = datetime.utcnow()
-
-
-class Order:
-    """Модель заказа."""
-    def __init__(self, id: int, user_id: int, course_id: int, amount_usdt: float, 
-                 currency: str, wallet_address: str, status: str = OrderStatus.PENDING):
-        self.id = id
-        self.user_id = user_id
-        self.course_id = course_id
-        self.amount_usdt = amount_usdt
-        self.currency = currency
-        self.status = status
-        self.wallet_address = wallet_address
-        self.tx_hash = None
-        self.proof_file_id = None
-        self.created_at = datetime.utcnow()
-        self.paid_at = None
-
-
-class Access:
-    """Модель доступа к курсу."""
-    def __init__(self, id: int, user_id: int, course_id: int, volumes_count: int = 2):
-        self.id = id
-        self.user_id = user_id
-        self.course_id = course_id
-        self.volumes_count = volumes_count
-        self.granted_at = datetime.utcnow()
+def parse_timestamp(value: str | None) -> datetime | None:
+    """Время из SQLite (CURRENT_TIMESTAMP или isoformat, UTC) -> datetime."""
+    return datetime.fromisoformat(value) if value else None
+
+
+def normalize_tx_hash(tx_hash: str) -> str:
+    """Хэш транзакции в одном виде: без пробелов, в нижнем регистре, без 0x."""
+    tx_hash = tx_hash.strip().lower()
+    return tx_hash[2:] if tx_hash.startswith("0x") else tx_hash
+
+
+class User(NamedTuple):
+    """Строка users."""
+    id: int
+    tg_id: int
+    username: str | None
+    created_at: str | None
+    last_seen: str | None
+    blocked_at: str | None
+
+    @property
+    def created(self) -> datetime | None:
+        return parse_timestamp(self.created_at)
+
+    @property
+    def seen(self) -> datetime | None:
+        return parse_timestamp(self.last_seen)
+
+
+class Order(NamedTuple):
+    """Строка orders (и orders_archive)."""
+    id: int
+    user_id: int
+    course_id: int
+    amount_usdt: float
+    currency: str
+    status: str
+    wallet_address: str | None
+    tx_hash: str | None
+    proof_file_id: str | None
+    created_at: str | None
+    paid_at: str | None
+
+    @property
+    def created(self) -> datetime | None:
+        return parse_timestamp(self.created_at)
+
+    @property
+    def paid(self) -> datetime | None:
+        return parse_timestamp(self.paid_at)
+
+
+class ReviewOrder(NamedTuple):
+    """Заказ в очереди проверки вместе с покупателем."""
+    id: int
+    user_id: int
+    course_id: int
+    amount_usdt: float
+    currency: str
+    tx_hash: str | None
+    proof_file_id: str | None
+    created_at: str | None
+    tg_id: int
+    username: str | None
+
+    @property
+    def created(self) -> datetime | None:
+        return parse_timestamp(self.created_at)
+
+
+class Access(NamedTuple):
+    """Строка access: доступ пользователя к курсу."""
+    id: int
+    user_id: int
+    course_id: int
+    volumes_count: int
+    granted_at: str | None
+
+    @property
+    def granted(self) -> datetime | None:
+        return parse_timestamp(self.granted_at)
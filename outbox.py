@@ -0,0 +1,183 @@
+"""
+Очередь исходящих сообщений (outbox) с пулом воркеров.
+
+Хендлеры только записывают задания в таблицу outbox, а воркеры
+отправляют их с учётом лимитов Telegram (общего и на чат), повторяют
+при flood wait и сетевых ошибках и продолжают после перезапуска.
+"""
+
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramRetryAfter,
+    TelegramEntityTooLarge,
+    TelegramNetworkError,
+    TelegramServerError,
+    TelegramAPIError,
+)
+
+from catalog import get_catalog
+from delivery import send_volume
+from ratelimit import TokenBucket, KeyedRateLimiter
+from storage import (
+    claim_outbox_jobs,
+    next_outbox_attempt_at,
+    complete_outbox_job,
+    retry_outbox_job,
+    fail_outbox_job,
+    reset_stuck_outbox_jobs,
+    release_outbox_jobs,
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 8
+MAX_BACKOFF = 300.0
+# Как часто проверять таблицу, если никто не будит воркеры
+IDLE_POLL_INTERVAL = 30.0
+# Задание может быть готово, но ждать предыдущее сообщение своего чата
+MIN_POLL_INTERVAL = 0.5
+
+
+def course_delivery_payloads(course_id: int) -> list[dict]:
+    """Задания на отправку всех томов курса и поздравления."""
+    catalog = get_catalog()
+    payloads = [
+        {"kind": "volume", "course_id": course_id, "volume": idx}
+        for idx in range(len(catalog.courses[course_id].volumes))
+    ]
+    payloads.append({"kind": "message", "text": catalog.delivered_text[course_id]})
+    return payloads
+
+
+class Outbox:
+    """Пул воркеров, разбирающих таблицу outbox."""
+
+    def __init__(self, bot: Bot, workers: int = 4, global_rate: float = 25.0, chat_rate: float = 1.0):
+        self.bot = bot
+        self.workers = workers
+        self.global_limit = TokenBucket(global_rate, global_rate)
+        self.chat_limit = KeyedRateLimiter(chat_rate, 3)
+        self._jobs: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    async def start(self):
+        """Вернуть в очередь прерванные задания и запустить воркеры."""
+        if self._tasks:
+            return
+        resumed = await reset_stuck_outbox_jobs()
+        if resumed:
+            logger.info("Resuming %d interrupted outbox jobs", resumed)
+        self._tasks = [asyncio.create_task(self._claimer())]
+        self._tasks += [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Остановить воркеры. Незавершённые задания подхватит следующий запуск."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Забранные, но не начатые задания: иначе после повторного start они уйдут дважды
+        released = []
+        while not self._jobs.empty():
+            released.append(self._jobs.get_nowait()[0])
+            self._jobs.task_done()
+        if released:
+            await release_outbox_jobs(released)
+
+    def notify(self):
+        """Разбудить воркеры после добавления заданий."""
+        self._wakeup.set()
+
+    async def _claimer(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                jobs = await claim_outbox_jobs(self._jobs.maxsize)
+            except Exception:
+                logger.exception("Failed to claim outbox jobs")
+                jobs = []
+            for job in jobs:
+                await self._jobs.put(job)
+            if jobs:
+                continue
+            try:
+                delay = IDLE_POLL_INTERVAL
+                next_at = await next_outbox_attempt_at()
+                if next_at is not None:
+                    delay = min(delay, max(MIN_POLL_INTERVAL, next_at - time.time()))
+            except Exception:
+                delay = IDLE_POLL_INTERVAL
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        while True:
+            job_id, chat_id, payload, attempts = await self._jobs.get()
+            try:
+                await self._process(job_id, chat_id, payload, attempts)
+            except Exception:
+                logger.exception("Outbox job %s crashed", job_id)
+            finally:
+                self._jobs.task_done()
+                # Следующее задание этого чата стало доступно
+                self.notify()
+
+    async def _process(self, job_id: int, chat_id: int, payload: dict, attempts: int):
+        await self.chat_limit.acquire(chat_id)
+        await self.global_limit.acquire()
+        try:
+            await self._send(chat_id, payload)
+        except TelegramRetryAfter as e:
+            # Flood wait распространяется на весь бот
+            self.global_limit.pause(e.retry_after)
+            self.retried += 1
+            await retry_outbox_job(job_id, e.retry_after, str(e))
+        except TelegramEntityTooLarge as e:
+            # Наследник TelegramNetworkError, но файл больше лимита Bot API — повтор не поможет
+            self.failed += 1
+            logger.error("Outbox job %s to %s failed, file is too large: %s", job_id, chat_id, e)
+            await fail_outbox_job(job_id, str(e))
+        except (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError, OSError) as e:
+            await self._retry_or_fail(job_id, attempts, str(e))
+        except (TelegramAPIError, KeyError, IndexError, ValueError) as e:
+            # Бот заблокирован, неверный чат, том удалён из курса — повтор не поможет
+            self.failed += 1
+            logger.warning("Outbox job %s to %s failed: %s", job_id, chat_id, e)
+            await fail_outbox_job(job_id, str(e))
+        except Exception as e:
+            # Неожиданная ошибка: задание не должно остаться в 'sending' и заблокировать чат
+            logger.exception("Outbox job %s to %s crashed", job_id, chat_id)
+            await self._retry_or_fail(job_id, attempts, repr(e))
+        else:
+            self.sent += 1
+            await complete_outbox_job(job_id)
+
+    async def _retry_or_fail(self, job_id: int, attempts: int, error: str):
+        if attempts + 1 >= MAX_ATTEMPTS:
+            self.failed += 1
+            await fail_outbox_job(job_id, error)
+            return
+        self.retried += 1
+        await retry_outbox_job(job_id, min(MAX_BACKOFF, 2.0 ** attempts), error)
+
+    async def _send(self, chat_id: int, payload: dict):
+        if payload["kind"] == "volume":
+            volume = get_catalog().courses[payload["course_id"]].volumes[payload["volume"]]
+            await send_volume(self.bot, chat_id, volume)
+        elif payload["kind"] == "message":
+            await self.bot.send_message(chat_id=chat_id, text=payload["text"])
+        else:
+            raise ValueError(f"Unknown outbox job kind: {payload['kind']}")
+
+    def stats(self) -> dict:
+        return {"sent": self.sent, "retried": self.retried, "failed": self.failed, "in_flight": self._jobs.qsize()}
@@ -0,0 +1,211 @@
+"""
+Автоматическое подтверждение оплат по переводам в блокчейне.
+
+Раз в poll_interval секунд для каждого кошелька из конфига берутся все
+неоплаченные заказы этой валюты, и индексатор запрашивается один раз на
+кошелёк — начиная с самого старого заказа. Переводы сопоставляются с
+заказами:
+
+1. по tx hash, который покупатель прислал в receive_proof, — если перевод
+   сделан не раньше создания заказа (чужой старый хэш не подойдёт);
+2. по сумме в окне времени после создания заказа — только если подходит
+   ровно один заказ (одинаковые цены иначе не различить). Заказы, оплату
+   которых подтвердили вручную без известного перевода, тоже считаются
+   претендентами: перевод мог быть за них.
+
+Засчитанный перевод записывается в payment_transfers и второй раз не
+используется; туда же попадают хэши заказов, подтверждённых вручную. Индексатор подключается через PAYMENT_INDEXER
+("модуль:Класс"); FakeIndexer — локальная заглушка для проверок.
+"""
+
+import asyncio
+import importlib
+from abc import ABC, abstractmethod
+import logging
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, NamedTuple
+
+from metrics import counter
+from models import Order, normalize_tx_hash
+from storage import get_open_orders, get_unlinked_paid_orders, get_matched_transfers, confirm_payment_by_transfer
+
+logger = logging.getLogger(__name__)
+
+PAYMENTS_MATCHED = counter("bot_payments_matched_total", "Orders paid by on-chain transfer", ("currency", "rule"))
+
+
+class Transfer(NamedTuple):
+    """Входящий перевод на кошелёк.
+
+    amount — в USDT (для BTC/ETH индексатор пересчитывает по курсу на момент перевода).
+    """
+    tx_hash: str
+    currency: str
+    to_address: str
+    amount: float
+    timestamp: float
+
+
+class ChainIndexer(ABC):
+    """Клиент индексатора блокчейна."""
+
+    @abstractmethod
+    async def incoming_transfers(self, currency: str, address: str, since: float) -> list[Transfer]:
+        """Подтверждённые входящие переводы на address не раньше since (unix time)."""
+
+    async def close(self):
+        pass
+
+
+class FakeIndexer(ChainIndexer):
+    """Индексатор в памяти: переводы добавляются вызовом add()."""
+
+    def __init__(self):
+        self.transfers: list[Transfer] = []
+        self.calls = 0
+
+    def add(self, transfer: Transfer):
+        self.transfers.append(transfer)
+
+    async def incoming_transfers(self, currency: str, address: str, since: float) -> list[Transfer]:
+        self.calls += 1
+        return [
+            t for t in self.transfers
+            if t.currency == currency and t.to_address == address and t.timestamp >= since
+        ]
+
+
+def load_indexer(spec: str) -> ChainIndexer:
+    """Создать индексатор по строке "модуль:Класс"."""
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def _order_time(order: dict) -> float:
+    # created_at — CURRENT_TIMESTAMP SQLite, UTC
+    return datetime.strptime(order["created_at"], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+
+
+def match_transfers(orders: list[dict], transfers: list[Transfer], tolerance: float,
+                    window: float, paid_orders: list[dict] = ()) -> list[tuple[dict, Transfer, str]]:
+    """Сопоставить переводы заказам: [(заказ, перевод, правило)].
+
+    paid_orders — оплаченные заказы без известного перевода: их хэши не
+    засчитываются, а по сумме они конкурируют с открытыми заказами.
+    """
+    matches = []
+    open_orders = {order["id"]: order for order in orders}
+    by_hash = {normalize_tx_hash(order["tx_hash"]): order for order in orders if order["tx_hash"]}
+    paid_hashes = {normalize_tx_hash(order["tx_hash"]) for order in paid_orders if order["tx_hash"]}
+    unmatched = []
+    for transfer in sorted(transfers, key=lambda t: t.timestamp):
+        tx_hash = normalize_tx_hash(transfer.tx_hash)
+        if tx_hash in paid_hashes:
+            continue
+        order = by_hash.get(tx_hash)
+        # Переплату принимаем, недоплату — только в пределах допуска
+        if (order is not None and order["id"] in open_orders
+                and transfer.amount >= order["amount_usdt"] - tolerance
+                and transfer.timestamp >= _order_time(order)):
+            matches.append((order, transfer, "tx_hash"))
+            del open_orders[order["id"]]
+        else:
+            unmatched.append(transfer)
+
+    for transfer in unmatched:
+        candidates = [
+            order for order in [*open_orders.values(), *paid_orders]
+            if abs(transfer.amount - order["amount_usdt"]) <= tolerance
+            and 0 <= transfer.timestamp - _order_time(order) <= window
+        ]
+        if len(candidates) == 1 and candidates[0]["id"] in open_orders:
+            matches.append((candidates[0], transfer, "amount"))
+            del open_orders[candidates[0]["id"]]
+        elif candidates:
+            logger.info(
+                "Transfer %s matches %d orders by amount (paid or open), waiting for a tx hash",
+                transfer.tx_hash, len(candidates)
+            )
+    return matches
+
+
+class PaymentWatcher:
+    """Периодически сверяет неоплаченные заказы с переводами на кошельки."""
+
+    def __init__(self, indexer: ChainIndexer, wallets: dict[str, str | None],
+                 on_paid: Callable[[Order, int], Awaitable[None]],
+                 fulfillment: Callable[[], tuple[dict[int, list[dict]], dict[int, int]]],
+                 interval: float = 30.0, tolerance: float = 0.5, window_hours: float = 24.0):
+        self.indexer = indexer
+        self.wallets = {currency: address for currency, address in wallets.items() if address}
+        # Вызывается с оплаченным заказом и tg_id покупателя после коммита: уведомления, аналитика.
+        # Доступ и доставка записываются в той же транзакции, что и статус заказа.
+        self.on_paid = on_paid
+        # () -> (задания outbox по course_id, число томов по course_id), как для approve_orders
+        self.fulfillment = fulfillment
+        self.interval = interval
+        self.tolerance = tolerance
+        self.window = window_hours * 3600
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.indexer.close()
+
+    async def check(self) -> int:
+        """Один проход по всем кошелькам. Возвращает число оплаченных заказов."""
+        paid = 0
+        for currency, address in self.wallets.items():
+            try:
+                paid += await self._check_wallet(currency, address)
+            except Exception:
+                logger.exception("Payment check for %s failed", currency)
+        return paid
+
+    async def _check_wallet(self, currency: str, address: str) -> int:
+        orders = [order for order in await get_open_orders(currency) if order["wallet_address"] == address]
+        if not orders:
+            # Нет ожидающих заказов — индексатор не запрашиваем
+            return 0
+        since = min(_order_time(order) for order in orders)
+        transfers = await self.indexer.incoming_transfers(currency, address, since)
+        used = await get_matched_transfers([normalize_tx_hash(t.tx_hash) for t in transfers])
+        transfers = [t for t in transfers if normalize_tx_hash(t.tx_hash) not in used]
+        # Переводы начиная с since могли оплатить заказы, созданные за window до since
+        paid_orders = [
+            order for order in await get_unlinked_paid_orders(currency, since - self.window)
+            if order["wallet_address"] == address
+        ]
+
+        paid = 0
+        deliveries, volumes_counts = self.fulfillment()
+        for order, transfer, rule in match_transfers(orders, transfers, self.tolerance, self.window, paid_orders):
+            confirmed = await confirm_payment_by_transfer(
+                order["id"], normalize_tx_hash(transfer.tx_hash), currency, transfer.amount, rule,
+                order["tg_id"], deliveries.get(order["course_id"], []), volumes_counts.get(order["course_id"], 2)
+            )
+            if confirmed is None:
+                continue
+            paid += 1
+            PAYMENTS_MATCHED.inc((currency, rule))
+            logger.info("Order %s paid by %s (%s, %.2f USDT)", order["id"], transfer.tx_hash, rule, transfer.amount)
+            try:
+                await self.on_paid(confirmed, order["tg_id"])
+            except Exception:
+                logger.exception("Post-payment handling for order %s failed", order["id"])
+        return paid
+
+    async def _run(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,77 @@
+"""
+Token bucket лимитеры для исходящих запросов к Telegram.
+"""
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity за раз."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated_at", "paused_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def try_acquire(self, cost: float = 1.0) -> float:
+        """Списать cost токенов. Возвращает 0, либо сколько секунд подождать."""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    async def acquire(self, cost: float = 1.0):
+        """Дождаться и списать cost токенов."""
+        while (wait := self.try_acquire(cost)) > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Не выдавать токены ближайшие seconds секунд (например, после flood wait)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class KeyedRateLimiter:
+    """Отдельное ведро на каждый ключ (чат, пользователь); простаивающие вёдра удаляются."""
+
+    def __init__(self, rate: float, capacity: float, idle_ttl: float = 300.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.idle_ttl = idle_ttl
+        self._buckets: dict[int, TokenBucket] = {}
+        self._last_evict = time.monotonic()
+
+    def bucket(self, key: int) -> TokenBucket:
+        self._maybe_evict()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+        return bucket
+
+    def try_acquire(self, key: int, cost: float = 1.0) -> float:
+        return self.bucket(key).try_acquire(cost)
+
+    async def acquire(self, key: int, cost: float = 1.0):
+        await self.bucket(key).acquire(cost)
+
+    def _maybe_evict(self):
+        now = time.monotonic()
+        if now - self._last_evict < self.idle_ttl:
+            return
+        self._last_evict = now
+        cutoff = now - self.idle_ttl
+        # Ведро, простоявшее idle_ttl, уже полное: удалить его = создать заново
+        for key in [k for k, b in self._buckets.items() if b.updated_at < cutoff and b.paused_until < now]:
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
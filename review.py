@@ -0,0 +1,115 @@
+"""
+Очередь проверки оплат для админов (/review).
+
+Страница — до REVIEW_PAGE_SIZE заказов в статусе waiting_review по
+возрастанию id, следующая страница начинается после последнего id
+(keyset pagination). Выбор заказов для массового подтверждения хранится
+в самой клавиатуре сообщения (☐/☑), поэтому не зависит от процесса,
+который обработает нажатие.
+
+callback_data: rv:<действие>:<order_id>:<after_id>, где after_id —
+начало текущей страницы, чтобы после действия перерисовать её же.
+after_id = -1 у кнопок в уведомлении о новой оплате.
+"""
+
+import html
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from catalog import Catalog
+from models import ReviewOrder
+
+REVIEW_PAGE_SIZE = 8
+FROM_NOTIFICATION = -1
+UNCHECKED, CHECKED = "☐", "☑"
+# Сколько символов tx hash показывать админу: покупатель может прислать любой текст,
+# а подпись к фото ограничена 1024 символами, сообщение — 4096
+TX_HASH_PREVIEW = 120
+
+
+def _button(text: str, callback_data: str) -> InlineKeyboardButton:
+    return InlineKeyboardButton(text=text, callback_data=callback_data)
+
+
+def tx_hash_html(tx_hash: str) -> str:
+    """tx hash покупателя для HTML-сообщения: экранированный и обрезанный до TX_HASH_PREVIEW."""
+    if len(tx_hash) > TX_HASH_PREVIEW:
+        tx_hash = tx_hash[:TX_HASH_PREVIEW] + "…"
+    return f"<code>{html.escape(tx_hash)}</code>"
+
+
+def parse_review_data(callback_data: str) -> tuple[str, int, int]:
+    """rv:action:order_id:after_id -> (action, order_id, after_id)."""
+    _, action, order_id, after_id = callback_data.split(":")
+    return action, int(order_id), int(after_id)
+
+
+def order_actions_kb(order_id: int) -> InlineKeyboardMarkup:
+    """Кнопки под уведомлением о новой оплате."""
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        _button("✅ Подтвердить", f"rv:ok:{order_id}:{FROM_NOTIFICATION}"),
+        _button("❌ Отклонить", f"rv:no:{order_id}:{FROM_NOTIFICATION}"),
+    ]])
+
+
+def render_review_page(orders: list[ReviewOrder], total: int, after_id: int, has_more: bool,
+                       catalog: Catalog) -> tuple[str, InlineKeyboardMarkup]:
+    """Текст и клавиатура страницы очереди проверки."""
+    if not orders:
+        text = "🧾 <b>Очередь проверки пуста</b>" if total == 0 else f"🧾 <b>На проверке: {total}</b>\n\nДальше заказов нет."
+        rows = [[_button("🔄 Обновить", "rv:page:0:0")]]
+        return text, InlineKeyboardMarkup(inline_keyboard=rows)
+
+    lines = [f"🧾 <b>На проверке: {total}</b>\n"]
+    rows = []
+    for order in orders:
+        course = catalog.courses.get(order.course_id)
+        who = f"@{order.username}" if order.username else str(order.tg_id)
+        line = (
+            f"<b>#{order.id}</b> · {course.name if course else order.course_id}\n"
+            f"💵 {order.amount_usdt} USDT ({order.currency}) · 👤 {who} · {order.created_at}"
+        )
+        if order.tx_hash:
+            # tx hash — свободный текст покупателя
+            line += f"\n🔗 {tx_hash_html(order.tx_hash)}"
+        lines.append(line)
+        row = [_button(f"{UNCHECKED} #{order.id}", f"rv:sel:{order.id}:{after_id}")]
+        if order.proof_file_id:
+            row.append(_button("🧾", f"rv:proof:{order.id}:{after_id}"))
+        row += [_button("✅", f"rv:ok:{order.id}:{after_id}"), _button("❌", f"rv:no:{order.id}:{after_id}")]
+        rows.append(row)
+
+    rows.append([_button("✅ Подтвердить выбранные", f"rv:bulk:0:{after_id}")])
+    nav = []
+    if after_id > 0:
+        nav.append(_button("« В начало", "rv:page:0:0"))
+    nav.append(_button("🔄", f"rv:page:0:{after_id}"))
+    if has_more:
+        nav.append(_button("Далее »", f"rv:page:0:{orders[-1].id}"))
+    rows.append(nav)
+    return "\n\n".join(lines), InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def toggle_selection(markup: InlineKeyboardMarkup, order_id: int) -> InlineKeyboardMarkup:
+    """Клавиатура с переключённой отметкой заказа."""
+    rows = []
+    for row in markup.inline_keyboard:
+        new_row = []
+        for button in row:
+            if button.callback_data and button.callback_data.startswith(f"rv:sel:{order_id}:"):
+                mark = UNCHECKED if button.text.startswith(CHECKED) else CHECKED
+                button = _button(f"{mark} #{order_id}", button.callback_data)
+            new_row.append(button)
+        rows.append(new_row)
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def selected_order_ids(markup: InlineKeyboardMarkup | None) -> list[int]:
+    """Заказы, отмеченные в клавиатуре страницы."""
+    if markup is None:
+        return []
+    return [
+        parse_review_data(button.callback_data)[1]
+        for row in markup.inline_keyboard for button in row
+        if button.callback_data and button.callback_data.startswith("rv:sel:") and button.text.startswith(CHECKED)
+    ]
@@ -2,160 +2,988 @@
 Асинхронная работа с SQLite БД без SQLAlchemy.
 """
 
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
 import aiosqlite
-from datetime import datetime
-from models import OrderStatus
+from cache import LRUCache
+from metrics import STORAGE_SECONDS, timed
+from migrations import apply_migrations
+from models import OrderStatus, Order, ReviewOrder, Access, normalize_tx_hash
+
+logger = logging.getLogger(__name__)
 
 DB_PATH = "bot.db"
 
+# Один писатель (SQLite всё равно сериализует записи) и несколько читателей:
+# в режиме WAL чтения не блокируют запись и друг друга.
+READER_POOL_SIZE = 4
+# sqlite3 держит кэш подготовленных выражений на каждом соединении,
+# поэтому одинаковые SQL-строки на долгоживущих соединениях не парсятся повторно.
+STATEMENT_CACHE_SIZE = 256
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+)
+
+# tg_id -> users.id; id пользователя никогда не меняется, поэтому кэш не инвалидируется
+USER_CACHE_SIZE = 10_000
+# (user_id, course_id) -> есть ли доступ. Доступ меняют grant_access/approve_orders
+# (а в других процессах — журнал изменений, см. cluster.py), поэтому положительные
+# ответы живут до вытеснения, отрицательные — недолго.
+ACCESS_CACHE_SIZE = 50_000
+ACCESS_NEGATIVE_TTL = 30.0
+# last_seen копится в памяти и записывается одной транзакцией раз в N секунд
+LAST_SEEN_FLUSH_INTERVAL = 5.0
+
+
+# Запросы горячего пути. План каждого проверяется benchmarks/query_plans.py:
+# изменение запроса или схемы не должно приводить к полному сканированию таблицы.
+SQL_USER_ID_BY_TG = "SELECT id FROM users WHERE tg_id = ?"
+# MAX(id) по покрывающему индексу (user_id, status, id) вместо ORDER BY id: с IN по статусам
+# индекс не упорядочен по id, и ORDER BY требовал сортировки во временном B-дереве
+SQL_LAST_PENDING_ORDER = f"""
+    SELECT {", ".join(Order._fields)}
+    FROM orders
+    WHERE id = (SELECT MAX(id) FROM orders WHERE user_id = ? AND status IN (?, ?, ?))
+"""
+SQL_ACCESS_ID = "SELECT id FROM access WHERE user_id = ? AND course_id = ?"
+SQL_FILE_ID = "SELECT file_id FROM file_ids WHERE path = ? AND bot_id = ? AND content_hash = ?"
+SQL_FSM_RECORD = "SELECT state, data, updated_at FROM fsm_states WHERE key = ?"
+SQL_CLAIM_OUTBOX = """
+    SELECT id, chat_id, payload, attempts FROM outbox AS o
+    WHERE status = 'pending' AND next_attempt_at <= ?
+      AND id = (SELECT MIN(id) FROM outbox
+                WHERE chat_id = o.chat_id AND status IN ('pending', 'sending'))
+    ORDER BY next_attempt_at
+    LIMIT ?
+"""
+SQL_NEXT_OUTBOX_ATTEMPT = "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'"
+SQL_ORDERS_BY_STATUS = "SELECT status, COUNT(*) FROM orders GROUP BY status"
+SQL_STALE_ORDER_IDS = "SELECT id FROM orders WHERE status = ? AND created_at < ? LIMIT ?"
+SQL_OPEN_ORDERS_BY_CURRENCY = """
+    SELECT o.id, o.user_id, o.course_id, o.amount_usdt, o.currency, o.wallet_address, o.tx_hash, o.created_at, u.tg_id
+    FROM orders AS o JOIN users AS u ON u.id = o.user_id
+    WHERE o.status IN (?, ?, ?) AND o.currency = ?
+"""
+# Оплаченные заказы, для которых не известно, каким переводом они оплачены (подтверждены вручную)
+SQL_UNLINKED_PAID_ORDERS = """
+    SELECT o.id, o.user_id, o.course_id, o.amount_usdt, o.currency, o.wallet_address, o.tx_hash, o.created_at, u.tg_id
+    FROM orders AS o JOIN users AS u ON u.id = o.user_id
+    WHERE o.status = ? AND o.currency = ? AND o.created_at >= ?
+      AND NOT EXISTS (SELECT 1 FROM payment_transfers WHERE order_id = o.id)
+"""
+# Колонки в порядке полей ReviewOrder
+SQL_REVIEW_COLUMNS = """
+    SELECT o.id, o.user_id, o.course_id, o.amount_usdt, o.currency, o.tx_hash, o.proof_file_id, o.created_at,
+           u.tg_id, u.username
+    FROM orders AS o JOIN users AS u ON u.id = o.user_id
+"""
+SQL_REVIEW_PAGE = SQL_REVIEW_COLUMNS + """
+    WHERE o.status = ? AND o.id > ?
+    ORDER BY o.id
+    LIMIT ?
+"""
+SQL_REVIEW_ORDER = SQL_REVIEW_COLUMNS + "WHERE o.status = ? AND o.id = ?"
+SQL_BROADCAST_RECIPIENTS = "SELECT id, tg_id FROM users WHERE id > ? AND blocked_at IS NULL ORDER BY id LIMIT ?"
+SQL_FUNNEL_COUNTERS = "SELECT day, stage, currency, count, amount FROM funnel_counters WHERE day = '' OR day >= ?"
+# Пакетные выборки: список id передаётся одним JSON-параметром, поэтому SQL-строка одна
+# для любого размера пачки и берётся из кэша подготовленных выражений соединения
+SQL_ACCESS_FOR_USERS = (
+    f"SELECT {', '.join(Access._fields)} FROM access WHERE user_id IN (SELECT value FROM json_each(?))"
+)
+SQL_CHANGES_AFTER = "SELECT id, topic, key FROM changes WHERE id > ? ORDER BY id"
+SQL_INBOX_BY_SLOT = "SELECT id, body FROM inbox WHERE slot = ? ORDER BY id LIMIT ?"
+
+# name -> (sql, пример параметров, индекс, который должен использоваться)
+HOT_QUERIES = {
+    "user_id_by_tg": (SQL_USER_ID_BY_TG, (1,), "sqlite_autoindex_users_1"),
+    "last_pending_order": (
+        SQL_LAST_PENDING_ORDER,
+        (1, OrderStatus.PENDING, OrderStatus.WAITING_PROOF, OrderStatus.WAITING_REVIEW),
+        "idx_orders_user_status",
+    ),
+    "access_id": (SQL_ACCESS_ID, (1, 1), "sqlite_autoindex_access_1"),
+    "file_id": (SQL_FILE_ID, ("data/course1.pdf", 1, "hash"), "sqlite_autoindex_file_ids_1"),
+    "fsm_record": (SQL_FSM_RECORD, ("fsm:1:1:1:default",), "sqlite_autoindex_fsm_states_1"),
+    "claim_outbox": (SQL_CLAIM_OUTBOX, (0.0, 8), "idx_outbox_due"),
+    "next_outbox_attempt": (SQL_NEXT_OUTBOX_ATTEMPT, (), "idx_outbox_due"),
+    "stale_order_ids": (SQL_STALE_ORDER_IDS, (OrderStatus.PENDING, "2000-01-01 00:00:00", 500), "idx_orders_status_created"),
+    "open_orders_by_currency": (
+        SQL_OPEN_ORDERS_BY_CURRENCY,
+        (OrderStatus.PENDING, OrderStatus.WAITING_PROOF, OrderStatus.WAITING_REVIEW, "USDT_TRC20"),
+        "idx_orders_currency_status",
+    ),
+    # Оплаченных много, поэтому важен индекс по (status, created_at): окно — последние сутки
+    "unlinked_paid_orders": (
+        SQL_UNLINKED_PAID_ORDERS, (OrderStatus.PAID, "USDT_TRC20", "2099-01-01 00:00:00"), "idx_orders_status_created"
+    ),
+    "review_page": (SQL_REVIEW_PAGE, (OrderStatus.WAITING_REVIEW, 0, 11), "idx_orders_status_id"),
+    "review_order": (SQL_REVIEW_ORDER, (OrderStatus.WAITING_REVIEW, 1), "PRIMARY KEY"),
+    "broadcast_recipients": (SQL_BROADCAST_RECIPIENTS, (0, 200), "PRIMARY KEY"),
+    "funnel_counters": (SQL_FUNNEL_COUNTERS, ("2000-01-01",), "sqlite_autoindex_funnel_counters_1"),
+    "access_for_users": (SQL_ACCESS_FOR_USERS, ("[1, 2, 3]",), "sqlite_autoindex_access_1"),
+    "changes_after": (SQL_CHANGES_AFTER, (0,), "PRIMARY KEY"),
+    "inbox_by_slot": (SQL_INBOX_BY_SLOT, (0, 100), "idx_inbox_slot"),
+}
+
+# Шаги воронки в funnel_counters (см. миграцию 4)
+FUNNEL_STAGES = ("started", "chose_currency", "sent_proof", "paid")
+
+# Колонки в порядке полей моделей: строка превращается в запись через Model._make(row)
+ORDER_COLUMNS = ", ".join(Order._fields)
+ACCESS_COLUMNS = ", ".join(Access._fields)
+# Колонки SQL_OPEN_ORDERS_BY_CURRENCY и SQL_UNLINKED_PAID_ORDERS
+# Заказы, которые ещё можно оплатить переводом (get_open_orders и confirm_payment_by_transfer)
+OPEN_ORDER_STATUSES = (OrderStatus.PENDING, OrderStatus.WAITING_PROOF, OrderStatus.WAITING_REVIEW)
+OPEN_ORDER_COLUMNS = ("id", "user_id", "course_id", "amount_usdt", "currency", "wallet_address", "tx_hash", "created_at", "tg_id")
+
+
+class ConnectionPool:
+    """Долгоживущие соединения к БД: один сериализованный писатель и пул читателей."""
+
+    def __init__(self, path: str, readers: int = READER_POOL_SIZE):
+        self.path = path
+        self.readers_count = readers
+        self._writer: aiosqlite.Connection | None = None
+        self._write_lock = asyncio.Lock()
+        self._readers: asyncio.Queue | None = None
+        # Отдельное соединение только для PRAGMA data_version (счётчик привязан к соединению)
+        self._watcher: aiosqlite.Connection | None = None
+        self._connections: list[aiosqlite.Connection] = []
+
+    async def _connect(self, read_only: bool = False) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path, cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        if read_only:
+            await conn.execute("PRAGMA query_only = ON")
+        self._connections.append(conn)
+        return conn
+
+    async def open(self):
+        """Открыть соединения. Писатель открывается первым, чтобы включить WAL."""
+        self._writer = await self._connect()
+        self._readers = asyncio.Queue()
+        for _ in range(self.readers_count):
+            self._readers.put_nowait(await self._connect(read_only=True))
+        self._watcher = await self._connect(read_only=True)
+
+    async def close(self):
+        """Закрыть все соединения."""
+        for conn in self._connections:
+            await conn.close()
+        self._connections.clear()
+        self._writer = None
+        self._readers = None
+        self._watcher = None
+
+    async def data_version(self) -> int:
+        """Меняется, когда БД закоммитило любое другое соединение (в том числе из другого процесса)."""
+        return (await _fetchone(self._watcher, "PRAGMA data_version"))[0]
+
+    async def set_trace_callback(self, callback):
+        """Установить sqlite trace callback на все соединения (для подсчёта запросов)."""
+        for conn in self._connections:
+            await conn.set_trace_callback(callback)
+
+    @asynccontextmanager
+    async def read(self):
+        """Взять соединение-читатель из пула."""
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self):
+        """Эксклюзивный доступ к писателю; коммит при успехе, откат при ошибке."""
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            await self._writer.commit()
+
+
+# Время каждой публичной функции модуля попадает в /metrics
+_timed = timed(STORAGE_SECONDS)
+
+_pool: ConnectionPool | None = None
+_user_ids = LRUCache(USER_CACHE_SIZE)
+_last_seen: dict[int, str] = {}
+_access = LRUCache(ACCESS_CACHE_SIZE)
+# Растёт при каждой инвалидации: чтение из БД, начатое до неё, не попадёт в кэш
+_access_generation = 0
+_last_seen_task: asyncio.Task | None = None
+
+
+def get_pool() -> ConnectionPool:
+    """Текущий пул соединений (открывается в init_db)."""
+    if _pool is None:
+        raise RuntimeError("Database is not initialized, call init_db() first")
+    return _pool
+
+
+async def _fetchone(conn: aiosqlite.Connection, sql: str, params: tuple = ()):
+    # Курсор закрывается сразу, чтобы не держать снимок WAL открытым
+    async with conn.execute(sql, params) as cursor:
+        return await cursor.fetchone()
+
 
 async def init_db():
     """Инициализация БД."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                tg_id INTEGER UNIQUE NOT NULL,
-                username TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                last_seen TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                course_id INTEGER NOT NULL,
-                amount_usdt FLOAT NOT NULL,
-                currency TEXT NOT NULL,
-                status TEXT DEFAULT 'pending',
-                wallet_address TEXT NOT NULL,
-                tx_hash TEXT,
-                proof_file_id TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                paid_at TEXT,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS access (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                course_id INTEGER NOT NULL,
-                volumes_count INTEGER DEFAULT 2,
-                granted_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id),
-                UNIQUE(user_id, course_id)
+    global _pool, _last_seen_task
+    if _pool is None:
+        pool = ConnectionPool(DB_PATH)
+        await pool.open()
+        _pool = pool
+
+    async with get_pool().write() as db:
+        await apply_migrations(db)
+
+    if _last_seen_task is None:
+        _last_seen_task = asyncio.create_task(_last_seen_flusher())
+
+
+async def close_db():
+    """Закрыть соединения с БД."""
+    global _pool, _last_seen_task
+    if _last_seen_task is not None:
+        _last_seen_task.cancel()
+        try:
+            await _last_seen_task
+        except asyncio.CancelledError:
+            pass
+        _last_seen_task = None
+    if _pool is not None:
+        await flush_last_seen()
+        await _pool.close()
+        _pool = None
+    _user_ids.clear()
+    _access.clear()
+
+
+@_timed
+async def flush_last_seen() -> int:
+    """Записать накопленные last_seen одной транзакцией."""
+    global _last_seen
+    if not _last_seen:
+        return 0
+    pending, _last_seen = _last_seen, {}
+    try:
+        async with get_pool().write() as db:
+            await db.executemany(
+                # Пользователь снова пишет боту — значит, разблокировал его
+                "UPDATE users SET last_seen = ?, blocked_at = NULL WHERE tg_id = ?",
+                [(seen, tg_id) for tg_id, seen in pending.items()]
             )
-        """)
-        await db.commit()
+    except Exception:
+        # Вернуть в буфер, не затирая более свежие отметки
+        for tg_id, seen in pending.items():
+            _last_seen.setdefault(tg_id, seen)
+        raise
+    return len(pending)
 
 
+async def _last_seen_flusher():
+    while True:
+        await asyncio.sleep(LAST_SEEN_FLUSH_INTERVAL)
+        try:
+            await flush_last_seen()
+        except Exception:
+            logger.exception("Failed to flush last_seen")
+
+
+@_timed
 async def get_or_create_user(tg_id: int, username: str | None) -> dict:
     """Получить или создать пользователя."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("SELECT id FROM users WHERE tg_id = ?", (tg_id,))
-        row = await cursor.fetchone()
-        
+    user_id = _user_ids.get(tg_id)
+    if user_id is None:
+        async with get_pool().read() as db:
+            row = await _fetchone(db, SQL_USER_ID_BY_TG, (tg_id,))
         if row:
-            await db.execute(
-                "UPDATE users SET last_seen = ? WHERE tg_id = ?",
-                (datetime.utcnow().isoformat(), tg_id)
-            )
-            await db.commit()
-            return {"id": row[0], "tg_id": tg_id, "username": username}
-        
-        cursor = await db.execute(
-            "INSERT INTO users (tg_id, username) VALUES (?, ?)",
-            (tg_id, username)
-        )
-        await db.commit()
-        return {"id": cursor.lastrowid, "tg_id": tg_id, "username": username}
+            user_id = row[0]
+        else:
+            async with get_pool().write() as db:
+                # Пользователя мог создать параллельный апдейт, пока ждали писателя
+                row = await _fetchone(db, SQL_USER_ID_BY_TG, (tg_id,))
+                if row:
+                    user_id = row[0]
+                else:
+                    cursor = await db.execute(
+                        "INSERT INTO users (tg_id, username) VALUES (?, ?)",
+                        (tg_id, username)
+                    )
+                    user_id = cursor.lastrowid
+        _user_ids.set(tg_id, user_id)
 
+    _last_seen[tg_id] = datetime.utcnow().isoformat()
+    return {"id": user_id, "tg_id": tg_id, "username": username}
 
-async def create_order(user_id: int, course_id: int, amount_usdt: float, currency: str, wallet_address: str) -> dict:
-    """Создать заказ."""
-    async with aiosqlite.connect(DB_PATH) as db:
+
+@_timed
+async def create_order(user_id: int, course_id: int, amount_usdt: float, currency: str, wallet_address: str) -> Order:
+    """Создать заказ (created_at не перечитывается из БД и остаётся None)."""
+    async with get_pool().write() as db:
         cursor = await db.execute(
             """INSERT INTO orders (user_id, course_id, amount_usdt, currency, wallet_address, status)
                VALUES (?, ?, ?, ?, ?, ?)""",
             (user_id, course_id, amount_usdt, currency, wallet_address, OrderStatus.PENDING)
         )
-        await db.commit()
-        return {"id": cursor.lastrowid, "user_id": user_id, "status": OrderStatus.PENDING}
+    return Order(cursor.lastrowid, user_id, course_id, amount_usdt, currency, OrderStatus.PENDING, wallet_address,
+                 None, None, None, None)
 
 
-async def get_last_pending_order(user_id: int) -> dict | None:
+@_timed
+async def get_last_pending_order(user_id: int) -> Order | None:
     """Получить последний незавершённый заказ."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
-            """SELECT id, user_id, course_id, amount_usdt, currency, status, wallet_address, tx_hash, proof_file_id
-               FROM orders
-               WHERE user_id = ? AND status IN (?, ?, ?)
-               ORDER BY id DESC
-               LIMIT 1""",
+    async with get_pool().read() as db:
+        row = await _fetchone(
+            db,
+            SQL_LAST_PENDING_ORDER,
             (user_id, OrderStatus.PENDING, OrderStatus.WAITING_PROOF, OrderStatus.WAITING_REVIEW)
         )
-        row = await cursor.fetchone()
-        if row:
-            return {
-                "id": row[0],
-                "user_id": row[1],
-                "course_id": row[2],
-                "amount_usdt": row[3],
-                "currency": row[4],
-                "status": row[5],
-                "wallet_address": row[6],
-                "tx_hash": row[7],
-                "proof_file_id": row[8]
-            }
-        return None
+    return Order._make(row) if row else None
 
 
+@_timed
 async def grant_access(user_id: int, course_id: int, volumes_count: int = 2) -> bool:
     """Выдать доступ к курсу."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
-            "SELECT id FROM access WHERE user_id = ? AND course_id = ?",
+    async with get_pool().write() as db:
+        row = await _fetchone(
+            db,
+            SQL_ACCESS_ID,
             (user_id, course_id)
         )
-        if await cursor.fetchone():
-            return False
-        
-        await db.execute(
-            "INSERT INTO access (user_id, course_id, volumes_count) VALUES (?, ?, ?)",
-            (user_id, course_id, volumes_count)
-        )
-        await db.commit()
-        return True
+        if not row:
+            await db.execute(
+                "INSERT INTO access (user_id, course_id, volumes_count) VALUES (?, ?, ?)",
+                (user_id, course_id, volumes_count)
+            )
+    invalidate_access(user_id, course_id)
+    return row is None
+
+
+def invalidate_access(user_id: int, course_id: int):
+    """Сбросить закэшированный доступ (вызывать при любой выдаче или отзыве)."""
+    global _access_generation
+    _access_generation += 1
+    _access.pop((user_id, course_id))
 
 
+def access_cache_stats() -> dict:
+    """Счётчики попаданий/промахов кэша доступов."""
+    return _access.stats()
+
+
+@_timed
 async def user_has_access(user_id: int, course_id: int) -> bool:
     """Проверить, есть ли доступ к курсу."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
-            "SELECT id FROM access WHERE user_id = ? AND course_id = ?",
+    key = (user_id, course_id)
+    cached = _access.get(key)
+    if cached is not None:
+        return cached
+
+    generation = _access_generation
+    async with get_pool().read() as db:
+        row = await _fetchone(
+            db,
+            SQL_ACCESS_ID,
             (user_id, course_id)
         )
-        return await cursor.fetchone() is not None
+    has_access = row is not None
+    if generation == _access_generation:
+        _access.set(key, has_access, ttl=None if has_access else ACCESS_NEGATIVE_TTL)
+    return has_access
+
+
+@_timed
+async def get_access_for_users(user_ids: list[int]) -> list[Access]:
+    """Доступы списка пользователей одним запросом (в любом порядке)."""
+    if not user_ids:
+        return []
+    async with get_pool().read() as db:
+        async with db.execute(SQL_ACCESS_FOR_USERS, (json.dumps(user_ids),)) as cursor:
+            return list(map(Access._make, await cursor.fetchall()))
 
 
+@_timed
 async def update_order_status(order_id: int, status: str, tx_hash: str | None = None, proof_file_id: str | None = None):
     """Обновить статус заказа."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with get_pool().write() as db:
         await db.execute(
             """UPDATE orders SET status = ?, tx_hash = ?, proof_file_id = ?
                WHERE id = ?""",
             (status, tx_hash, proof_file_id, order_id)
         )
-        await db.commit()
 
 
-async def confirm_payment(order_id: int):
-    """Подтвердить оплату."""
-    async with aiosqlite.connect(DB_PATH) as db:
+@_timed
+async def count_orders_by_status() -> dict[str, int]:
+    """Число заказов в горячей таблице по статусам."""
+    async with get_pool().read() as db:
+        async with db.execute(SQL_ORDERS_BY_STATUS) as cursor:
+            return {status: count for status, count in await cursor.fetchall()}
+
+
+@_timed
+async def cancel_pending_order(order_id: int) -> bool:
+    """Отменить заказ, если он ещё не оплачен и чек не отправлен."""
+    async with get_pool().write() as db:
+        cursor = await db.execute(
+            "UPDATE orders SET status = ? WHERE id = ? AND status IN (?, ?)",
+            (OrderStatus.CANCELED, order_id, OrderStatus.PENDING, OrderStatus.WAITING_PROOF)
+        )
+        return cursor.rowcount == 1
+
+
+@_timed
+async def expire_stale_orders(status: str, cutoff: str, batch_size: int = 500) -> int:
+    """Отменить до batch_size заказов в статусе status, созданных раньше cutoff."""
+    async with get_pool().write() as db:
+        async with db.execute(SQL_STALE_ORDER_IDS, (status, cutoff, batch_size)) as cursor:
+            ids = [row[0] for row in await cursor.fetchall()]
+        if ids:
+            placeholders = ",".join("?" * len(ids))
+            await db.execute(
+                f"UPDATE orders SET status = ? WHERE id IN ({placeholders})",
+                (OrderStatus.CANCELED, *ids)
+            )
+    return len(ids)
+
+
+@_timed
+async def archive_orders(cutoff: str, batch_size: int = 500) -> int:
+    """Перенести до batch_size завершённых заказов старше cutoff в orders_archive."""
+    async with get_pool().write() as db:
+        ids = []
+        for status in (OrderStatus.PAID, OrderStatus.CANCELED):
+            async with db.execute(SQL_STALE_ORDER_IDS, (status, cutoff, batch_size - len(ids))) as cursor:
+                ids += [row[0] for row in await cursor.fetchall()]
+            if len(ids) >= batch_size:
+                break
+        if ids:
+            placeholders = ",".join("?" * len(ids))
+            await db.execute(
+                f"INSERT OR REPLACE INTO orders_archive ({ORDER_COLUMNS}) "
+                f"SELECT {ORDER_COLUMNS} FROM orders WHERE id IN ({placeholders})",
+                ids
+            )
+            await db.execute(f"DELETE FROM orders WHERE id IN ({placeholders})", ids)
+    return len(ids)
+
+
+@_timed
+async def get_open_orders(currency: str) -> list[dict]:
+    """Неоплаченные заказы в валюте currency вместе с tg_id покупателя."""
+    async with get_pool().read() as db:
+        async with db.execute(
+            SQL_OPEN_ORDERS_BY_CURRENCY,
+            (*OPEN_ORDER_STATUSES, currency)
+        ) as cursor:
+            rows = await cursor.fetchall()
+    return [dict(zip(OPEN_ORDER_COLUMNS, row)) for row in rows]
+
+
+@_timed
+async def get_unlinked_paid_orders(currency: str, since: float) -> list[dict]:
+    """Оплаченные без записи в payment_transfers заказы валюты, созданные не раньше since (unix time)."""
+    created_after = datetime.utcfromtimestamp(since).strftime("%Y-%m-%d %H:%M:%S")
+    async with get_pool().read() as db:
+        async with db.execute(SQL_UNLINKED_PAID_ORDERS, (OrderStatus.PAID, currency, created_after)) as cursor:
+            rows = await cursor.fetchall()
+    return [dict(zip(OPEN_ORDER_COLUMNS, row)) for row in rows]
+
+
+@_timed
+async def get_matched_transfers(tx_hashes: list[str]) -> set[str]:
+    """Какие из переводов уже засчитаны какому-то заказу."""
+    if not tx_hashes:
+        return set()
+    async with get_pool().read() as db:
+        async with db.execute(
+            f"SELECT tx_hash FROM payment_transfers WHERE tx_hash IN ({','.join('?' * len(tx_hashes))})",
+            tx_hashes
+        ) as cursor:
+            return {row[0] for row in await cursor.fetchall()}
+
+
+@_timed
+async def confirm_payment_by_transfer(order_id: int, tx_hash: str, currency: str, amount: float, rule: str,
+                                      chat_id: int, payloads: list[dict], volumes_count: int) -> Order | None:
+    """Засчитать перевод заказу одной транзакцией: статус paid, доступ к курсу и задания outbox.
+
+    None, если перевод уже засчитан другому заказу или заказ больше не открыт
+    (оплачен, отклонён админом или отменён по TTL после чтения get_open_orders).
+    """
+    async with get_pool().write() as db:
+        if await _fetchone(db, "SELECT 1 FROM payment_transfers WHERE tx_hash = ?", (tx_hash,)):
+            return None
+        cursor = await db.execute(
+            "UPDATE orders SET status = ?, paid_at = ?, tx_hash = ? WHERE id = ? AND status IN (?, ?, ?)",
+            (OrderStatus.PAID, datetime.utcnow().isoformat(), tx_hash, order_id, *OPEN_ORDER_STATUSES)
+        )
+        if cursor.rowcount != 1:
+            return None
+        await db.execute(
+            "INSERT INTO payment_transfers (tx_hash, order_id, currency, amount, rule) VALUES (?, ?, ?, ?, ?)",
+            (tx_hash, order_id, currency, amount, rule)
+        )
+        order = Order._make(await _fetchone(db, f"SELECT {ORDER_COLUMNS} FROM orders WHERE id = ?", (order_id,)))
         await db.execute(
+            "INSERT INTO access (user_id, course_id, volumes_count) VALUES (?, ?, ?) "
+            "ON CONFLICT (user_id, course_id) DO NOTHING",
+            (order.user_id, order.course_id, volumes_count)
+        )
+        await enqueue_outbox(chat_id, payloads, db=db)
+    invalidate_access(order.user_id, order.course_id)
+    return order
+
+
+@_timed
+async def get_review_page(after_id: int, limit: int) -> tuple[list[ReviewOrder], int]:
+    """Заказы на проверке после after_id (по возрастанию id) и их общее число."""
+    async with get_pool().read() as db:
+        async with db.execute(SQL_REVIEW_PAGE, (OrderStatus.WAITING_REVIEW, after_id, limit)) as cursor:
+            rows = await cursor.fetchall()
+        total = await _fetchone(db, "SELECT COUNT(*) FROM orders WHERE status = ?", (OrderStatus.WAITING_REVIEW,))
+    return list(map(ReviewOrder._make, rows)), total[0]
+
+
+@_timed
+async def get_review_order(order_id: int) -> ReviewOrder | None:
+    """Заказ на проверке по id (None, если его уже обработали)."""
+    async with get_pool().read() as db:
+        row = await _fetchone(db, SQL_REVIEW_ORDER, (OrderStatus.WAITING_REVIEW, order_id))
+    return ReviewOrder._make(row) if row else None
+
+
+@_timed
+async def approve_orders(order_ids: list[int], deliveries: dict[int, list[dict]],
+                         volumes_counts: dict[int, int],
+                         statuses: tuple[str, ...] = (OrderStatus.WAITING_REVIEW,)) -> list[ReviewOrder]:
+    """Подтвердить заказы в одном из statuses (по умолчанию — на проверке) одной транзакцией.
+
+    Для каждого заказа: статус paid, доступ к курсу и задания outbox из
+    deliveries[course_id]. Уже обработанные заказы пропускаются.
+    Возвращает подтверждённые заказы.
+    """
+    if not order_ids:
+        return []
+    async with get_pool().write() as db:
+        async with db.execute(
+            SQL_REVIEW_COLUMNS + "WHERE o.id IN (SELECT value FROM json_each(?)) "
+            "AND o.status IN (SELECT value FROM json_each(?))",
+            (json.dumps(order_ids), json.dumps(statuses))
+        ) as cursor:
+            orders = list(map(ReviewOrder._make, await cursor.fetchall()))
+        if not orders:
+            return []
+        paid_at = datetime.utcnow().isoformat()
+        await db.executemany(
             "UPDATE orders SET status = ?, paid_at = ? WHERE id = ?",
-            (OrderStatus.PAID, datetime.utcnow().isoformat(), order_id)
+            [(OrderStatus.PAID, paid_at, order.id) for order in orders]
+        )
+        await db.executemany(
+            "INSERT INTO access (user_id, course_id, volumes_count) VALUES (?, ?, ?) "
+            "ON CONFLICT (user_id, course_id) DO NOTHING",
+            [(order.user_id, order.course_id, volumes_counts.get(order.course_id, 2)) for order in orders]
+        )
+        # Присланный покупателем хэш больше не засчитается другому заказу (см. payments.py)
+        await db.executemany(
+            "INSERT OR IGNORE INTO payment_transfers (tx_hash, order_id, currency, amount, rule) VALUES (?, ?, ?, ?, 'manual')",
+            [(normalize_tx_hash(order.tx_hash), order.id, order.currency, order.amount_usdt)
+             for order in orders if order.tx_hash and order.tx_hash.strip()]
+        )
+        for order in orders:
+            await enqueue_outbox(order.tg_id, deliveries.get(order.course_id, []), db=db)
+    for order in orders:
+        invalidate_access(order.user_id, order.course_id)
+    return orders
+
+
+@_timed
+async def reject_order(order_id: int, notice: str) -> ReviewOrder | None:
+    """Отклонить заказ на проверке и поставить покупателю уведомление в outbox."""
+    async with get_pool().write() as db:
+        row = await _fetchone(db, SQL_REVIEW_ORDER, (OrderStatus.WAITING_REVIEW, order_id))
+        if row is None:
+            return None
+        order = ReviewOrder._make(row)
+        await db.execute("UPDATE orders SET status = ? WHERE id = ?", (OrderStatus.CANCELED, order_id))
+        await enqueue_outbox(order.tg_id, [{"kind": "message", "text": notice}], db=db)
+    return order
+
+
+@_timed
+async def get_funnel_stats(days: int = 7) -> dict:
+    """Воронка продаж из funnel_counters: итоги, выручка по валютам и последние days дней."""
+    since = (datetime.utcnow() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    async with get_pool().read() as db:
+        async with db.execute(SQL_FUNNEL_COUNTERS, (since,)) as cursor:
+            rows = await cursor.fetchall()
+    totals = dict.fromkeys(FUNNEL_STAGES, 0)
+    revenue: dict[str, float] = {}
+    daily: dict[str, dict[str, int]] = {}
+    for day, stage, currency, count, amount in rows:
+        counts = totals if day == "" else daily.setdefault(day, dict.fromkeys(FUNNEL_STAGES, 0))
+        counts[stage] = counts.get(stage, 0) + count
+        if day == "" and stage == "paid":
+            revenue[currency] = amount
+    return {
+        "totals": totals,
+        "revenue": revenue,
+        "daily": [{"day": day, **daily[day]} for day in sorted(daily, reverse=True)],
+    }
+
+
+@_timed
+async def get_file_id(path: str, content_hash: str, bot_id: int) -> str | None:
+    """Получить сохранённый file_id Telegram для файла с данным содержимым."""
+    async with get_pool().read() as db:
+        row = await _fetchone(
+            db,
+            SQL_FILE_ID,
+            (path, bot_id, content_hash)
+        )
+        return row[0] if row else None
+
+
+async def get_file_ids(bot_id: int) -> list[tuple[str, str, str]]:
+    """Все сохранённые file_id бота: (path, content_hash, file_id). Для прогрева при старте."""
+    async with get_pool().read() as db:
+        async with db.execute(
+            "SELECT path, content_hash, file_id FROM file_ids WHERE bot_id = ?", (bot_id,)
+        ) as cursor:
+            return await cursor.fetchall()
+
+
+@_timed
+async def save_file_id(path: str, content_hash: str, bot_id: int, file_id: str):
+    """Сохранить file_id после загрузки файла (заменяет запись для старого содержимого)."""
+    async with get_pool().write() as db:
+        await db.execute(
+            """INSERT OR REPLACE INTO file_ids (path, bot_id, content_hash, file_id, updated_at)
+               VALUES (?, ?, ?, ?, ?)""",
+            (path, bot_id, content_hash, file_id, datetime.utcnow().isoformat())
+        )
+
+
+@_timed
+async def delete_file_id(path: str, bot_id: int):
+    """Удалить file_id, который Telegram больше не принимает."""
+    async with get_pool().write() as db:
+        await db.execute("DELETE FROM file_ids WHERE path = ? AND bot_id = ?", (path, bot_id))
+
+
+@_timed
+async def load_fsm_record(key: str) -> tuple[str | None, str, float] | None:
+    """Прочитать состояние FSM: (state, data_json, updated_at)."""
+    async with get_pool().read() as db:
+        return await _fetchone(
+            db,
+            SQL_FSM_RECORD,
+            (key,)
+        )
+
+
+@_timed
+async def save_fsm_records(rows: list[tuple[str, str | None, str, float]], deleted_keys: list[str]):
+    """Записать пачку состояний FSM и удалить опустевшие одной транзакцией."""
+    async with get_pool().write() as db:
+        if rows:
+            await db.executemany(
+                "INSERT OR REPLACE INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)",
+                rows
+            )
+        if deleted_keys:
+            await db.executemany(
+                "DELETE FROM fsm_states WHERE key = ?",
+                [(key,) for key in deleted_keys]
+            )
+
+
+@_timed
+async def delete_expired_fsm_records(cutoff: float) -> int:
+    """Удалить состояния FSM, не менявшиеся с момента cutoff (unix time)."""
+    async with get_pool().write() as db:
+        cursor = await db.execute("DELETE FROM fsm_states WHERE updated_at < ?", (cutoff,))
+        return cursor.rowcount
+
+
+@_timed
+async def enqueue_outbox(chat_id: int, payloads: list[dict], db: aiosqlite.Connection | None = None):
+    """Поставить сообщения для чата в очередь отправки (в порядке списка).
+
+    Если передан db (соединение-писатель), вставка идёт в его текущей транзакции.
+    """
+    rows = [(chat_id, json.dumps(payload, ensure_ascii=False), time.time()) for payload in payloads]
+    sql = "INSERT INTO outbox (chat_id, payload, next_attempt_at) VALUES (?, ?, ?)"
+    if db is not None:
+        await db.executemany(sql, rows)
+        return
+    async with get_pool().write() as db:
+        await db.executemany(sql, rows)
+
+
+@_timed
+async def claim_outbox_jobs(limit: int) -> list[tuple[int, int, dict, int]]:
+    """Забрать готовые к отправке задания: (id, chat_id, payload, attempts).
+
+    Для каждого чата берётся только самое раннее незавершённое задание,
+    поэтому сообщения одному чату уходят строго по порядку.
+    """
+    async with get_pool().write() as db:
+        async with db.execute(
+            SQL_CLAIM_OUTBOX,
+            (time.time(), limit)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        if rows:
+            await db.executemany(
+                "UPDATE outbox SET status = 'sending' WHERE id = ?",
+                [(row[0],) for row in rows]
+            )
+    return [(row[0], row[1], json.loads(row[2]), row[3]) for row in rows]
+
+
+@_timed
+async def next_outbox_attempt_at() -> float | None:
+    """Время ближайшей запланированной отправки."""
+    async with get_pool().read() as db:
+        row = await _fetchone(db, SQL_NEXT_OUTBOX_ATTEMPT)
+        return row[0] if row else None
+
+
+@_timed
+async def complete_outbox_job(job_id: int):
+    """Удалить успешно отправленное задание."""
+    async with get_pool().write() as db:
+        await db.execute("DELETE FROM outbox WHERE id = ?", (job_id,))
+
+
+@_timed
+async def retry_outbox_job(job_id: int, delay: float, error: str):
+    """Вернуть задание в очередь с задержкой."""
+    async with get_pool().write() as db:
+        await db.execute(
+            """UPDATE outbox SET status = 'pending', attempts = attempts + 1, next_attempt_at = ?, last_error = ?
+               WHERE id = ?""",
+            (time.time() + delay, error, job_id)
+        )
+
+
+@_timed
+async def fail_outbox_job(job_id: int, error: str):
+    """Пометить задание как окончательно неудавшееся."""
+    async with get_pool().write() as db:
+        await db.execute(
+            "UPDATE outbox SET status = 'failed', attempts = attempts + 1, last_error = ? WHERE id = ?",
+            (error, job_id)
+        )
+
+
+@_timed
+async def reset_stuck_outbox_jobs() -> int:
+    """После перезапуска вернуть в очередь задания, которые отправлялись в момент остановки."""
+    async with get_pool().write() as db:
+        cursor = await db.execute("UPDATE outbox SET status = 'pending' WHERE status = 'sending'")
+        return cursor.rowcount
+
+
+@_timed
+async def release_outbox_jobs(job_ids: list[int]):
+    """Вернуть в очередь забранные, но не начатые задания (при остановке воркеров)."""
+    async with get_pool().write() as db:
+        await db.execute(
+            "UPDATE outbox SET status = 'pending' WHERE status = 'sending' AND id IN (SELECT value FROM json_each(?))",
+            (json.dumps(job_ids),)
+        )
+
+
+BROADCAST_COLUMNS = "id, text, status, created_by, last_user_id, sent, failed, blocked"
+
+
+def _broadcast_row(row) -> dict:
+    return dict(zip(BROADCAST_COLUMNS.split(", "), row))
+
+
+@_timed
+async def create_broadcast(text: str, created_by: int) -> dict:
+    """Создать рассылку всем пользователям."""
+    async with get_pool().write() as db:
+        cursor = await db.execute(
+            "INSERT INTO broadcasts (text, created_by) VALUES (?, ?)",
+            (text, created_by)
+        )
+        row = await _fetchone(db, f"SELECT {BROADCAST_COLUMNS} FROM broadcasts WHERE id = ?", (cursor.lastrowid,))
+    return _broadcast_row(row)
+
+
+@_timed
+async def get_running_broadcasts() -> list[dict]:
+    """Незавершённые рассылки (для продолжения после перезапуска)."""
+    async with get_pool().read() as db:
+        async with db.execute(
+            f"SELECT {BROADCAST_COLUMNS} FROM broadcasts WHERE status = 'running' ORDER BY id"
+        ) as cursor:
+            return [_broadcast_row(row) for row in await cursor.fetchall()]
+
+
+@_timed
+async def get_broadcast_recipients(after_user_id: int, limit: int) -> list[tuple[int, int]]:
+    """Следующая страница получателей (users.id, tg_id) после after_user_id."""
+    async with get_pool().read() as db:
+        async with db.execute(SQL_BROADCAST_RECIPIENTS, (after_user_id, limit)) as cursor:
+            return await cursor.fetchall()
+
+
+@_timed
+async def save_broadcast_progress(broadcast_id: int, last_user_id: int, sent: int, failed: int,
+                                  blocked_user_ids: list[int]) -> bool:
+    """Записать итоги страницы и отметить заблокировавших бота одной транзакцией.
+
+    Возвращает False, если рассылку тем временем остановили.
+    """
+    async with get_pool().write() as db:
+        if blocked_user_ids:
+            now = datetime.utcnow().isoformat()
+            await db.executemany(
+                "UPDATE users SET blocked_at = ? WHERE id = ?",
+                [(now, user_id) for user_id in blocked_user_ids]
+            )
+        cursor = await db.execute(
+            """UPDATE broadcasts
+               SET last_user_id = ?, sent = sent + ?, failed = failed + ?, blocked = blocked + ?
+               WHERE id = ? AND status = 'running'""",
+            (last_user_id, sent, failed, len(blocked_user_ids), broadcast_id)
+        )
+        return cursor.rowcount == 1
+
+
+@_timed
+async def finish_broadcast(broadcast_id: int, status: str = "done") -> dict | None:
+    """Завершить (done) или остановить (canceled) рассылку. None, если она уже не идёт."""
+    async with get_pool().write() as db:
+        cursor = await db.execute(
+            "UPDATE broadcasts SET status = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'running'",
+            (status, broadcast_id)
+        )
+        if cursor.rowcount != 1:
+            return None
+        row = await _fetchone(db, f"SELECT {BROADCAST_COLUMNS} FROM broadcasts WHERE id = ?", (broadcast_id,))
+    return _broadcast_row(row)
+
+
+@_timed
+async def publish_change(topic: str, key: str = ""):
+    """Записать изменение в журнал: другие процессы сбросят свои кэши (см. cluster.py)."""
+    async with get_pool().write() as db:
+        await db.execute("INSERT INTO changes (topic, key) VALUES (?, ?)", (topic, key))
+
+
+@_timed
+async def last_change_id() -> int:
+    """id последней записи журнала изменений (0, если журнал пуст)."""
+    async with get_pool().read() as db:
+        row = await _fetchone(db, "SELECT MAX(id) FROM changes")
+    return row[0] or 0
+
+
+@_timed
+async def get_changes(after_id: int) -> list[tuple[int, str, str]]:
+    """Записи журнала изменений после after_id: [(id, topic, key)]."""
+    async with get_pool().read() as db:
+        async with db.execute(SQL_CHANGES_AFTER, (after_id,)) as cursor:
+            return await cursor.fetchall()
+
+
+@_timed
+async def prune_changes(cutoff: str) -> int:
+    """Удалить записи журнала старше cutoff ('YYYY-MM-DD HH:MM:SS', UTC)."""
+    async with get_pool().write() as db:
+        cursor = await db.execute("DELETE FROM changes WHERE created_at < ?", (cutoff,))
+        return cursor.rowcount
+
+
+@_timed
+async def push_inbox(slot: int, body: str):
+    """Передать апдейт процессу, владеющему слотом."""
+    async with get_pool().write() as db:
+        await db.execute("INSERT INTO inbox (slot, body) VALUES (?, ?)", (slot, body))
+
+
+@_timed
+async def read_inbox(slots: list[int], limit: int = 500) -> dict[int, list[tuple[int, str]]]:
+    """Апдейты своих слотов в порядке поступления: slot -> [(id, body)]. Строки не удаляются."""
+    pending = {}
+    async with get_pool().read() as db:
+        for slot in slots:
+            async with db.execute(SQL_INBOX_BY_SLOT, (slot, limit)) as cursor:
+                rows = await cursor.fetchall()
+            if rows:
+                pending[slot] = rows
+    return pending
+
+
+@_timed
+async def delete_inbox(ids: list[int]):
+    """Удалить апдейты, принятые в очередь процесса."""
+    async with get_pool().write() as db:
+        await db.execute("DELETE FROM inbox WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(ids),))
+
+
+@_timed
+async def init_worker_slots(slots: int):
+    """Создать слоты 0..slots-1; апдейты лишних слотов (после уменьшения числа процессов) переложить."""
+    async with get_pool().write() as db:
+        await db.executemany("INSERT OR IGNORE INTO worker_slots (slot) VALUES (?)", [(slot,) for slot in range(slots)])
+        await db.execute("DELETE FROM worker_slots WHERE slot >= ?", (slots,))
+        await db.execute("UPDATE inbox SET slot = slot % ? WHERE slot >= ?", (slots, slots))
+
+
+@_timed
+async def renew_worker_slots(owner: str, ttl: float) -> list[int]:
+    """Продлить аренду своих слотов и занять не больше одного свободного. Возвращает свои слоты.
+
+    Процесс без слотов занимает свободный сразу, остальные — только если слот
+    простаивает дольше ttl: перезапущенный процесс успевает забрать свой слот обратно.
+    """
+    now = time.time()
+    async with get_pool().write() as db:
+        await db.execute("UPDATE worker_slots SET expires_at = ? WHERE owner = ?", (now + ttl, owner))
+        async with db.execute("SELECT slot FROM worker_slots WHERE owner = ? ORDER BY slot", (owner,)) as cursor:
+            owned = [slot for (slot,) in await cursor.fetchall()]
+        free_before = now if not owned else now - ttl
+        row = await _fetchone(
+            db,
+            "SELECT slot FROM worker_slots WHERE (owner IS NULL OR owner != ?) AND expires_at < ? ORDER BY slot LIMIT 1",
+            (owner, free_before)
+        )
+        if row:
+            await db.execute(
+                "UPDATE worker_slots SET owner = ?, expires_at = ? WHERE slot = ?",
+                (owner, now + ttl, row[0])
+            )
+            owned.append(row[0])
+    return sorted(owned)
+
+
+@_timed
+async def release_worker_slots(owner: str):
+    """Освободить слоты при остановке процесса."""
+    async with get_pool().write() as db:
+        await db.execute(
+            "UPDATE worker_slots SET owner = NULL, expires_at = ? WHERE owner = ?",
+            (time.time(), owner)
         )
-        await db.commit()
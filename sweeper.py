@@ -0,0 +1,85 @@
+"""
+Фоновая уборка заказов.
+
+Брошенные заказы (pending, waiting_proof, ...) отменяются по TTL своего
+статуса, а давно завершённые переносятся в orders_archive, чтобы горячая
+таблица orders и её индексы оставались маленькими. Заодно чистится
+журнал изменений для процессов вебхука (см. cluster.py).
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from storage import expire_stale_orders, archive_orders, prune_changes
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+# Процесс, отставший от журнала изменений сильнее, всё равно давно перезапущен
+CHANGES_RETENTION = timedelta(hours=1)
+
+
+def _cutoff(delta: timedelta) -> str:
+    # Формат совпадает с CURRENT_TIMESTAMP в orders.created_at
+    return (datetime.utcnow() - delta).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class OrderSweeper:
+    """Периодически отменяет устаревшие заказы и архивирует завершённые."""
+
+    def __init__(self, ttl_hours: dict[str, float], archive_after_days: float, interval: float = 600.0):
+        self.ttl_hours = ttl_hours
+        self.archive_after_days = archive_after_days
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def sweep(self) -> tuple[int, int]:
+        """Один проход: (отменено, заархивировано)."""
+        expired = 0
+        for status, hours in self.ttl_hours.items():
+            if hours <= 0:
+                continue
+            cutoff = _cutoff(timedelta(hours=hours))
+            # Небольшими транзакциями, чтобы не держать писателя надолго
+            while (n := await expire_stale_orders(status, cutoff, BATCH_SIZE)):
+                expired += n
+                if n < BATCH_SIZE:
+                    break
+                await asyncio.sleep(0)
+
+        archived = 0
+        if self.archive_after_days > 0:
+            cutoff = _cutoff(timedelta(days=self.archive_after_days))
+            while (n := await archive_orders(cutoff, BATCH_SIZE)):
+                archived += n
+                if n < BATCH_SIZE:
+                    break
+                await asyncio.sleep(0)
+
+        await prune_changes(_cutoff(CHANGES_RETENTION))
+
+        if expired or archived:
+            logger.info("Order sweep: %d expired, %d archived", expired, archived)
+        return expired, archived
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Order sweep failed")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,3 @@
+"""
+Тесты. Запуск из корня репозитория: python -m pytest tests
+"""
@@ -0,0 +1,27 @@
+import asyncio
+import os
+
+import pytest
+
+# bot.py читает конфиг при импорте
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("ADMIN_IDS", "1")
+for _wallet in ("USDT_TRC20_WALLET", "USDT_ERC20_WALLET", "BTC_WALLET", "ETH_WALLET"):
+    os.environ.setdefault(_wallet, f"test-{_wallet.lower()}")
+
+import storage  # noqa: E402
+
+
+@pytest.fixture
+def run_db(tmp_path):
+    """Выполнить корутину-сценарий на временной БД: run_db(scenario)."""
+    def run(scenario):
+        async def main():
+            storage.DB_PATH = str(tmp_path / "bot.db")
+            await storage.init_db()
+            try:
+                return await scenario()
+            finally:
+                await storage.close_db()
+        return asyncio.run(main())
+    return run
@@ -0,0 +1,92 @@
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+import storage
+from catalog import get_catalog
+
+BUYER = 500
+
+
+class FakeCallback:
+    """CallbackQuery с тем, что читают хендлеры: data, from_user, message.chat и answer()."""
+
+    def __init__(self, data: str, tg_id: int = BUYER):
+        self.data = data
+        self.from_user = SimpleNamespace(id=tg_id, username=None)
+        self.message = SimpleNamespace(chat=SimpleNamespace(id=tg_id))
+        self.bot = None
+        self.answers: list[tuple[str | None, bool]] = []
+
+    async def answer(self, text: str | None = None, show_alert: bool = False):
+        self.answers.append((text, show_alert))
+
+
+@pytest.fixture
+def sent(monkeypatch) -> list[str]:
+    volumes = []
+
+    async def send_volume(_bot, chat_id, volume):
+        volumes.append(volume.title)
+
+    monkeypatch.setattr(bot, "send_volume", send_volume)
+    return volumes
+
+
+async def grant(tg_id: int, course_id: int):
+    user = await storage.get_or_create_user(tg_id, None)
+    await storage.grant_access(user["id"], course_id)
+
+
+@pytest.mark.parametrize("handler, data", [
+    (bot.download_volume, "download_volume:{course}:1"),
+    (bot.download_volume, "download_volume_1"),
+    (bot.download_all_volumes, "download_all:{course}"),
+])
+def test_download_requires_access(run_db, sent, handler, data):
+    course_id = get_catalog().default_course_id
+    callback = FakeCallback(data.format(course=course_id))
+    run_db(lambda: handler(callback))
+    assert sent == []
+    assert callback.answers == [("Нет доступа.", True)]
+
+
+def test_download_volume_with_access(run_db, sent):
+    course_id = get_catalog().default_course_id
+    callback = FakeCallback(f"download_volume:{course_id}:1")
+
+    async def scenario():
+        await grant(BUYER, course_id)
+        await bot.download_volume(callback)
+
+    run_db(scenario)
+    assert sent == [get_catalog().courses[course_id].volumes[0].title]
+
+
+def test_download_volume_out_of_range(run_db, sent):
+    course_id = get_catalog().default_course_id
+    callback = FakeCallback(f"download_volume:{course_id}:99")
+
+    async def scenario():
+        await grant(BUYER, course_id)
+        await bot.download_volume(callback)
+
+    run_db(scenario)
+    assert sent == []
+    assert callback.answers == [("Нет доступа.", True)]
+
+
+def test_owned_course_ids(run_db):
+    catalog = get_catalog()
+    course_id = catalog.default_course_id
+
+    async def scenario():
+        user = await storage.get_or_create_user(BUYER, None)
+        before = await bot._owned_course_ids(user["id"], catalog)
+        await grant(BUYER, course_id)
+        # Доступ к курсу, которого нет в каталоге, не показывается
+        await grant(BUYER, 999)
+        return before, await bot._owned_course_ids(user["id"], catalog)
+
+    assert run_db(scenario) == ((), (course_id,))
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import os
+
+from aiohttp import web
+
+from capi import ConversionsSink
+
+UNREACHABLE = "http://127.0.0.1:9"
+
+
+class StandIn:
+    """Заглушка /{pixel_id}/events: первые fail_first запросов получают 503."""
+
+    def __init__(self, fail_first: int = 0):
+        self.fail_first = fail_first
+        self.requests = 0
+        self.batches: list[list[str]] = []
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self.requests <= self.fail_first:
+            return web.json_response({"error": "unavailable"}, status=503)
+        body = await request.json()
+        self.batches.append([event["event_id"] for event in body["data"]])
+        return web.json_response({"events_received": len(body["data"])})
+
+    async def start(self) -> tuple[web.AppRunner, str]:
+        app = web.Application()
+        app.router.add_post("/{pixel_id}/events", self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        return runner, f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+
+def sink(api_url: str, spill_path, **kwargs) -> ConversionsSink:
+    options = {"batch_size": 10, "flush_interval": 0.01, "timeout": 1.0, **kwargs}
+    return ConversionsSink("pixel", "token", api_url, str(spill_path), **options)
+
+
+def spilled_ids(spill_path) -> list[str]:
+    """event_id из spill-файла (по умолчанию — файла текущего процесса)."""
+    with open(spill_path, encoding="utf-8") as f:
+        return [event["event_id"] for line in f for event in json.loads(line)]
+
+
+def track(target: ConversionsSink, prefix: str, count: int):
+    for i in range(count):
+        target.track("Lead", i, event_id=f"{prefix}{i}")
+
+
+def test_outage_keeps_buffer_bounded(tmp_path):
+    spill_path = tmp_path / "spill.jsonl"
+
+    async def scenario():
+        target = sink(UNREACHABLE, spill_path, max_buffer=50)
+        await target.start()
+        track(target, "e", 300)
+        for _ in range(10):
+            # Не ждать паузу после ошибки: каждый цикл снова пытается отправить
+            target._retry_at = 0.0
+            await asyncio.sleep(0.02)
+        buffered = len(target._buffer)
+        spilled_during_outage = os.path.exists(target.spill_path)
+        await target.stop()
+        return buffered, spilled_during_outage, target.spill_path
+
+    buffered, spilled_during_outage, own_path = asyncio.run(scenario())
+    assert buffered == 50
+    assert not spilled_during_outage
+    assert spilled_ids(own_path) == [f"e{i}" for i in range(250, 300)]
+
+
+def test_spill_file_keeps_newest_events(tmp_path):
+    spill_path = tmp_path / "spill.jsonl"
+
+    async def scenario():
+        for prefix in ("a", "b"):
+            target = sink(UNREACHABLE, spill_path, max_buffer=30)
+            await target.start()
+            track(target, prefix, 20)
+            await target.stop()
+        return target.spill_path
+
+    own_path = asyncio.run(scenario())
+    assert spilled_ids(own_path) == [f"a{i}" for i in range(10, 20)] + [f"b{i}" for i in range(20)]
+
+
+def test_spilled_events_are_replayed_after_restart(tmp_path):
+    spill_path = tmp_path / "spill.jsonl"
+    stand_in = StandIn(fail_first=2)
+
+    async def scenario():
+        target = sink(UNREACHABLE, spill_path)
+        await target.start()
+        track(target, "old", 25)
+        await target.stop()
+        assert os.path.exists(target.spill_path)
+
+        runner, api_url = await stand_in.start()
+        try:
+            target = sink(api_url, spill_path)
+            await target.start()
+            track(target, "new", 25)
+            for _ in range(500):
+                delivered = {event_id for batch in stand_in.batches for event_id in batch}
+                if len(delivered) == 50 and not os.path.exists(target.spill_path):
+                    break
+                target._retry_at = 0.0
+                await asyncio.sleep(0.01)
+            await target.stop()
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+    delivered = {event_id for batch in stand_in.batches for event_id in batch}
+    assert delivered == {f"old{i}" for i in range(25)} | {f"new{i}" for i in range(25)}
+    assert max(len(batch) for batch in stand_in.batches) <= 10
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_rejected_events_are_not_retried(tmp_path):
+    spill_path = tmp_path / "spill.jsonl"
+    requests = []
+
+    async def reject(request: web.Request) -> web.Response:
+        requests.append(request)
+        return web.json_response({"error": "invalid token"}, status=400)
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_post("/{pixel_id}/events", reject)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        try:
+            target = sink(f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}", spill_path)
+            await target.start()
+            track(target, "e", 5)
+            await target.stop()
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+    assert len(requests) == 1
+    assert list(tmp_path.iterdir()) == []
+
+
+def write_spill(path, event_ids: list[str]):
+    path.write_text(json.dumps([{"event_name": "Lead", "event_id": event_id} for event_id in event_ids]) + "\n")
+
+
+def dead_pid() -> int:
+    pid = 2 ** 22 + 1
+    while True:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return pid
+        except PermissionError:
+            pass
+        pid += 1
+
+
+def test_start_adopts_spills_of_stopped_processes(tmp_path):
+    spill_path = tmp_path / "spill.jsonl"
+    # Общий файл прежней версии, файл завершившегося процесса и файл живого процесса
+    write_spill(spill_path, ["legacy"])
+    write_spill(tmp_path / f"spill.{dead_pid()}.jsonl", ["dead"])
+    alive = tmp_path / f"spill.{os.getppid()}.jsonl"
+    write_spill(alive, ["alive"])
+
+    async def scenario():
+        target = sink(UNREACHABLE, spill_path)
+        await target.start()
+        await target.stop()
+        return target.spill_path
+
+    own_path = asyncio.run(scenario())
+    assert sorted(spilled_ids(own_path)) == ["dead", "legacy"]
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted([os.path.basename(own_path), alive.name])
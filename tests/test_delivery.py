@@ -0,0 +1,161 @@
+import time
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+import pytest
+from aiohttp import web
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import FSInputFile
+
+import delivery
+import storage
+from catalog import Volume
+
+TOKEN = "123456:STUB"
+
+
+class StubServer:
+    """Минимальный telegram-bot-api: sendDocument загрузкой, ссылкой file:// (только local) и по file_id."""
+
+    def __init__(self, local: bool):
+        self.local = local
+        self.documents: list[str] = []
+        self.rejected_file_ids: set[str] = set()
+        self.missing_chats: set[int] = set()
+
+    def _error(self, code: int, description: str) -> web.Response:
+        return web.json_response({"ok": False, "error_code": code, "description": description}, status=code)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        if int(form["chat_id"]) in self.missing_chats:
+            return self._error(400, "Bad Request: chat not found")
+        document = form["document"]
+        if document.startswith("attach://"):
+            self.documents.append("upload")
+            file_id = f"uploaded-{len(self.documents)}"
+        elif document.startswith("file://"):
+            if not self.local:
+                return self._error(400, "Bad Request: wrong remote file identifier specified")
+            path = unquote(urlparse(document).path)
+            if not Path(path).is_file():
+                return self._error(400, "Bad Request: file not found")
+            self.documents.append(document)
+            file_id = f"local-{len(self.documents)}"
+        elif document in self.rejected_file_ids:
+            return self._error(400, "Bad Request: wrong file identifier/HTTP URL specified")
+        else:
+            self.documents.append(document)
+            file_id = document
+        return web.json_response({"ok": True, "result": {
+            "message_id": len(self.documents), "date": int(time.time()),
+            "chat": {"id": int(form["chat_id"]), "type": "private"},
+            "document": {"file_id": file_id, "file_unique_id": file_id},
+        }})
+
+
+@pytest.fixture(autouse=True)
+def clear_file_ids():
+    delivery._file_ids.clear()
+    delivery._hashes.clear()
+
+
+@pytest.fixture
+def volume(tmp_path) -> Volume:
+    path = tmp_path / "volume.pdf"
+    path.write_bytes(b"%PDF-1.4\n" + b"x" * 1024)
+    return Volume(1, "Том 1", "", str(path), "Том 1")
+
+
+async def send_to(stub: StubServer, volume: Volume, local: bool, chat_ids: list[int]) -> list[str]:
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", stub.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    api = TelegramAPIServer.from_base(f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}", is_local=local)
+    bot = Bot(TOKEN, session=AiohttpSession(api=api))
+    try:
+        return [(await delivery.send_volume(bot, chat_id, volume)).document.file_id for chat_id in chat_ids]
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+
+
+async def send_twice(stub: StubServer, volume: Volume, local: bool) -> list[str]:
+    return await send_to(stub, volume, local, [1, 1])
+
+
+def test_upload_source_local_server_uses_file_uri(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Path("volume.pdf").write_bytes(b"%PDF-1.4\n")
+    api = TelegramAPIServer.from_base("http://127.0.0.1:8081", is_local=True)
+    bot = Bot(TOKEN, session=AiohttpSession(api=api))
+    assert delivery.upload_source(bot, "volume.pdf") == (tmp_path / "volume.pdf").resolve().as_uri()
+
+
+def test_upload_source_cloud_uploads_content(tmp_path):
+    bot = Bot(TOKEN)
+    source = delivery.upload_source(bot, str(tmp_path / "volume.pdf"))
+    assert isinstance(source, FSInputFile)
+
+
+def test_local_server_sends_by_path_then_file_id(run_db, volume):
+    stub = StubServer(local=True)
+    file_ids = run_db(lambda: send_twice(stub, volume, local=True))
+    assert stub.documents == [Path(volume.pdf_path).resolve().as_uri(), file_ids[0]]
+    assert file_ids[1] == file_ids[0]
+
+
+def test_cloud_api_uploads_then_sends_file_id(run_db, volume):
+    stub = StubServer(local=False)
+    file_ids = run_db(lambda: send_twice(stub, volume, local=False))
+    assert stub.documents == ["upload", file_ids[0]]
+
+
+def test_file_id_is_persisted_for_restart(run_db, volume):
+    stub = StubServer(local=True)
+
+    async def scenario():
+        first, _ = await send_twice(stub, volume, local=True)
+        delivery._file_ids.clear()
+        content_hash = await delivery.file_hash(volume.pdf_path)
+        return first, await storage.get_file_id(volume.pdf_path, content_hash, 123456)
+
+    first, saved = run_db(scenario)
+    assert saved == first
+
+
+def test_rejected_file_id_is_uploaded_again(run_db, volume):
+    stub = StubServer(local=True)
+
+    async def scenario():
+        content_hash = await delivery.file_hash(volume.pdf_path)
+        await storage.save_file_id(volume.pdf_path, content_hash, 123456, "stale")
+        stub.rejected_file_ids.add("stale")
+        return await send_twice(stub, volume, local=True)
+
+    file_ids = run_db(scenario)
+    assert stub.documents == [Path(volume.pdf_path).resolve().as_uri(), file_ids[0]]
+    assert file_ids[0] != "stale"
+
+
+def test_other_bad_request_keeps_file_id(run_db, volume):
+    stub = StubServer(local=True)
+    stub.missing_chats.add(2)
+
+    async def scenario():
+        first, = await send_to(stub, volume, local=True, chat_ids=[1])
+        with pytest.raises(TelegramBadRequest):
+            await send_to(stub, volume, local=True, chat_ids=[2])
+        content_hash = await delivery.file_hash(volume.pdf_path)
+        return first, await storage.get_file_id(volume.pdf_path, content_hash, 123456)
+
+    first, saved = run_db(scenario)
+    # Один путь file:// — ошибка чата не привела к повторной загрузке
+    assert stub.documents == [Path(volume.pdf_path).resolve().as_uri()]
+    assert saved == first
@@ -0,0 +1,48 @@
+import asyncio
+from types import SimpleNamespace
+
+from middlewares import ThrottlingMiddleware
+
+ADMIN = 1
+BUYER = 500
+
+
+def tap(middleware: ThrottlingMiddleware, tg_id: int, data: str, times: int) -> tuple[int, list[str]]:
+    """Нажать кнопку times раз подряд: (сколько дошло до хендлера, ответы middleware)."""
+    handled = 0
+    answers = []
+
+    async def handler(event, data):
+        nonlocal handled
+        handled += 1
+
+    async def answer(text: str):
+        answers.append(text)
+
+    async def run():
+        for _ in range(times):
+            event = SimpleNamespace(from_user=SimpleNamespace(id=tg_id), data=data, answer=answer)
+            await middleware(handler, event, {})
+
+    asyncio.run(run())
+    return handled, answers
+
+
+def test_buyer_taps_are_throttled():
+    middleware = ThrottlingMiddleware(rate=0.001, burst=5, exempt_ids=[ADMIN])
+    handled, answers = tap(middleware, BUYER, "courses_info", 10)
+    assert handled == 5
+    assert len(answers) == 5
+
+
+def test_download_costs_more():
+    middleware = ThrottlingMiddleware(rate=0.001, burst=5)
+    handled, _ = tap(middleware, BUYER, "download_volume:1:1", 10)
+    assert handled == 2
+
+
+def test_admin_bulk_review_is_not_throttled():
+    middleware = ThrottlingMiddleware(rate=0.001, burst=5, exempt_ids=[ADMIN])
+    handled, answers = tap(middleware, ADMIN, "rv:t:1:0", 50)
+    assert handled == 50
+    assert answers == []
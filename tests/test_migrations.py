@@ -0,0 +1,65 @@
+import asyncio
+import sqlite3
+
+import aiosqlite
+
+import storage
+from migrations import MIGRATIONS, SCHEMA_VERSION, apply_migrations, get_schema_version
+
+
+def applied_versions(path) -> list[int]:
+    with sqlite3.connect(path) as conn:
+        return [row[0] for row in conn.execute("SELECT version FROM schema_version ORDER BY version")]
+
+
+def user_version(path) -> int:
+    with sqlite3.connect(path) as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def test_versions_are_sequential():
+    assert [version for version, _, _ in MIGRATIONS] == list(range(1, len(MIGRATIONS) + 1))
+
+
+def test_fresh_database_gets_all_migrations(run_db, tmp_path):
+    run_db(lambda: asyncio.sleep(0))
+    path = tmp_path / "bot.db"
+    assert applied_versions(path) == list(range(1, SCHEMA_VERSION + 1))
+    assert user_version(path) == SCHEMA_VERSION
+
+
+def test_restart_skips_applied_migrations(run_db, tmp_path):
+    run_db(lambda: asyncio.sleep(0))
+    run_db(lambda: asyncio.sleep(0))
+    assert applied_versions(tmp_path / "bot.db") == list(range(1, SCHEMA_VERSION + 1))
+
+
+def test_old_database_is_upgraded_with_data(run_db, tmp_path):
+    path = tmp_path / "bot.db"
+
+    async def legacy():
+        # База, мигрированная до версии 3 ещё без PRAGMA user_version
+        async with aiosqlite.connect(path) as db:
+            await get_schema_version(db)
+            for version, description, statements in MIGRATIONS[:3]:
+                for sql in statements:
+                    await db.execute(sql)
+                await db.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)", (version, description))
+            await db.execute("INSERT INTO users (tg_id) VALUES (42)")
+            await db.commit()
+
+    asyncio.run(legacy())
+    assert user_version(path) == 0
+
+    user = run_db(lambda: storage.get_or_create_user(42, None))
+    assert user["id"] == 1
+    assert applied_versions(path) == list(range(1, SCHEMA_VERSION + 1))
+    assert user_version(path) == SCHEMA_VERSION
+
+
+def test_apply_migrations_returns_current_version(tmp_path):
+    async def scenario():
+        async with aiosqlite.connect(tmp_path / "bot.db") as db:
+            return await apply_migrations(db), await apply_migrations(db)
+
+    assert asyncio.run(scenario()) == (SCHEMA_VERSION, SCHEMA_VERSION)
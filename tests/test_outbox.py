@@ -0,0 +1,93 @@
+import asyncio
+
+from aiogram.exceptions import TelegramEntityTooLarge
+from aiogram.methods import SendDocument
+
+import storage
+from outbox import Outbox
+
+CHAT = 1
+
+
+class FakeBot:
+    """send_message вызывает fail(), пока тот задан; иначе запоминает текст."""
+
+    def __init__(self, fail=None):
+        self.fail = fail
+        self.texts: list[str] = []
+
+    async def send_message(self, chat_id: int, text: str):
+        if self.fail is not None:
+            raise self.fail()
+        self.texts.append(text)
+
+
+async def outbox_rows() -> list[tuple[str, int]]:
+    async with storage.get_pool().read() as db:
+        async with db.execute("SELECT status, attempts FROM outbox ORDER BY id") as cursor:
+            return [tuple(row) for row in await cursor.fetchall()]
+
+
+async def process_first(outbox: Outbox):
+    job_id, chat_id, payload, attempts = (await storage.claim_outbox_jobs(1))[0]
+    await outbox._process(job_id, chat_id, payload, attempts)
+
+
+def test_unexpected_error_reschedules_job(run_db):
+    async def scenario():
+        outbox = Outbox(FakeBot(fail=lambda: RuntimeError("boom")), chat_rate=100)
+        await storage.enqueue_outbox(CHAT, [{"kind": "message", "text": "hi"}])
+        await process_first(outbox)
+        return await outbox_rows(), outbox.stats()
+
+    rows, stats = run_db(scenario)
+    assert rows == [("pending", 1)]
+    assert stats["retried"] == 1
+
+
+def test_file_too_large_fails_without_retry(run_db):
+    def too_large():
+        return TelegramEntityTooLarge(method=SendDocument(chat_id=CHAT, document="x"), message="Request Entity Too Large")
+
+    async def scenario():
+        outbox = Outbox(FakeBot(fail=too_large), chat_rate=100)
+        await storage.enqueue_outbox(CHAT, [{"kind": "message", "text": "hi"}])
+        await process_first(outbox)
+        return await outbox_rows()
+
+    assert run_db(scenario) == [("failed", 1)]
+
+
+def test_restart_does_not_send_claimed_jobs_twice(run_db):
+    bot = FakeBot()
+    blocked = asyncio.Event()
+
+    async def scenario():
+        outbox = Outbox(bot, workers=1, chat_rate=100)
+        send_message = bot.send_message
+
+        async def stuck(chat_id: int, text: str):
+            # Первая отправка зависает, остальные забранные задания ждут в очереди воркеров
+            blocked.set()
+            await asyncio.Event().wait()
+
+        bot.send_message = stuck
+        for chat_id in range(1, 4):
+            await storage.enqueue_outbox(chat_id, [{"kind": "message", "text": f"to {chat_id}"}])
+        await outbox.start()
+        await blocked.wait()
+        while outbox._jobs.qsize() < 2:
+            await asyncio.sleep(0.01)
+        await outbox.stop()
+
+        bot.send_message = send_message
+        await outbox.start()
+        for _ in range(200):
+            if not await outbox_rows():
+                break
+            await asyncio.sleep(0.01)
+        await outbox.stop()
+        return await outbox_rows()
+
+    assert run_db(scenario) == []
+    assert sorted(bot.texts) == ["to 1", "to 2", "to 3"]
@@ -0,0 +1,191 @@
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+import storage
+from models import OrderStatus
+from payments import ChainIndexer, FakeIndexer, PaymentWatcher, Transfer, load_indexer, match_transfers
+
+WALLET = "trc20-wallet"
+CREATED = "2024-05-01 12:00:00"
+CREATED_AT = datetime(2024, 5, 1, 12, tzinfo=timezone.utc).timestamp()
+HOUR = 3600.0
+
+
+def order(order_id: int, tx_hash: str | None = None, amount: float = 200.0, created_at: str = CREATED) -> dict:
+    return {
+        "id": order_id, "user_id": order_id, "course_id": 1, "amount_usdt": amount, "currency": "USDT_TRC20",
+        "wallet_address": WALLET, "tx_hash": tx_hash, "created_at": created_at, "tg_id": order_id,
+    }
+
+
+def transfer(tx_hash: str, amount: float = 200.0, after: float = 60.0) -> Transfer:
+    return Transfer(tx_hash, "USDT_TRC20", WALLET, amount, CREATED_AT + after)
+
+
+def matched(matches: list) -> dict[int, tuple[str, str]]:
+    return {order["id"]: (t.tx_hash, rule) for order, t, rule in matches}
+
+
+def match(orders, transfers, paid_orders=()):
+    return matched(match_transfers(orders, transfers, tolerance=0.5, window=24 * HOUR, paid_orders=paid_orders))
+
+
+def test_hash_match_ignores_case_and_prefix():
+    assert match([order(1, "0xABC123")], [transfer("abc123")]) == {1: ("abc123", "tx_hash")}
+
+
+def test_hash_match_rejects_underpayment():
+    assert match([order(1, "abc123")], [transfer("abc123", amount=150.0)]) == {}
+
+
+def test_hash_of_transfer_before_order_is_rejected():
+    # Покупатель прислал хэш чужого старого перевода на тот же кошелёк
+    assert match([order(1, "old")], [transfer("old", after=-HOUR)]) == {}
+
+
+def test_old_hash_does_not_fall_back_to_amount():
+    assert match([order(1, "old"), order(2)], [transfer("old", after=-HOUR)]) == {}
+
+
+def test_hash_of_paid_order_is_rejected():
+    paid = order(1, "0xSHARED")
+    assert match([order(2, "shared")], [transfer("shared")], paid_orders=[paid]) == {}
+
+
+def test_hash_of_paid_order_is_not_matched_by_amount():
+    paid = order(1, "shared")
+    assert match([order(2)], [transfer("shared")], paid_orders=[paid]) == {}
+
+
+def test_amount_match_in_window():
+    assert match([order(1)], [transfer("t1", amount=199.8)]) == {1: ("t1", "amount")}
+
+
+def test_amount_match_outside_window():
+    assert match([order(1)], [transfer("t1", after=25 * HOUR)]) == {}
+    assert match([order(1)], [transfer("t1", after=-60.0)]) == {}
+
+
+def test_ambiguous_amount_is_left_for_review():
+    assert match([order(1), order(2)], [transfer("t1")]) == {}
+
+
+def test_amount_competes_with_manually_paid_orders():
+    # Перевод мог оплатить заказ, подтверждённый вручную по чеку
+    assert match([order(2)], [transfer("t1")], paid_orders=[order(1)]) == {}
+
+
+def test_paid_order_outside_window_does_not_compete():
+    paid = order(1, created_at="2024-04-29 12:00:00")
+    assert match([order(2)], [transfer("t1")], paid_orders=[paid]) == {2: ("t1", "amount")}
+
+
+def test_hash_match_frees_transfer_for_other_orders():
+    orders = [order(1, "h1"), order(2)]
+    assert match(orders, [transfer("h1"), transfer("t2", after=120.0)]) == {
+        1: ("h1", "tx_hash"), 2: ("t2", "amount"),
+    }
+
+
+async def new_order(tg_id: int, tx_hash: str | None = None, proof: str | None = None) -> int:
+    user = await storage.get_or_create_user(tg_id, None)
+    created = await storage.create_order(user["id"], 1, 200, "USDT_TRC20", WALLET)
+    if tx_hash or proof:
+        await storage.update_order_status(created.id, OrderStatus.WAITING_REVIEW, tx_hash, proof)
+    return created.id
+
+
+def watcher(indexer: FakeIndexer, paid: list[int]) -> PaymentWatcher:
+    async def on_paid(paid_order, tg_id: int):
+        paid.append(paid_order.id)
+
+    def fulfillment():
+        return {1: [{"kind": "message", "text": "paid"}]}, {1: 1}
+
+    return PaymentWatcher(indexer, {"USDT_TRC20": WALLET}, on_paid, fulfillment, tolerance=0.5, window_hours=24)
+
+
+def test_watcher_grants_access_with_payment(run_db):
+    async def scenario():
+        indexer, paid = FakeIndexer(), []
+        order_id = await new_order(1, "0xABC")
+        indexer.add(Transfer("abc", "USDT_TRC20", WALLET, 200.0, time.time() + 60))
+        await watcher(indexer, paid).check()
+        user = await storage.get_or_create_user(1, None)
+        async with storage.get_pool().read() as db:
+            async with db.execute("SELECT COUNT(*) FROM outbox WHERE chat_id = 1") as cursor:
+                queued = (await cursor.fetchone())[0]
+        return paid, order_id, await storage.user_has_access(user["id"], 1), queued
+
+    paid, order_id, has_access, queued = run_db(scenario)
+    assert paid == [order_id]
+    assert has_access
+    assert queued == 1
+
+
+def test_watcher_uses_transfer_once(run_db):
+    async def scenario():
+        indexer, paid = FakeIndexer(), []
+        first = await new_order(1, "abc")
+        indexer.add(Transfer("abc", "USDT_TRC20", WALLET, 200.0, time.time() + 60))
+        await watcher(indexer, paid).check()
+        await new_order(2, "abc")
+        await watcher(indexer, paid).check()
+        return paid, first
+
+    paid, first = run_db(scenario)
+    assert paid == [first]
+
+
+def test_watcher_skips_hash_of_manually_approved_order(run_db):
+    async def scenario():
+        indexer, paid = FakeIndexer(), []
+        manual = await new_order(1, "0xMANUAL")
+        await storage.approve_orders([manual], {}, {})
+        await new_order(2, "manual")
+        indexer.add(Transfer("manual", "USDT_TRC20", WALLET, 200.0, time.time() + 60))
+        await watcher(indexer, paid).check()
+        return paid
+
+    assert run_db(scenario) == []
+
+
+def test_watcher_amount_competes_with_receipt_approval(run_db):
+    async def scenario():
+        indexer, paid = FakeIndexer(), []
+        by_receipt = await new_order(1, proof="photo")
+        await storage.approve_orders([by_receipt], {}, {})
+        await new_order(2)
+        indexer.add(Transfer("receipt", "USDT_TRC20", WALLET, 200.0, time.time() + 60))
+        await watcher(indexer, paid).check()
+        return paid
+
+    assert run_db(scenario) == []
+
+
+def test_confirm_skips_order_closed_after_read(run_db):
+    async def scenario():
+        order_id = await new_order(1, "abc")
+        open_orders = await storage.get_open_orders("USDT_TRC20")
+        await storage.reject_order(order_id, "rejected")
+        confirmed = await storage.confirm_payment_by_transfer(
+            order_id, "abc", "USDT_TRC20", 200.0, "tx_hash", 1, [{"kind": "message", "text": "paid"}], 1
+        )
+        user = await storage.get_or_create_user(1, None)
+        return [o["id"] for o in open_orders], confirmed, await storage.user_has_access(user["id"], 1), order_id
+
+    open_ids, confirmed, has_access, order_id = run_db(scenario)
+    assert open_ids == [order_id]
+    assert confirmed is None
+    assert not has_access
+
+
+class IncompleteIndexer(ChainIndexer):
+    pass
+
+
+def test_indexer_without_incoming_transfers_fails_on_load():
+    with pytest.raises(TypeError):
+        load_indexer(f"{__name__}:IncompleteIndexer")
@@ -0,0 +1,45 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import storage
+from models import OrderStatus
+
+ORDERS = 20_000
+USERS = 2_000
+
+
+@pytest.fixture(scope="module")
+def db_path(tmp_path_factory) -> str:
+    """БД со всеми миграциями и заказами разных статусов (без ANALYZE, как в проде после миграций)."""
+    path = str(tmp_path_factory.mktemp("plans") / "bot.db")
+    storage.DB_PATH = path
+
+    async def migrate():
+        await storage.init_db()
+        await storage.close_db()
+
+    asyncio.run(migrate())
+    statuses = (OrderStatus.PAID, OrderStatus.CANCELED, OrderStatus.PENDING, OrderStatus.WAITING_REVIEW)
+    with sqlite3.connect(path) as conn:
+        conn.executemany("INSERT INTO users (id, tg_id) VALUES (?, ?)", [(i, i) for i in range(1, USERS + 1)])
+        conn.executemany(
+            "INSERT INTO orders (user_id, course_id, amount_usdt, currency, status, wallet_address) "
+            "VALUES (?, 1, 200, 'USDT_TRC20', ?, 'w')",
+            [(i % USERS + 1, statuses[i % len(statuses)]) for i in range(ORDERS)]
+        )
+    return path
+
+
+@pytest.mark.parametrize("name", storage.HOT_QUERIES)
+def test_hot_query_plan(db_path, name):
+    sql, params, index = storage.HOT_QUERIES[name]
+    with sqlite3.connect(db_path) as conn:
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+    # Перебор CONSTANT ROW и json_each (списка id из параметра) — не скан таблицы
+    scans = [step for step in plan if step.startswith("SCAN ")
+             and "CONSTANT ROW" not in step and "json_each VIRTUAL TABLE" not in step]
+    assert scans == [], plan
+    assert [step for step in plan if "TEMP B-TREE" in step] == [], plan
+    assert any(index in step for step in plan), plan
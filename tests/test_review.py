@@ -0,0 +1,33 @@
+import html
+import re
+
+from catalog import get_catalog
+from models import ReviewOrder
+from review import REVIEW_PAGE_SIZE, TX_HASH_PREVIEW, render_review_page, tx_hash_html
+
+# Лимит Bot API на длину сообщения считается по тексту после разбора HTML
+MESSAGE_LIMIT = 4096
+
+
+def visible_length(text: str) -> int:
+    return len(html.unescape(re.sub(r"<[^>]+>", "", text)))
+
+
+def test_tx_hash_is_escaped():
+    assert tx_hash_html("<b>0xabc</b>") == "<code>&lt;b&gt;0xabc&lt;/b&gt;</code>"
+
+
+def test_long_tx_hash_is_truncated():
+    preview = tx_hash_html("a" * 5000)
+    assert preview == f"<code>{'a' * TX_HASH_PREVIEW}…</code>"
+
+
+def test_review_page_with_long_hashes_fits_message():
+    catalog = get_catalog()
+    orders = [
+        ReviewOrder(i, i, catalog.default_course_id, 200.0, "USDT_TRC20", "&" * 4000, None,
+                    "2024-05-01 12:00:00", 10_000 + i, "u" * 32)
+        for i in range(1, REVIEW_PAGE_SIZE + 1)
+    ]
+    text, _ = render_review_page(orders, 1000, 0, True, catalog)
+    assert visible_length(text) <= MESSAGE_LIMIT
@@ -0,0 +1,140 @@
+"""
+Очередь апдейтов вебхука с пулом воркеров.
+
+Вебхук кладёт апдейт в очередь и сразу отвечает Telegram. Каждый воркер
+владеет своей ограниченной очередью, а апдейты одного чата всегда
+попадают к одному и тому же воркеру, поэтому порядок внутри чата
+сохраняется.
+"""
+
+import asyncio
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from cache import RecentIds
+
+logger = logging.getLogger(__name__)
+
+
+def chat_key(update: Update) -> int:
+    """Ключ шардирования: id чата, иначе id пользователя, иначе update_id."""
+    try:
+        event = update.event
+    except Exception:
+        return update.update_id
+    chat = getattr(event, "chat", None)
+    if chat is None:
+        message = getattr(event, "message", None)
+        chat = getattr(message, "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user is not None else update.update_id
+
+
+class UpdateQueue:
+    """Ограниченная очередь апдейтов, которую разбирает пул воркеров."""
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        workers: int = 8,
+        maxsize: int = 1000,
+        enqueue_timeout: float = 5.0,
+        dedup_window: int = 10_000,
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.workers = workers
+        self.maxsize = maxsize
+        self.enqueue_timeout = enqueue_timeout
+        per_worker = max(1, maxsize // workers)
+        self._queues = [asyncio.Queue(maxsize=per_worker) for _ in range(workers)]
+        self._tasks: list[asyncio.Task] = []
+        # Telegram повторяет доставку при таймаутах: повторы отбрасываются по update_id
+        self._recent = RecentIds(dedup_window)
+        # Метрики backpressure
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.full_events = 0
+        self.rejected = 0
+        self.duplicates = 0
+        self.max_depth = 0
+
+    def start(self):
+        """Запустить воркеры."""
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(q)) for q in self._queues]
+
+    async def stop(self, timeout: float = 10.0):
+        """Дождаться обработки очереди (не дольше timeout) и остановить воркеры."""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Update queue not drained on shutdown, %d updates dropped", self.depth)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    async def submit(self, update: Update, wait: bool = True) -> bool:
+        """Поставить апдейт в очередь. False — очередь так и не освободилась.
+
+        wait=False — не ждать enqueue_timeout, а сразу вернуть False при полной очереди.
+        """
+        if not self._recent.add(update.update_id):
+            self.duplicates += 1
+            return True
+        queue = self._queues[chat_key(update) % self.workers]
+        try:
+            queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.full_events += 1
+            try:
+                if not wait:
+                    raise asyncio.TimeoutError
+                await asyncio.wait_for(queue.put(update), self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                # Забываем: повторная доставка этого апдейта должна пройти
+                self._recent.discard(update.update_id)
+                self.rejected += 1
+                return False
+        self.enqueued += 1
+        depth = self.depth
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            update = await queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                logger.exception("Failed to process update %s", update.update_id)
+            finally:
+                queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "capacity": sum(q.maxsize for q in self._queues),
+            "max_depth": self.max_depth,
+            "workers": self.workers,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "failed": self.failed,
+            "full_events": self.full_events,
+            "rejected": self.rejected,
+            "duplicates": self.duplicates,
+        }
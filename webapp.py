@@ -1,28 +1,163 @@
 """
 FastAPI сервер для Render.com вебхука Telegram.
+
+Холодный старт. Модуль импортирует только FastAPI и лёгкие модули, поэтому
+uvicorn открывает порт почти сразу. aiogram и bot.py (секунды CPU на
+построение pydantic-моделей) импортируются в потоке уже после открытия
+порта, затем warm_up() открывает БД (без DDL, если схема актуальна),
+запускает диспетчер, загружает каталог и file_id томов и открывает
+HTTP-сессию к Bot API. /ready отвечает 200 только после этого; апдейт,
+пришедший раньше, ждёт готовности до WEBHOOK_READY_TIMEOUT секунд.
+Длительность каждого этапа пишется в лог и отдаётся в /ready.
 """
 
 import asyncio
+import hmac
+import importlib
 import logging
+import time
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request
-from aiogram.types import Update
+from fastapi.responses import JSONResponse, PlainTextResponse
 
-from config import TELEGRAM_BOT_TOKEN, ADMIN_IDS
-from bot import dp, bot
-from storage import init_db
+from config import (
+    ADMIN_API_TOKEN, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_ENQUEUE_TIMEOUT, WEBHOOK_READY_TIMEOUT,
+    WEB_CONCURRENCY, CLUSTER_POLL_INTERVAL, CLUSTER_LEASE_TTL
+)
+import metrics
+from storage import init_db, close_db, count_orders_by_status, access_cache_stats, get_funnel_stats, invalidate_access
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Модули с aiogram: импортируются в warm_up(), а не при импорте webapp
+HEAVY_MODULES = ("aiogram.types", "bot", "cluster", "update_queue")
+# Сколько ждать getMe при прогреве HTTP-сессии; неудача не мешает готовности
+WARMUP_GET_ME_TIMEOUT = 5
+
+# Заполняются в warm_up()
+Update = bot = dp = outbox = update_queue = cluster = STATS_MAX_DAYS = None
+ready = asyncio.Event()
+warmup_timings: dict[str, float] = {}
+warmup_error: str | None = None
+_started = False
+
+ORDERS_BY_STATUS = metrics.gauge("bot_orders", "Orders in the hot table by status", ("status",))
+# Подсчёт заказов — запрос к БД, не чаще раза в ORDERS_METRIC_TTL секунд
+ORDERS_METRIC_TTL = 15.0
+_orders_counted_at = 0.0
+
+
+def _import_heavy_modules():
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
+
+
+def _build():
+    """Очередь вебхука, кластер и метрики поверх уже импортированного bot.py."""
+    global Update, bot, dp, outbox, update_queue, cluster, STATS_MAX_DAYS
+    from aiogram.types import Update
+    from bot import dp, bot, outbox, broadcaster, background_jobs, start_background_jobs, STATS_MAX_DAYS
+    from catalog import reload_catalog
+    from cluster import Cluster
+    from update_queue import UpdateQueue
+
+    update_queue = UpdateQueue(dp, bot, workers=WEBHOOK_WORKERS, maxsize=WEBHOOK_QUEUE_SIZE, enqueue_timeout=WEBHOOK_ENQUEUE_TIMEOUT)
+
+    # Несколько процессов uvicorn: апдейты чата — процессу-владельцу слота, кэши — по журналу изменений
+    if WEB_CONCURRENCY > 1:
+        cluster = Cluster(bot, update_queue, WEB_CONCURRENCY, poll_interval=CLUSTER_POLL_INTERVAL, lease_ttl=CLUSTER_LEASE_TTL)
+        cluster.on_change("access", lambda key: invalidate_access(*map(int, key.split(":"))))
+        cluster.on_change("catalog", lambda key: asyncio.to_thread(reload_catalog))
+        cluster.on_change("broadcast", lambda key: broadcaster.resume())
+        # Задания outbox могли добавить другие процессы
+        cluster.on_commit(outbox.notify)
+        for job in background_jobs:
+            cluster.leader_job(job)
+    else:
+        start_background_jobs(dp)
+
+    # Значения очередей читаются при сборе метрик, а не на каждом событии
+    metrics.gauge("bot_webhook_queue_depth", "Updates waiting in the webhook queue",
+                  function=lambda: update_queue.depth)
+    metrics.gauge("bot_webhook_queue_events", "Webhook queue counters", ("event",), function=lambda: {
+        (name,): update_queue.stats()[name]
+        for name in ("enqueued", "processed", "failed", "full_events", "rejected", "duplicates")
+    })
+    metrics.gauge("bot_outbox_jobs", "Outbox job counters since start", ("event",), function=lambda: {
+        (name,): value for name, value in outbox.stats().items()
+    })
+    metrics.gauge("bot_access_cache", "user_has_access cache counters", ("event",), function=lambda: {
+        (name,): value for name, value in access_cache_stats().items()
+    })
+
+
+async def _start():
+    global _started
+    _build()
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    _started = True
+    update_queue.start()
+    if cluster is not None:
+        await cluster.start()
+
+
+async def _warm_caches():
+    """Каталог, file_id и хэши PDF, HTTP-сессия к Bot API — до первого апдейта."""
+    from catalog import get_catalog
+    from delivery import warm_up as warm_up_delivery
+
+    catalog = get_catalog()
+    volumes = [volume for course in catalog.courses.values() for volume in course.volumes]
+    cached = await warm_up_delivery(bot, volumes)
+    logger.info("Volumes ready to send by file_id: %d of %d", cached, len(volumes))
+    try:
+        await bot.get_me(request_timeout=WARMUP_GET_ME_TIMEOUT)
+    except Exception as e:
+        logger.warning("Bot API warm-up request failed: %s", e)
+
+
+async def warm_up():
+    """Импорт, БД, диспетчер и кэши; по завершении /ready отвечает 200."""
+    global warmup_error
+    started = stage_started = time.perf_counter()
+    try:
+        for stage, step in (
+            ("imports", lambda: asyncio.to_thread(_import_heavy_modules)),
+            ("database", init_db),
+            ("startup", _start),
+            ("caches", _warm_caches),
+        ):
+            await step()
+            now = time.perf_counter()
+            warmup_timings[stage] = round(now - stage_started, 3)
+            stage_started = now
+    except Exception as e:
+        warmup_error = f"{type(e).__name__}: {e}"
+        logger.exception("Warm-up failed")
+        return
+    warmup_timings["total"] = round(time.perf_counter() - started, 3)
+    ready.set()
+    logger.info("Ready in %.2fs: %s", warmup_timings["total"], warmup_timings)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Инициализация при запуске."""
-    await init_db()
-    logger.info("Database initialized")
+    """Порт открывается сразу, прогрев идёт в фоне."""
+    warmup = asyncio.create_task(warm_up())
     yield
+    if not warmup.done():
+        warmup.cancel()
+        await asyncio.gather(warmup, return_exceptions=True)
+    if _started:
+        if cluster is not None:
+            await cluster.stop()
+        await update_queue.stop()
+        # Закрывает FSM-хранилище (сброс несохранённых состояний)
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
+    await close_db()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -31,22 +166,72 @@ app = FastAPI(lifespan=lifespan)
 @app.post("/telegram/webhook")
 async def telegram_webhook(request: Request):
     """Вебхук для Telegram."""
+    if not ready.is_set():
+        try:
+            await asyncio.wait_for(ready.wait(), WEBHOOK_READY_TIMEOUT)
+        except TimeoutError:
+            return JSONResponse({"ok": False, "error": "starting up"}, status_code=503)
     try:
-        update_data = await request.json()
-        update = Update.model_validate(update_data)
-        await dp.feed_update(bot, update)
-        return {"ok": True}
+        body = await request.body()
+        # Байты тела сразу в модель, без промежуточного dict
+        update = Update.model_validate_json(body, context={"bot": bot})
     except Exception as e:
         logger.error(f"Error: {e}")
         return {"ok": False, "error": str(e)}
+    if cluster is not None:
+        accepted = await cluster.route(update, body.decode())
+    else:
+        accepted = await update_queue.submit(update)
+    if not accepted:
+        # Очередь переполнена: Telegram повторит доставку позже
+        logger.warning("Update queue is full, rejecting update %s", update.update_id)
+        return JSONResponse({"ok": False, "error": "queue is full"}, status_code=503)
+    return {"ok": True}
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Метрики в текстовом формате Prometheus."""
+    global _orders_counted_at
+    if ready.is_set() and time.monotonic() - _orders_counted_at > ORDERS_METRIC_TTL:
+        _orders_counted_at = time.monotonic()
+        counts = await count_orders_by_status()
+        ORDERS_BY_STATUS.replace({(status,): count for status, count in counts.items()})
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/admin/stats")
+async def admin_stats(request: Request, days: int = 7):
+    """Воронка продаж и выручка (как /stats в боте)."""
+    token = request.headers.get("X-Admin-Token", "")
+    if not ADMIN_API_TOKEN or not hmac.compare_digest(token, ADMIN_API_TOKEN):
+        return JSONResponse({"ok": False, "error": "forbidden"}, status_code=403)
+    if not ready.is_set():
+        return JSONResponse({"ok": False, "error": "starting up"}, status_code=503)
+    return await get_funnel_stats(min(max(days, 1), STATS_MAX_DAYS))
 
 
 @app.get("/")
 async def health_check():
-    """Проверка здоровья сервера."""
-    return {"status": "ok", "message": "Bot is running"}
+    """Проверка здоровья сервера (процесс жив, даже если ещё прогревается)."""
+    status = {"status": "ok" if ready.is_set() else "starting", "message": "Bot is running"}
+    if update_queue is not None:
+        status["queue"] = update_queue.stats()
+    if cluster is not None:
+        status["cluster"] = cluster.stats()
+    return status
+
+
+@app.get("/ready")
+async def readiness():
+    """200 после прогрева, до этого 503 (для проверки готовности на хостинге)."""
+    if not ready.is_set():
+        status = {"ready": False, "error": warmup_error, "timings": warmup_timings}
+        return JSONResponse(status, status_code=503)
+    return {"ready": True, "timings": warmup_timings}
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Несколько процессов uvicorn запускает только по строке импорта
+    uvicorn.run("webapp:app", host="0.0.0.0", port=8000, workers=WEB_CONCURRENCY)